@@ -0,0 +1,225 @@
+# apps/async_engine.py
+import os
+import json
+import asyncio
+import logging
+from django.conf import settings
+from langchain_core.messages import HumanMessage
+from .llm_pool import get_async_llm
+from .concurrency import is_overload_error
+from .zip_archive import ZipArchive
+from .views import (
+    GEMINI_MODEL, get_prompt, parse_response_content, clean_extracted_items,
+    image_content_part, prepare_image, get_cached_result, build_items_result,
+    estimate_request_tokens, list_zip_images, update_progress, rate_limiter,
+    publish_image_results, is_large_archive
+)
+
+logger = logging.getLogger('apps')
+
+
+async def aextract_single_image(image_bytes, filename, image_path, cache_key, api_key, processing_type,
+                                request_deadline):
+    """Async version of extract_single_image with a per-request deadline"""
+    llm = get_async_llm(api_key, GEMINI_MODEL, request_timeout=request_deadline, max_retries=1)
+    prompt = get_prompt(processing_type)
+
+    message = HumanMessage(content=[
+        {"type": "text", "text": prompt},
+        image_content_part(image_bytes)
+    ])
+
+    last_error = None
+    overloaded = False
+    for attempt in range(2):
+        try:
+            await asyncio.to_thread(rate_limiter.acquire, api_key, estimate_request_tokens(prompt, 1))
+            response = await asyncio.wait_for(llm.ainvoke([message]), timeout=request_deadline)
+            data = parse_response_content(response.content)
+            items = clean_extracted_items(data, processing_type)
+            return build_items_result(items, filename, image_path, cache_key)
+
+        except json.JSONDecodeError as e:
+            last_error = f"Lỗi JSON: {str(e)}"
+            overloaded = False
+        except asyncio.TimeoutError:
+            last_error = f"Lỗi API: quá {request_deadline}s"
+            overloaded = True
+        except Exception as e:
+            last_error = f"Lỗi API: {str(e)}"
+            overloaded = is_overload_error(e)
+            if attempt < 1:
+                await asyncio.sleep(1)
+
+    return {
+        "success": False,
+        "data": [],
+        "filename": filename,
+        "error": last_error or "Thất bại",
+        "overloaded": overloaded
+    }
+
+
+async def aprocess_zip_entry(archive, entry, api_key, processing_type, session_id, semaphore, request_deadline):
+    """Read, prepare and extract one ZIP entry while holding a semaphore slot"""
+    async with semaphore:
+        try:
+            image_bytes = await asyncio.to_thread(archive.read, entry)
+            if len(image_bytes) == 0:
+                return None
+
+            cache_key, image_bytes, image_path = await asyncio.to_thread(
+                prepare_image, image_bytes, entry.filename, processing_type, session_id
+            )
+
+            cached_result = await asyncio.to_thread(
+                get_cached_result, cache_key, entry.filename, image_path, session_id
+            )
+            if cached_result:
+                return cached_result
+
+            return await aextract_single_image(
+                image_bytes, entry.filename, image_path, cache_key, api_key, processing_type,
+                request_deadline
+            )
+
+        except Exception as e:
+            logger.error(f"Error processing {entry.filename}: {e}")
+            return {"success": False, "data": [], "filename": entry.filename, "error": str(e)}
+
+
+async def aprocess_zip_file(zip_path, api_key, processing_type, session_id, max_images=None,
+                            concurrency=None, request_deadline=None, completed=None, job_deadline=None):
+    """Process ZIP file with images on one event loop.
+
+    Returns (all_data, image_results) like process_zip_file, skipping the
+    entries in `completed`. Images still running `job_deadline` seconds in
+    (30 per image by default) are cancelled and reported as timed out.
+
+    Experimental (OCR_EXTRACTION_ENGINE = 'asyncio'): one request per image
+    under a fixed semaphore, without OCR_LLM_BATCH_IMAGES batching or the
+    llm_limiter backoff the thread engine applies.
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, 'OCR_ASYNC_CONCURRENCY', 32)
+    if request_deadline is None:
+        request_deadline = getattr(settings, 'OCR_ASYNC_REQUEST_DEADLINE', 60)
+
+    all_data = []
+    processed_count = 0
+    image_results = []
+
+    try:
+        with ZipArchive(zip_path) as archive:
+            image_files = list_zip_images(archive, max_images)
+
+            total_images = len(image_files)
+            if total_images == 0:
+                return [], []
+
+            completed = completed or set()
+            processed_count = sum(1 for entry in image_files if entry.filename in completed)
+            if processed_count:
+                logger.info(f"Resuming: {processed_count}/{total_images} images already done")
+
+            large_archive = is_large_archive(total_images)
+            chunk_size = getattr(settings, 'OCR_MAX_BATCH_SIZE', 15) if large_archive else 1
+            pending_outcomes = []
+
+            logger.info(f"Processing {total_images} images (async, {concurrency} in flight)")
+            update_progress(session_id, processed_count, total_images, f"Xử lý {total_images} ảnh...")
+
+            semaphore = asyncio.Semaphore(concurrency)
+            task_to_filename = {}
+            for entry in image_files:
+                if entry.filename in completed:
+                    continue
+                if entry.file_size > 15 * 1024 * 1024:
+                    image_result = {
+                        'filename': entry.filename,
+                        'success': False,
+                        'error': 'File quá lớn',
+                        'data_count': 0
+                    }
+                    image_results.append(image_result)
+                    pending_outcomes.append((entry.filename, image_result, []))
+                    continue
+
+                task = asyncio.create_task(aprocess_zip_entry(
+                    archive, entry, api_key, processing_type, session_id, semaphore, request_deadline
+                ))
+                task_to_filename[task] = entry.filename
+
+            pending = set(task_to_filename)
+            job_end = asyncio.get_running_loop().time() + (job_deadline or total_images * 30)
+            while pending:
+                timeout = job_end - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result is None:
+                        continue
+                    processed_count += 1
+                    filename = result["filename"]
+
+                    image_result = {
+                        'filename': os.path.basename(filename),
+                        'success': result["success"],
+                        'data_count': len(result["data"]) if result["success"] else 0,
+                        'error': result.get("error") if not result["success"] else None
+                    }
+                    image_results.append(image_result)
+                    pending_outcomes.append((filename, image_result, result["data"] if result["success"] else []))
+                    if result["success"] and not large_archive:
+                        all_data.extend(result["data"])
+
+                    # One Redis round trip per image, or per chunk for large archives
+                    if len(pending_outcomes) < chunk_size and processed_count < total_images:
+                        continue
+                    await asyncio.to_thread(publish_image_results, session_id, pending_outcomes)
+                    pending_outcomes = []
+
+                    if large_archive:
+                        update_progress(session_id, processed_count, total_images,
+                                      f"Phần {-(-processed_count // chunk_size)}/{-(-total_images // chunk_size)}")
+                    elif result["success"]:
+                        update_progress(session_id, processed_count, total_images,
+                                      f"✓ {os.path.basename(filename)}")
+                    else:
+                        update_progress(session_id, processed_count, total_images,
+                                      f"✗ {os.path.basename(filename)}")
+
+            await asyncio.to_thread(publish_image_results, session_id, pending_outcomes)
+
+            # Cancel whatever is still running once the job deadline has passed
+            for task in pending:
+                task.cancel()
+                image_results.append({
+                    'filename': os.path.basename(task_to_filename[task]),
+                    'success': False,
+                    'error': 'Hết thời gian xử lý',
+                    'data_count': 0
+                })
+            if pending:
+                logger.warning(f"Cancelled {len(pending)} images after job deadline")
+                await asyncio.gather(*pending, return_exceptions=True)
+
+            success_count = sum(1 for r in image_results if r['success'])
+            logger.info(f"Completed: {success_count}/{len(image_results)} success")
+            update_progress(session_id, total_images, total_images,
+                          f"Xong! {success_count}/{len(image_results)} ảnh")
+
+            return all_data, image_results
+
+    except Exception as e:
+        logger.error(f"Error processing ZIP: {e}")
+        return [], []
+
+
+def run_zip_file_async(zip_path, api_key, processing_type, session_id, max_images=None, completed=None):
+    """Run aprocess_zip_file on a fresh event loop (one per Celery task)"""
+    return asyncio.run(aprocess_zip_file(zip_path, api_key, processing_type, session_id, max_images,
+                                         completed=completed))
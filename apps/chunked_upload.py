@@ -0,0 +1,183 @@
+# apps/chunked_upload.py
+import os
+import json
+import uuid
+import hashlib
+import logging
+
+logger = logging.getLogger('apps')
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Invalid chunked upload request; the message is shown to the user"""
+
+
+class ChunkedUploadStore:
+    """Resumable uploads written chunk by chunk straight into a file on disk.
+
+    Each chunk lands at its own offset of the upload's file (by default
+    `<upload_dir>/<upload_id>.part`), so chunks can arrive in any order and be
+    re-sent after an interruption. The upload state and the SHA-256 of each
+    verified chunk live in Redis; a chunk is only written once it matches its
+    digest, and a verified chunk is never overwritten with different bytes. Files of uploads whose state has expired without
+    complete() are deleted by purge_abandoned().
+    """
+
+    FILES_KEY = 'upload_files'
+
+    def __init__(self, redis_client, upload_dir, chunk_size=8 * 1024 * 1024, max_size=2 * 1024 ** 3,
+                 ttl=24 * 3600):
+        self.redis_client = redis_client
+        self.upload_dir = upload_dir
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.ttl = ttl
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.part")
+
+    def _chunk_count(self, size):
+        return max(1, -(-size // self.chunk_size))
+
+    def create(self, filename, size, owner, metadata, path=None):
+        """Start an upload and preallocate its file (at `path` if given); returns the upload state"""
+        if size <= 0:
+            raise UploadError('File rỗng')
+        if size > self.max_size:
+            raise UploadError(f'File quá lớn. Tối đa {self.max_size // (1024 * 1024)}MB')
+
+        upload_id = uuid.uuid4().hex
+        path = path or self._part_path(upload_id)
+        state = {
+            'upload_id': upload_id,
+            'path': path,
+            'filename': os.path.basename(filename),
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'chunk_count': self._chunk_count(size),
+            'owner': owner,
+            'metadata': metadata
+        }
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        self.redis_client.set(f"upload:{upload_id}", json.dumps(state), ex=self.ttl)
+        self.redis_client.hset(self.FILES_KEY, upload_id, json.dumps({'path': path, 'metadata': metadata}))
+        logger.info(f"Chunked upload {upload_id}: {state['filename']}, {size} bytes, "
+                    f"{state['chunk_count']} chunks")
+        return state
+
+    def get(self, upload_id, owner):
+        """Upload state with the verified chunk indexes, for resuming"""
+        data = self.redis_client.get(f"upload:{upload_id}")
+        if not data:
+            raise UploadError('Không tìm thấy phiên tải lên')
+        state = json.loads(data)
+        if state['owner'] != owner:
+            raise UploadError('Không tìm thấy phiên tải lên')
+        state['received'] = sorted(int(i) for i in self.redis_client.hkeys(f"upload_digests:{upload_id}"))
+        return state
+
+    def write_chunk(self, upload_id, owner, index, stream, length, sha256):
+        """Read one chunk from `stream`, verify length and SHA-256, then write it at its offset.
+
+        The chunk is held in memory (at most chunk_size bytes) until it is
+        verified. Re-sending a verified chunk is accepted only with the same
+        digest, and then leaves the file untouched.
+        """
+        state = self.get(upload_id, owner)
+        if not 0 <= index < state['chunk_count']:
+            raise UploadError('Số thứ tự phần không hợp lệ')
+
+        offset = index * state['chunk_size']
+        expected_length = min(state['chunk_size'], state['size'] - offset)
+        if length != expected_length:
+            raise UploadError(f'Kích thước phần sai: {length} thay vì {expected_length}')
+
+        chunk = bytearray()
+        while len(chunk) < expected_length:
+            data = stream.read(min(READ_SIZE, expected_length - len(chunk)))
+            if not data:
+                break
+            chunk += data
+
+        digest = hashlib.sha256(chunk).hexdigest()
+        if len(chunk) != expected_length or digest != (sha256 or '').lower():
+            raise UploadError('Checksum của phần không khớp, vui lòng gửi lại')
+
+        digests_key = f"upload_digests:{upload_id}"
+        verified = self.redis_client.hget(digests_key, index)
+        if verified is not None:
+            if verified.decode() != digest:
+                raise UploadError('Phần này đã được nhận với nội dung khác')
+            return state
+
+        fd = os.open(state['path'], os.O_WRONLY)
+        try:
+            os.pwrite(fd, chunk, offset)
+        finally:
+            os.close(fd)
+
+        pipe = self.redis_client.pipeline()
+        pipe.hsetnx(digests_key, index, digest)
+        pipe.hget(digests_key, index)
+        pipe.expire(digests_key, self.ttl)
+        pipe.expire(f"upload:{upload_id}", self.ttl)
+        _, verified, _, _ = pipe.execute()
+        if verified.decode() != digest:
+            # A concurrent send of different bytes won the digest, but either write may be on disk
+            self.redis_client.hdel(digests_key, index)
+            raise UploadError('Phần này đã được nhận với nội dung khác')
+        state['received'] = sorted(set(state['received']) | {index})
+        return state
+
+    def contiguous_bytes(self, state):
+        """Length of the verified prefix of the file (chunks 0..n without a gap)"""
+        received = set(state['received'])
+        count = 0
+        while count in received:
+            count += 1
+        return min(state['size'], count * state['chunk_size'])
+
+    def complete(self, upload_id, owner, target_path):
+        """Move the finished file to target_path once every chunk is verified"""
+        state = self.get(upload_id, owner)
+        missing = state['chunk_count'] - len(state['received'])
+        if missing:
+            raise UploadError(f'Còn thiếu {missing} phần')
+
+        if state['path'] != target_path:
+            os.replace(state['path'], target_path)
+        # Unlisted first: the file now belongs to processing, not to purge_abandoned
+        self.redis_client.hdel(self.FILES_KEY, upload_id)
+        self.redis_client.delete(f"upload:{upload_id}", f"upload_digests:{upload_id}")
+        logger.info(f"Chunked upload {upload_id} complete: {target_path}")
+        return state
+
+    def purge_abandoned(self):
+        """Delete the files of uploads whose state expired before complete().
+
+        Returns the metadata of each purged upload, so callers can release
+        what they attached to it.
+        """
+        purged = []
+        for upload_id, record in self.redis_client.hscan_iter(self.FILES_KEY):
+            upload_id = upload_id.decode()
+            if self.redis_client.exists(f"upload:{upload_id}"):
+                continue
+            record = json.loads(record)
+            try:
+                os.remove(record['path'])
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error removing abandoned upload {upload_id}: {e}")
+                continue
+            self.redis_client.delete(f"upload_digests:{upload_id}")
+            self.redis_client.hdel(self.FILES_KEY, upload_id)
+            purged.append(record['metadata'])
+            logger.info(f"Removed abandoned upload {upload_id}: {record['path']}")
+        return purged
@@ -0,0 +1,100 @@
+# apps/concurrency.py
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('apps')
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+OVERLOAD_STATUS_CODES = (429, 500, 502, 503, 504)
+OVERLOAD_EXCEPTIONS = (TimeoutError, asyncio.TimeoutError)
+if google_exceptions is not None:
+    OVERLOAD_EXCEPTIONS += (
+        google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError, google_exceptions.BadGateway,
+    )
+
+
+def is_overload_error(error):
+    """True if error means the API is rate limiting or overloaded.
+
+    Decided by exception type and HTTP status (`code` or `status_code`),
+    following the __cause__/__context__ chain so wrapped SDK errors count;
+    the message text is never looked at.
+    """
+    seen = set()
+    while isinstance(error, BaseException) and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, OVERLOAD_EXCEPTIONS):
+            return True
+        for attribute in ('code', 'status_code'):
+            code = getattr(error, attribute, None)
+            if isinstance(code, int) and code in OVERLOAD_STATUS_CODES:
+                return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class AIMDLimiter:
+    """Limit in-flight LLM requests with additive increase / multiplicative decrease.
+
+    The window grows by one request per window's worth of healthy responses and
+    is cut by `backoff` on 429/5xx, timeouts or responses slower than
+    `latency_target` seconds.
+    """
+
+    def __init__(self, initial=3, min_limit=1, max_limit=12, latency_target=20.0, backoff=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def window(self):
+        """Current number of requests allowed in flight"""
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.window:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency, error=None):
+        with self._condition:
+            self._in_flight -= 1
+            old_window = self.window
+            if (error is not None and is_overload_error(error)) or latency > self.latency_target:
+                self._limit = max(float(self.min_limit), self._limit * self.backoff)
+            elif error is None:
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / self.window)
+            if self.window != old_window:
+                logger.info(f"LLM concurrency window: {old_window} -> {self.window}")
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one in-flight slot for the duration of a request"""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.release(time.monotonic() - start, e)
+            raise
+        else:
+            self.release(time.monotonic() - start)
@@ -0,0 +1,64 @@
+# apps/date_normalizer.py
+import re
+import datetime
+import unicodedata
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+MEMO_SIZE = 4096
+
+# Day-month-year, year-month-day (ISO) or "ngày 5 tháng 3 năm 2000", in one pass.
+# Separators may be surrounded by stray spaces; accents may be missing after OCR.
+_SEP = r'\s*[/.\-]\s*|\s+'
+DATE_PATTERN = re.compile(rf"""
+    ^\s*(?:ng[aà]y\s*)?
+    (?:
+        (?P<d>\d{{1,2}})(?:{_SEP})(?P<m>\d{{1,2}})(?:{_SEP})(?P<y>\d{{4}}|\d{{2}})[\s.,;]*$
+      | (?P<iso_y>\d{{4}})\s*[/.\-]\s*(?P<iso_m>\d{{1,2}})\s*[/.\-]\s*(?P<iso_d>\d{{1,2}})[\s.,;]*$
+      | (?P<vn_d>\d{{1,2}})\s*th[aá]ng\s*(?P<vn_m>\d{{1,2}})\s*n[aă]m\s*(?P<vn_y>\d{{4}}|\d{{2}})
+    )
+""", re.IGNORECASE | re.VERBOSE)
+
+
+def expand_year(year):
+    """Four-digit year; two-digit years are taken as the latest year not in the future"""
+    if year >= 100:
+        return year
+    this_year = datetime.date.today().year
+    year += this_year // 100 * 100
+    return year - 100 if year > this_year else year
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _normalize(value):
+    match = DATE_PATTERN.match(unicodedata.normalize('NFC', value))
+    if not match:
+        return ""
+
+    groups = match.groupdict()
+    for prefix in ('', 'iso_', 'vn_'):
+        if groups[f'{prefix}d'] is not None:
+            day, month, year = (groups[f'{prefix}d'], groups[f'{prefix}m'], groups[f'{prefix}y'])
+            break
+
+    try:
+        date = datetime.date(expand_year(int(year)), int(month), int(day))
+    except ValueError:
+        return ""
+    return f"{date.day:02d}/{date.month:02d}/{date.year:04d}"
+
+
+def normalize_date(value):
+    """Date as dd/mm/yyyy, or "" if `value` is not a valid date in a supported form"""
+    if not isinstance(value, str):
+        return ""
+    return _normalize(value)
+
+
+def normalize_date_series(values):
+    """normalize_date over a pandas Series, normalizing each distinct value once"""
+    codes, uniques = pd.factorize(values)
+    # Missing values get code -1, which picks the trailing ""
+    normalized = np.array([normalize_date(value) for value in uniques] + [""], dtype=object)
+    return pd.Series(normalized[codes], index=values.index, name=values.name)
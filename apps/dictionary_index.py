@@ -0,0 +1,342 @@
+# apps/dictionary_index.py
+import os
+import re
+import sys
+import mmap
+import zlib
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+import unicodedata
+from array import array
+from collections import Counter
+
+logger = logging.getLogger('apps')
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+# Characters of each word that go into the deletion index
+PREFIX_LENGTH = 7
+
+# Compiled index file: header, then 8-byte aligned sections of native
+# 32-bit arrays (the fingerprint covers the byte order, so a file from
+# another architecture is rebuilt rather than misread)
+MAGIC = b'VIDICT\x00\x01'
+FORMAT_VERSION = 1
+SECTIONS = ('word_pool', 'word_offsets', 'counts', 'word_table', 'key_pool', 'key_offsets', 'key_table',
+            'posting_offsets', 'postings', 'bigram_table')
+HEADER = struct.Struct('<8sHH32s' + 'QQ' * len(SECTIONS))
+PAIR = struct.Struct('<II')
+
+
+def read_dictionary(paths):
+    """(word counts, bigrams) of the dictionary files, lowercase NFC.
+
+    A word's count is the number of entries it appears in; bigrams are the
+    adjacent word pairs of multi-word entries, as "word word".
+    """
+    counts = Counter()
+    bigrams = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                words = WORD_PATTERN.findall(unicodedata.normalize('NFC', line).lower())
+                counts.update(set(words))
+                bigrams.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return counts, bigrams
+
+
+def deletions(word, max_distance, prefix_length):
+    """Strings left after deleting up to max_distance characters from the word's prefix"""
+    prefix = word[:prefix_length]
+    found = {prefix}
+    frontier = [prefix]
+    for _ in range(max_distance):
+        next_frontier = []
+        for term in frontier:
+            if len(term) <= 1:
+                continue
+            for i in range(len(term)):
+                deleted = term[:i] + term[i + 1:]
+                if deleted not in found:
+                    found.add(deleted)
+                    next_frontier.append(deleted)
+        frontier = next_frontier
+    return found
+
+
+def build_deletes(words, max_distance, prefix_length):
+    """Deletion index: key -> word, or list of words, having that deletion"""
+    deletes = {}
+    for word in words:
+        for key in deletions(word, max_distance, prefix_length):
+            entry = deletes.get(key)
+            if entry is None:
+                deletes[key] = word
+            elif isinstance(entry, str):
+                deletes[key] = [entry, word]
+            else:
+                entry.append(word)
+    return deletes
+
+
+def source_fingerprint(paths, max_distance, prefix_length):
+    """SHA-256 of the word lists' contents and the index parameters"""
+    digest = hashlib.sha256(f"{FORMAT_VERSION} {sys.byteorder} {max_distance} {prefix_length}".encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.digest()
+
+
+def _table_size(count):
+    size = 8
+    while size < 2 * count:
+        size *= 2
+    return size
+
+
+def _string_table(strings):
+    """(pool, offsets, hash table) of UTF-8 strings; table slots hold index + 1, 0 when empty"""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('I', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    table = array('I', bytes(4 * _table_size(len(encoded))))
+    mask = len(table) - 1
+    for index, data in enumerate(encoded):
+        slot = zlib.crc32(data) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = index + 1
+    return b''.join(encoded), offsets, table
+
+
+def compile_dictionary(paths, target, max_distance, prefix_length=PREFIX_LENGTH):
+    """Write the compiled index of the word lists to `target`, atomically"""
+    fingerprint = source_fingerprint(paths, max_distance, prefix_length)
+    counts, bigrams = read_dictionary(paths)
+    words = sorted(counts)
+    word_numbers = {word: i for i, word in enumerate(words)}
+    word_pool, word_offsets, word_table = _string_table(words)
+
+    deletes = build_deletes(words, max_distance, prefix_length)
+    keys = sorted(deletes)
+    key_pool, key_offsets, key_table = _string_table(keys)
+    posting_offsets = array('I', [0])
+    postings = array('I')
+    for key in keys:
+        entry = deletes[key]
+        postings.extend(word_numbers[word] for word in ([entry] if isinstance(entry, str) else entry))
+        posting_offsets.append(len(postings))
+
+    # Slot pairs (first word + 1, second word)
+    bigram_table = array('I', bytes(8 * _table_size(len(bigrams))))
+    mask = len(bigram_table) // 2 - 1
+    for bigram in bigrams:
+        first, second = (word_numbers[word] for word in bigram.split(' '))
+        slot = zlib.crc32(PAIR.pack(first, second)) & mask
+        while bigram_table[2 * slot]:
+            slot = (slot + 1) & mask
+        bigram_table[2 * slot] = first + 1
+        bigram_table[2 * slot + 1] = second
+
+    sections = [word_pool, word_offsets.tobytes(), array('I', (counts[w] for w in words)).tobytes(),
+                word_table.tobytes(), key_pool, key_offsets.tobytes(), key_table.tobytes(),
+                posting_offsets.tobytes(), postings.tobytes(), bigram_table.tobytes()]
+    positions = []
+    offset = HEADER.size
+    for data in sections:
+        offset += -offset % 8
+        positions += [offset, len(data)]
+        offset += len(data)
+
+    directory = os.path.dirname(target) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, max_distance, prefix_length, fingerprint, *positions))
+            for position, data in zip(positions[::2], sections):
+                f.write(b'\0' * (position - f.tell()))
+                f.write(data)
+        # Readable by workers running as other users (mkstemp creates 0600)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logger.info(f"Compiled spelling dictionary {target}: {len(words)} words, {len(keys)} index keys, "
+                f"{len(bigrams)} bigrams, {offset} bytes")
+
+
+def read_header(path):
+    """(max_distance, prefix_length, fingerprint, positions) of an index file, or None if unreadable"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) != HEADER.size or header[:len(MAGIC)] != MAGIC:
+        return None
+    _, max_distance, prefix_length, fingerprint, *positions = HEADER.unpack(header)
+    return max_distance, prefix_length, fingerprint, positions
+
+
+def index_is_current(paths, index_path, max_distance, prefix_length=PREFIX_LENGTH):
+    header = read_header(index_path)
+    return header is not None and header[2] == source_fingerprint(paths, max_distance, prefix_length)
+
+
+def load_dictionary(paths, index_path, max_distance, prefix_length=PREFIX_LENGTH):
+    """CompiledDictionary of the word lists, compiling index_path first if it is missing or stale.
+
+    Processes starting together wait on a lock file instead of all compiling.
+    """
+    if not index_is_current(paths, index_path, max_distance, prefix_length):
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        with open(f"{index_path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not index_is_current(paths, index_path, max_distance, prefix_length):
+                    compile_dictionary(paths, index_path, max_distance, prefix_length)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    return CompiledDictionary(index_path)
+
+
+class CompiledDictionary:
+    """Read-only view of a compiled index through a shared mmap.
+
+    Nothing is parsed or copied at open: `counts`, `bigrams` and `deletes`
+    answer the same lookups as the dict, set and deletion index that
+    SpellingCorrector builds from the text files, by probing hash tables in
+    the mapped file. Every process mapping the file shares its pages.
+    """
+
+    def __init__(self, path):
+        header = read_header(path)
+        if header is None:
+            raise ValueError(f"Not a compiled dictionary: {path}")
+        self.path = path
+        self.max_distance, self.prefix_length, self.fingerprint, positions = header
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self._map)
+        views = {}
+        for name, offset, length in zip(SECTIONS, positions[::2], positions[1::2]):
+            view = data[offset:offset + length]
+            views[name] = view if name.endswith('_pool') else view.cast('I')
+        self._word_pool = views['word_pool']
+        self._word_offsets = views['word_offsets']
+        self._counts = views['counts']
+        self._word_table = views['word_table']
+        self._key_pool = views['key_pool']
+        self._key_offsets = views['key_offsets']
+        self._key_table = views['key_table']
+        self._posting_offsets = views['posting_offsets']
+        self._postings = views['postings']
+        self._bigram_table = views['bigram_table']
+
+        self.counts = _Counts(self)
+        self.bigrams = _Bigrams(self)
+        self.deletes = _Deletes(self)
+
+    @staticmethod
+    def _find(table, pool, offsets, data):
+        mask = len(table) - 1
+        slot = zlib.crc32(data) & mask
+        while True:
+            entry = table[slot]
+            if not entry:
+                return -1
+            if pool[offsets[entry - 1]:offsets[entry]] == data:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def word_number(self, word):
+        """Index of the word, or -1"""
+        return self._find(self._word_table, self._word_pool, self._word_offsets, word.encode('utf-8'))
+
+    def word(self, number):
+        return str(self._word_pool[self._word_offsets[number]:self._word_offsets[number + 1]], 'utf-8')
+
+    def count(self, number):
+        return self._counts[number]
+
+    def has_bigram(self, first, second):
+        table = self._bigram_table
+        mask = len(table) // 2 - 1
+        slot = zlib.crc32(PAIR.pack(first, second)) & mask
+        while table[2 * slot]:
+            if table[2 * slot] == first + 1 and table[2 * slot + 1] == second:
+                return True
+            slot = (slot + 1) & mask
+        return False
+
+    def key_words(self, key):
+        """Words indexed under a deletion key"""
+        number = self._find(self._key_table, self._key_pool, self._key_offsets, key.encode('utf-8'))
+        if number < 0:
+            return None
+        postings = self._postings[self._posting_offsets[number]:self._posting_offsets[number + 1]]
+        return [self.word(word_number) for word_number in postings]
+
+    def close(self):
+        for name in ('_word_pool', '_word_offsets', '_counts', '_word_table', '_key_pool', '_key_offsets',
+                     '_key_table', '_posting_offsets', '_postings', '_bigram_table'):
+            getattr(self, name).release()
+        self._map.close()
+
+
+class _Counts:
+    """word -> count, like the dict read_dictionary returns"""
+
+    def __init__(self, compiled):
+        self._compiled = compiled
+
+    def get(self, word, default=None):
+        number = self._compiled.word_number(word)
+        return default if number < 0 else self._compiled.count(number)
+
+    def __getitem__(self, word):
+        count = self.get(word)
+        if count is None:
+            raise KeyError(word)
+        return count
+
+    def __contains__(self, word):
+        return self._compiled.word_number(word) >= 0
+
+    def __len__(self):
+        return len(self._compiled._counts)
+
+
+class _Bigrams:
+    """Membership of "word word" strings, like the set read_dictionary returns"""
+
+    def __init__(self, compiled):
+        self._compiled = compiled
+
+    def __contains__(self, bigram):
+        first, _, second = bigram.partition(' ')
+        first, second = self._compiled.word_number(first), self._compiled.word_number(second)
+        return first >= 0 and second >= 0 and self._compiled.has_bigram(first, second)
+
+
+class _Deletes:
+    """Deletion key -> list of words, like build_deletes"""
+
+    def __init__(self, compiled):
+        self._compiled = compiled
+
+    def get(self, key, default=None):
+        words = self._compiled.key_words(key)
+        return default if words is None else words
+
+    def __len__(self):
+        return len(self._compiled._key_offsets) - 1
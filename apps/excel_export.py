@@ -0,0 +1,124 @@
+# apps/excel_export.py
+import os
+import glob
+import time
+import logging
+import tempfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+logger = logging.getLogger('apps')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Same look as the header row written by DataFrame.to_excel
+_THIN = Side(style='thin')
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+def write_xlsx(target, columns, rows, start_row=0, column_formats=None, sheet_name='Sheet1'):
+    """Write a one-sheet workbook to `target` in openpyxl's write-only mode.
+
+    `rows` is any iterable of value lists in column order and is consumed
+    once, so memory does not grow with the row count. None cells are left
+    out of the sheet. `column_formats` maps column names to the number
+    format of their data cells; `start_row` blank rows precede the header.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    for _ in range(start_row):
+        sheet.append([])
+
+    header = []
+    for column in columns:
+        cell = WriteOnlyCell(sheet, column)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        header.append(cell)
+    sheet.append(header)
+
+    column_formats = column_formats or {}
+    formats = [(i, column_formats[column]) for i, column in enumerate(columns) if column in column_formats]
+    for row in rows:
+        values = list(row)
+        for i, number_format in formats:
+            cell = WriteOnlyCell(sheet, values[i])
+            cell.number_format = number_format
+            values[i] = cell
+        sheet.append(values)
+
+    workbook.save(target)
+
+
+class ExportCache:
+    """Generated exports kept on disk, one file per session and data version.
+
+    A download for a version already built is served from its file; building
+    a new version removes the session's older files. Files not downloaded for
+    `max_age` seconds (the row store TTL: their session has expired) are
+    removed whenever an export is built.
+    """
+
+    def __init__(self, directory, max_age=None):
+        self.directory = directory
+        self.max_age = max_age
+
+    def path(self, session_id, version):
+        return os.path.join(self.directory, f"{session_id}_v{version}.xlsx")
+
+    def get_or_build(self, session_id, version, build):
+        """Path of the export for `version`, calling build(file) to write it if missing"""
+        path = self.path(session_id, version)
+        if os.path.exists(path):
+            try:
+                # Served files stay as long as their session is in use
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                build(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        for old_path in glob.glob(os.path.join(self.directory, f"{session_id}_v*.xlsx")):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        logger.info(f"Built export {os.path.basename(path)}")
+        if self.max_age:
+            self.prune()
+        return path
+
+    def prune(self):
+        """Remove exports (and leftover temp files) not used for max_age seconds; returns the count"""
+        cutoff = time.time() - self.max_age
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith(('.xlsx', '.tmp')):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info(f"Removed {removed} expired exports")
+        return removed
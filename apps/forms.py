@@ -87,4 +87,19 @@ class UploadZipForm(forms.Form):
         api_key = self.cleaned_data['api_key'].strip()
         if len(api_key) < 10:
             raise forms.ValidationError('API key không hợp lệ.')
-        return api_key
\ No newline at end of file
+        return api_key
+
+class ChunkedUploadInitForm(forms.Form):
+    """Fields sent when starting a chunked upload (the ZIP itself follows in parts)"""
+    filename = forms.CharField(max_length=255)
+    size = forms.IntegerField(min_value=1)
+    processing_type = forms.ChoiceField(choices=UploadZipForm.PROCESSING_CHOICES)
+    excel_filename = forms.CharField(max_length=100, required=False)
+    
+    def clean_filename(self):
+        filename = self.cleaned_data['filename']
+        if not filename.lower().endswith('.zip'):
+            raise forms.ValidationError('Vui lòng tải lên file ZIP.')
+        return filename
+    
+    clean_excel_filename = UploadZipForm.clean_excel_filename
\ No newline at end of file
@@ -0,0 +1,231 @@
+# apps/imaging.py
+import io
+import os
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('apps')
+
+# Formats the API accepts as they are
+UPLOAD_FORMATS = ('JPEG', 'PNG', 'WEBP')
+QUALITY_STEPS = (85, 75, 65, 55)
+ORIENTATION_TAG = 0x0112
+
+
+def physical_cpu_count():
+    """Number of physical cores (logical count if /proc/cpuinfo is unavailable)"""
+    try:
+        cores = set()
+        physical_id = None
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('physical id'):
+                    physical_id = line.split(':')[1].strip()
+                elif line.startswith('core id'):
+                    cores.add((physical_id, line.split(':')[1].strip()))
+        if cores:
+            return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+
+def image_mime_type(image_bytes):
+    """Detect MIME type from the image header; application/octet-stream if unrecognized"""
+    if image_bytes[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    if image_bytes[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if image_bytes[:2] == b'BM':
+        return 'image/bmp'
+    return 'application/octet-stream'
+
+
+def encode_within_budget(image, image_format, byte_budget):
+    """Encode at the highest quality step that fits byte_budget, else the smallest result"""
+    # One buffer is reused for every attempt; only the chosen encoding is copied out
+    output = io.BytesIO()
+    best_quality = None
+    best_size = None
+    for quality in QUALITY_STEPS:
+        output.seek(0)
+        output.truncate()
+        _save_encoded(image, output, image_format, quality)
+        size = output.tell()
+        if size <= byte_budget:
+            return output.getvalue()
+        if best_size is None or size < best_size:
+            best_quality, best_size = quality, size
+
+    if best_quality != QUALITY_STEPS[-1]:
+        output.seek(0)
+        output.truncate()
+        _save_encoded(image, output, image_format, best_quality)
+    return output.getvalue()
+
+
+def _save_encoded(image, output, image_format, quality):
+    if image_format == 'WEBP':
+        image.save(output, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+
+
+def preprocess_for_ocr(image_bytes, grayscale=False, long_edge=2000, byte_budget=1536 * 1024,
+                       image_format='JPEG'):
+    """Normalize an image for OCR upload.
+
+    Applies EXIF orientation, scales the long edge down to `long_edge`
+    (decoding JPEGs at reduced scale with Image.draft), converts to grayscale
+    if asked and re-encodes within `byte_budget`. The original is kept when
+    re-encoding would not make it smaller and it already is what the steps
+    produce: an upload format, upright, within `long_edge` and in the mode.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        original_format = image.format
+        mode = 'L' if grayscale else 'RGB'
+        normalized = (original_format in UPLOAD_FORMATS and image.mode == mode
+                      and max(image.size) <= long_edge and image.getexif().get(ORIENTATION_TAG, 1) == 1)
+
+        if original_format == 'JPEG':
+            scale = min(1.0, long_edge / max(image.size))
+            image.draft(mode, (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != mode:
+            image = image.convert(mode)
+
+        scale = long_edge / max(image.size)
+        if scale < 1.0:
+            new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+        output = encode_within_budget(image, image_format, byte_budget)
+        if normalized and len(output) >= len(image_bytes):
+            return image_bytes
+        return output
+
+    except Exception as e:
+        logger.warning(f"Failed to preprocess image: {e}")
+        return image_bytes
+
+
+def _preprocess_shared(source_name, size, options):
+    """Process pool entry point: preprocess the image held in shared memory.
+
+    Returns (name, size) of a new shared memory block with the result, or
+    None if the image is unchanged.
+    """
+    source = shared_memory.SharedMemory(name=source_name)
+    try:
+        image_bytes = bytes(source.buf[:size])
+    finally:
+        source.close()
+
+    output = preprocess_for_ocr(image_bytes, **options)
+    if output is image_bytes:
+        return None
+
+    target = shared_memory.SharedMemory(create=True, size=max(1, len(output)))
+    target.buf[:len(output)] = output
+    target.close()
+    return target.name, len(output)
+
+
+class ImagePreprocessor:
+    """Run CPU-bound OCR preprocessing in a process pool, off the network threads.
+
+    Image bytes travel to and from the pool through shared memory; only the
+    block names are pickled. processes=0 preprocesses inline, and so do
+    daemonic processes (Celery prefork children), which may not start a pool:
+    run the OCR workers with --pool threads so tasks share the parent's pool.
+    Workers come from a forkserver, not a fork of the threaded worker.
+    """
+
+    def __init__(self, processes=None, long_edge=2000, byte_budget=1536 * 1024, image_format='JPEG',
+                 start_method='forkserver'):
+        self.processes = physical_cpu_count() if processes is None else processes
+        self.start_method = start_method
+        self.options = {
+            'long_edge': long_edge,
+            'byte_budget': byte_budget,
+            'image_format': image_format,
+        }
+        self._executor = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_executor)
+
+    def _forget_executor(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context(self.start_method))
+                logger.info(f"Started image preprocessing pool ({self.processes} processes, pid {os.getpid()})")
+            return self._executor
+
+    def _drop_executor(self, executor):
+        """Stop using a pool that failed; the next image starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        try:
+            executor.shutdown(wait=False, cancel_futures=True)
+        except Exception as e:
+            logger.warning(f"Error shutting down preprocessing pool: {e}")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def preprocess(self, image_bytes, grayscale=False):
+        """Same result as preprocess_for_ocr, computed in the pool"""
+        options = dict(self.options, grayscale=grayscale)
+        if self.processes <= 0 or multiprocessing.current_process().daemon:
+            return preprocess_for_ocr(image_bytes, **options)
+
+        try:
+            executor = self._get_executor()
+        except Exception as e:
+            logger.warning(f"Preprocessing pool unavailable, preprocessing inline: {e}")
+            return preprocess_for_ocr(image_bytes, **options)
+
+        source = None
+        try:
+            source = shared_memory.SharedMemory(create=True, size=max(1, len(image_bytes)))
+            source.buf[:len(image_bytes)] = image_bytes
+            result = executor.submit(_preprocess_shared, source.name, len(image_bytes), options).result()
+        except Exception as e:
+            logger.warning(f"Preprocessing pool failed, preprocessing inline: {e}")
+            self._drop_executor(executor)
+            return preprocess_for_ocr(image_bytes, **options)
+        finally:
+            if source is not None:
+                source.close()
+                source.unlink()
+
+        if result is None:
+            return image_bytes
+
+        target_name, size = result
+        target = shared_memory.SharedMemory(name=target_name)
+        try:
+            return bytes(target.buf[:size])
+        finally:
+            target.close()
+            target.unlink()
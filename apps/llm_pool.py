@@ -0,0 +1,81 @@
+# apps/llm_pool.py
+import os
+import asyncio
+import logging
+import threading
+import weakref
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+logger = logging.getLogger('apps')
+
+# One client per set of constructor arguments for the whole process
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Async channels are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_key(api_key, model, request_timeout, max_retries, client_kwargs):
+    """Pool key covering every constructor argument (client_kwargs values need not be hashable)"""
+    return (api_key, model, request_timeout, max_retries, repr(sorted(client_kwargs.items())))
+
+
+def get_llm(api_key, model, request_timeout=30, max_retries=3, **client_kwargs):
+    """Return the shared ChatGoogleGenerativeAI client for this process and these arguments"""
+    key = _client_key(api_key, model, request_timeout, max_retries, client_kwargs)
+    llm = _clients.get(key)
+    if llm is not None:
+        return llm
+
+    with _clients_lock:
+        llm = _clients.get(key)
+        if llm is None:
+            llm = ChatGoogleGenerativeAI(
+                model=model,
+                temperature=0,
+                google_api_key=api_key,
+                request_timeout=request_timeout,
+                max_retries=max_retries,
+                **client_kwargs
+            )
+            _clients[key] = llm
+            logger.info(f"Created LLM client for {model} (pid {os.getpid()})")
+        return llm
+
+
+def get_async_llm(api_key, model, request_timeout=30, max_retries=3):
+    """Return a client for ainvoke() owned by the running event loop"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    key = _client_key(api_key, model, request_timeout, max_retries, {})
+    llm = clients.get(key)
+    if llm is None:
+        llm = ChatGoogleGenerativeAI(
+            model=model,
+            temperature=0,
+            google_api_key=api_key,
+            request_timeout=request_timeout,
+            max_retries=max_retries
+        )
+        clients[key] = llm
+    return llm
+
+
+def reset_pool():
+    """Drop all clients (their channels must not be shared across fork)"""
+    with _clients_lock:
+        _clients.clear()
+    _async_clients.clear()
+
+
+def _forget_clients():
+    """In a forked child: drop the parent's clients and a lock another thread may have held"""
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+    _async_clients.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_clients)
@@ -0,0 +1,24 @@
+# apps/management/commands/compile_dictionary.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from apps.dictionary_index import compile_dictionary, index_is_current
+
+
+class Command(BaseCommand):
+    help = 'Compile OCR_DICTIONARY_FILES into the memory-mapped index at OCR_DICTIONARY_INDEX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Compile even if the index is up to date')
+
+    def handle(self, *args, **options):
+        index_path = getattr(settings, 'OCR_DICTIONARY_INDEX', None)
+        if not index_path:
+            raise CommandError('OCR_DICTIONARY_INDEX is not set')
+        files = getattr(settings, 'OCR_DICTIONARY_FILES', [])
+        max_distance = getattr(settings, 'OCR_DICTIONARY_MAX_DISTANCE', 1)
+
+        if not options['force'] and index_is_current(files, index_path, max_distance):
+            self.stdout.write(f"{index_path} is up to date")
+            return
+        compile_dictionary(files, index_path, max_distance)
+        self.stdout.write(self.style.SUCCESS(f"Compiled {index_path}"))
@@ -0,0 +1,172 @@
+# apps/ocr_cache.py
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger('apps')
+
+
+class OCRResultCache:
+    """Content-addressed cache of extracted items, stored in Redis with a disk fallback.
+
+    Entries expire `ttl` after they were last read or written. Above
+    `max_entries`, the least recently used ones are evicted down to
+    EVICT_TO of the limit, so eviction work is spread over many writes.
+    """
+
+    KEY_PREFIX = "ocr_cache:"
+    LRU_KEY = "ocr_cache:lru"
+    EVICT_TO = 0.9
+
+    def __init__(self, redis_client, cache_dir, ttl=7 * 24 * 3600, max_entries=10000):
+        self.redis_client = redis_client
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Entries on disk, counted by a directory walk on the first write
+        self._disk_count = None
+
+    @staticmethod
+    def make_key(image_bytes, processing_type, prompt, model_name):
+        """Build cache key from image content, processing type, prompt and model"""
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        key_source = "|".join([
+            image_hash,
+            processing_type,
+            hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            model_name,
+        ])
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return cached items or None"""
+        try:
+            data = self.redis_client.get(f"{self.KEY_PREFIX}{key}")
+            if data is None:
+                return None
+            # The key's expiry follows its LRU score, so expired members can be pruned by score
+            pipe = self.redis_client.pipeline()
+            pipe.expire(f"{self.KEY_PREFIX}{key}", self.ttl)
+            pipe.zadd(self.LRU_KEY, {key: time.time()})
+            pipe.execute()
+            return json.loads(data)
+        except Exception as e:
+            logger.warning(f"Redis cache unavailable, using disk: {e}")
+            return self._disk_get(key)
+
+    def set(self, key, items):
+        """Store items under key"""
+        payload = json.dumps(items, ensure_ascii=False)
+        try:
+            self.redis_client.set(f"{self.KEY_PREFIX}{key}", payload, ex=self.ttl)
+            self.redis_client.zadd(self.LRU_KEY, {key: time.time()})
+            self._redis_evict()
+        except Exception as e:
+            logger.warning(f"Redis cache unavailable, using disk: {e}")
+            self._disk_set(key, payload)
+
+    def record(self, session_id, hit):
+        """Count a cache hit or miss for the session"""
+        try:
+            stats_key = f"cache_stats:{session_id}"
+            self.redis_client.hincrby(stats_key, "hits" if hit else "misses", 1)
+            self.redis_client.expire(stats_key, 3600)
+        except Exception as e:
+            logger.error(f"Error recording cache stats: {e}")
+
+    def get_stats(self, session_id):
+        """Return hit/miss counters for the session"""
+        try:
+            stats = self.redis_client.hgetall(f"cache_stats:{session_id}")
+            return {
+                'hits': int(stats.get(b'hits', 0)),
+                'misses': int(stats.get(b'misses', 0)),
+            }
+        except Exception as e:
+            logger.error(f"Error getting cache stats: {e}")
+            return {'hits': 0, 'misses': 0}
+
+    def _redis_evict(self):
+        """Forget entries whose keys expired, then drop least recently used ones above max_entries"""
+        self.redis_client.zremrangebyscore(self.LRU_KEY, '-inf', time.time() - self.ttl)
+        count = self.redis_client.zcard(self.LRU_KEY)
+        if count <= self.max_entries:
+            return
+        oldest = self.redis_client.zrange(self.LRU_KEY, 0, count - int(self.max_entries * self.EVICT_TO) - 1)
+        if oldest:
+            self.redis_client.delete(*[f"{self.KEY_PREFIX}{k.decode()}" for k in oldest])
+            self.redis_client.zrem(self.LRU_KEY, *oldest)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            if not os.path.exists(path):
+                return None
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+            os.utime(path)
+            return items
+        except Exception as e:
+            logger.warning(f"Error reading disk cache {key}: {e}")
+            return None
+
+    def _disk_set(self, key, payload):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self._disk_count is None:
+                self._disk_count = sum(1 for _ in self._disk_entries())
+            is_new = not os.path.exists(path)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+            if is_new:
+                self._disk_count += 1
+            if self._disk_count > self.max_entries:
+                self._disk_evict()
+        except Exception as e:
+            logger.warning(f"Error writing disk cache {key}: {e}")
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def _disk_evict(self):
+        """Remove expired entries, then least recently used ones down to EVICT_TO of max_entries.
+
+        Only runs once the count passes max_entries, so the directory walk
+        happens once per (1 - EVICT_TO) * max_entries new entries.
+        """
+        entries = []
+        now = time.time()
+        for path in self._disk_entries():
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    entries.append((mtime, path))
+            except FileNotFoundError:
+                continue
+
+        keep = int(self.max_entries * self.EVICT_TO)
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - keep]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            entries = entries[len(entries) - keep:]
+        self._disk_count = len(entries)
@@ -0,0 +1,124 @@
+# apps/pipeline.py
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger('apps')
+
+_DONE = object()
+
+
+class _Failure:
+    """Exception raised by a stage, carried to the consumer with what on_error made of it"""
+
+    def __init__(self, error, output=None):
+        self.error = error
+        self.output = output
+
+
+def run_pipeline(source, stages, queue_size=2, timeout=None, on_error=None):
+    """Run items from `source` through (name, func, workers) stages on bounded queues.
+
+    Yields outputs of the last stage in completion order. At most `queue_size`
+    items wait between two stages and `source` is only advanced when the first
+    queue has room, so the number of live buffers depends on the worker counts,
+    not on how many items `source` produces.
+
+    When a stage raises, `on_error(name, item, error)` turns the item into
+    an output that skips the remaining stages and is yielded like any other,
+    so one bad item does not end the run. Without on_error, or if it raises
+    too, the error is raised to the consumer.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def feed():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+        except Exception as e:
+            logger.error(f"Pipeline source error: {e}")
+            put(queues[0], _Failure(e))
+        for _ in range(stages[0][2]):
+            put(queues[0], _DONE)
+
+    def work(index, name, func, remaining):
+        in_q, out_q = queues[index], queues[index + 1]
+        while True:
+            item = get(in_q)
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                output = item
+            else:
+                try:
+                    output = func(item)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {name} error: {e}")
+                    output = _Failure(e)
+                    if on_error is not None:
+                        try:
+                            output.output = on_error(name, item, e)
+                        except Exception as handler_error:
+                            logger.error(f"Pipeline error handler failed for stage {name}: {handler_error}")
+                            output.error = handler_error
+            del item
+            if not put(out_q, output):
+                return
+            del output
+
+        with remaining['lock']:
+            remaining['count'] -= 1
+            last_worker = remaining['count'] == 0
+        if last_worker:
+            next_workers = stages[index + 1][2] if index + 1 < len(stages) else 1
+            for _ in range(next_workers):
+                put(out_q, _DONE)
+
+    threading.Thread(target=feed, name="pipeline-source", daemon=True).start()
+    for index, (name, func, workers) in enumerate(stages):
+        remaining = {'count': workers, 'lock': threading.Lock()}
+        for n in range(workers):
+            threading.Thread(
+                target=work, args=(index, name, func, remaining),
+                name=f"pipeline-{name}-{n}", daemon=True
+            ).start()
+
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        while True:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                raise TimeoutError("Pipeline timed out")
+            try:
+                item = queues[-1].get(timeout=wait)
+            except queue.Empty:
+                raise TimeoutError("Pipeline timed out")
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                if item.output is None:
+                    raise item.error
+                item = item.output
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,111 @@
+# apps/rate_limit.py
+import time
+import random
+import hashlib
+import logging
+
+logger = logging.getLogger('apps')
+
+# Takes `requested` from both buckets atomically, or nothing.
+# Returns 0 on success, otherwise seconds to wait before trying again.
+# The clock is the Redis server's, so workers with skewed clocks share one
+# timeline; `ts` only moves forward by the time credited as tokens (to now
+# once the bucket is full), so no interval is ever refilled twice.
+# Relies on script effects replication (the default since Redis 5) for TIME.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local requested = math.min(tonumber(ARGV[i * 3]), capacity)
+    local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    local elapsed = math.max(0, now - ts)
+    local credited = math.min(elapsed, math.max(0, capacity - tokens) / rate)
+    tokens = math.min(capacity, tokens + credited * rate)
+    if credited < elapsed then
+        ts = now
+    else
+        ts = ts + credited
+    end
+    levels[i] = {tokens, requested, ts}
+    if tokens < requested then
+        wait = math.max(wait, (requested - tokens) / rate)
+    end
+end
+for i = 1, 2 do
+    local tokens = levels[i][1]
+    if wait == 0 then
+        tokens = tokens - levels[i][2]
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens), 'ts', tostring(levels[i][3]))
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """Requests-per-minute and tokens-per-minute limit per API key, shared by all workers"""
+
+    def __init__(self, redis_client, requests_per_minute, tokens_per_minute, max_wait=600):
+        self.redis_client = redis_client
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @staticmethod
+    def _key_id(api_key):
+        return hashlib.sha256((api_key or '').encode()).hexdigest()[:16]
+
+    def _try_acquire(self, key_id, tokens):
+        wait = self._script(
+            keys=[f"ratelimit:{key_id}:requests", f"ratelimit:{key_id}:tokens"],
+            args=[
+                self.requests_per_minute, self.requests_per_minute / 60.0, 1,
+                self.tokens_per_minute, self.tokens_per_minute / 60.0, tokens,
+            ]
+        )
+        return float(wait)
+
+    def acquire(self, api_key, tokens=1):
+        """Block until one request and `tokens` tokens are available for api_key"""
+        key_id = self._key_id(api_key)
+        waiting_key = f"ratelimit:{key_id}:waiting"
+        deadline = time.monotonic() + self.max_wait
+        queued = False
+        try:
+            while True:
+                wait = self._try_acquire(key_id, tokens)
+                if wait <= 0:
+                    return
+                if time.monotonic() + wait > deadline:
+                    logger.warning(f"Rate limit wait exceeded {self.max_wait}s, proceeding")
+                    return
+                if not queued:
+                    self.redis_client.incr(waiting_key)
+                    self.redis_client.expire(waiting_key, self.max_wait)
+                    queued = True
+                time.sleep(min(wait, 1.0) + random.uniform(0, 0.1))
+        except Exception as e:
+            logger.error(f"Rate limiter unavailable, proceeding: {e}")
+        finally:
+            if queued:
+                try:
+                    self.redis_client.decr(waiting_key)
+                except Exception as e:
+                    logger.error(f"Error updating rate limit queue: {e}")
+
+    def queue_depth(self, api_key):
+        """Number of callers currently waiting for api_key"""
+        try:
+            depth = self.redis_client.get(f"ratelimit:{self._key_id(api_key)}:waiting")
+            return max(0, int(depth)) if depth else 0
+        except Exception as e:
+            logger.error(f"Error getting rate limit queue: {e}")
+            return 0
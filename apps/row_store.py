@@ -0,0 +1,147 @@
+# apps/row_store.py
+import json
+import logging
+from redis.exceptions import WatchError
+
+logger = logging.getLogger('apps')
+
+PIPELINE_ROWS = 1000
+
+
+class RowStore:
+    """Extracted rows of each session, kept in Redis one hash per row.
+
+    A row lives in `rows:{session_id}:{index}` with one field per column
+    (values JSON-encoded, so numbers stay numbers). `rows_meta:{session_id}`
+    holds the row count, column order, processing type, Excel filename, a
+    version that every edit bumps, and how many entries of the published
+    results (result_items:{session_id}) the rows cover, so callers only read
+    entries beyond that. Edits write single fields, so their cost does not
+    depend on how many rows the session has.
+    """
+
+    def __init__(self, redis_client, ttl=7200):
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    def _meta_key(self, session_id):
+        return f"rows_meta:{session_id}"
+
+    def _row_key(self, session_id, index):
+        return f"rows:{session_id}:{index}"
+
+    def start(self, session_id, processing_type, excel_filename):
+        """Record a new session's settings, dropping rows of an earlier run"""
+        self.clear(session_id)
+        meta_key = self._meta_key(session_id)
+        pipe = self.redis_client.pipeline()
+        pipe.hset(meta_key, mapping={
+            'processing_type': processing_type,
+            'excel_filename': excel_filename,
+            'count': 0,
+            'entries': 0,
+            'version': 0,
+            'columns': '[]'
+        })
+        pipe.expire(meta_key, self.ttl)
+        pipe.execute()
+
+    @staticmethod
+    def _parse_meta(raw):
+        raw = {k.decode(): v.decode('utf-8') for k, v in raw.items()}
+        return {
+            'processing_type': raw.get('processing_type') or 'transcript',
+            'excel_filename': raw.get('excel_filename') or 'ocr_ketqua.xlsx',
+            'count': int(raw.get('count', 0)),
+            'entries': int(raw.get('entries', 0)),
+            'version': int(raw.get('version', 0)),
+            'columns': json.loads(raw.get('columns', '[]'))
+        }
+
+    def meta(self, session_id):
+        """Count, entries, version, columns, processing_type and excel_filename (defaults if unknown)"""
+        return self._parse_meta(self.redis_client.hgetall(self._meta_key(session_id)))
+
+    def append(self, session_id, rows, start, entries):
+        """Store the rows of published result entries start..entries after those stored; returns the row count.
+
+        `start` is the meta()['entries'] the caller read the entries from.
+        If another request stored them first, nothing is written, so rows are
+        never added twice; rows already stored (and their edits) are kept.
+        """
+        meta_key = self._meta_key(session_id)
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(meta_key)
+                meta = self._parse_meta(pipe.hgetall(meta_key))
+                if meta['entries'] != start or entries <= start:
+                    return meta['count']
+
+                count = meta['count']
+                columns = meta['columns']
+                pipe.multi()
+                for index, row in enumerate(rows, count):
+                    for column in row:
+                        if column not in columns:
+                            columns.append(column)
+                    row_key = self._row_key(session_id, index)
+                    if row:
+                        pipe.hset(row_key, mapping={column: json.dumps(value, ensure_ascii=False)
+                                                    for column, value in row.items()})
+                    pipe.expire(row_key, self.ttl)
+                pipe.hset(meta_key, mapping={'count': count + len(rows), 'entries': entries,
+                                             'columns': json.dumps(columns, ensure_ascii=False)})
+                if rows:
+                    pipe.hincrby(meta_key, 'version', 1)
+                pipe.expire(meta_key, self.ttl)
+                pipe.execute()
+                return count + len(rows)
+            except WatchError:
+                return self.meta(session_id)['count']
+
+    def rows(self, session_id, start=0, stop=None, columns=None):
+        """Rows start..stop as dicts in column order, refreshing their expiry"""
+        meta = self.meta(session_id)
+        stop = meta['count'] if stop is None else min(stop, meta['count'])
+        columns = columns or meta['columns']
+
+        rows = []
+        for batch_start in range(start, stop, PIPELINE_ROWS):
+            pipe = self.redis_client.pipeline()
+            for index in range(batch_start, min(batch_start + PIPELINE_ROWS, stop)):
+                row_key = self._row_key(session_id, index)
+                pipe.hgetall(row_key)
+                pipe.expire(row_key, self.ttl)
+            for raw in pipe.execute()[::2]:
+                values = {k.decode('utf-8'): json.loads(v) for k, v in raw.items()}
+                row = {column: values.pop(column) for column in columns if column in values}
+                row.update(values)
+                rows.append(row)
+        self.redis_client.expire(self._meta_key(session_id), self.ttl)
+        return rows
+
+    def update(self, session_id, changes):
+        """Write (row_index, field_name, value) changes; returns the new version"""
+        meta = self.meta(session_id)
+        columns = meta['columns']
+        meta_key = self._meta_key(session_id)
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        for row_index, field_name, value in changes:
+            row_key = self._row_key(session_id, row_index)
+            pipe.hset(row_key, field_name, json.dumps(value, ensure_ascii=False))
+            pipe.expire(row_key, self.ttl)
+            if field_name not in columns:
+                columns.append(field_name)
+        pipe.hset(meta_key, 'columns', json.dumps(columns, ensure_ascii=False))
+        pipe.hincrby(meta_key, 'version', 1)
+        pipe.expire(meta_key, self.ttl)
+        return pipe.execute()[-2]
+
+    def clear(self, session_id):
+        """Delete the session's rows and metadata"""
+        count = self.meta(session_id)['count']
+        for start in range(0, count, PIPELINE_ROWS):
+            self.redis_client.delete(*[self._row_key(session_id, index)
+                                       for index in range(start, min(start + PIPELINE_ROWS, count))])
+        self.redis_client.delete(self._meta_key(session_id))
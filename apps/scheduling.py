@@ -0,0 +1,307 @@
+# apps/scheduling.py
+import json
+import time
+import logging
+
+logger = logging.getLogger('apps')
+
+SMALL_QUEUE = 'ocr_small'
+LARGE_QUEUE = 'ocr_large'
+
+# Take an active slot for the owner, or park the job in the owner's held list
+# (unless ARGV[4] is '0'). Returns 1 if the job may be dispatched now, 0 if not.
+CLAIM_SLOT_SCRIPT = """
+local active = tonumber(redis.call('GET', KEYS[1]) or '0')
+if active < tonumber(ARGV[1]) then
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+if ARGV[4] == '0' then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 0
+"""
+
+# Hand the finished job's slot to the owner's next held job, or release it.
+# Returns the next session id, or false if nothing was held.
+RELEASE_SLOT_SCRIPT = """
+local next_job = redis.call('LPOP', KEYS[2])
+if next_job then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return next_job
+end
+local active = tonumber(redis.call('GET', KEYS[1]) or '0')
+if active > 1 then
+    redis.call('DECR', KEYS[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+return false
+"""
+
+# Put a held job whose dispatch failed back at the head of the owner's held
+# list and free the slot it was given; dispatch_stranded() retries it.
+REQUEUE_HELD_SCRIPT = """
+redis.call('LPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+local active = tonumber(redis.call('GET', KEYS[1]) or '0')
+if active > 1 then
+    redis.call('DECR', KEYS[1])
+else
+    redis.call('DEL', KEYS[1])
+end
+"""
+
+# Give free slots to held jobs: used when an owner's active count expired with
+# its jobs (a worker died before finished()). Returns the session ids to dispatch.
+DRAIN_HELD_SCRIPT = """
+local dispatched = {}
+local active = tonumber(redis.call('GET', KEYS[1]) or '0')
+while active < tonumber(ARGV[1]) do
+    local next_job = redis.call('LPOP', KEYS[2])
+    if not next_job then
+        break
+    end
+    active = redis.call('INCR', KEYS[1])
+    table.insert(dispatched, next_job)
+end
+if #dispatched > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return dispatched
+"""
+
+
+class JobScheduler:
+    """Route OCR jobs to size-tiered Celery queues with a per-owner fair share.
+
+    An owner (user or browser session) has at most `max_active_per_owner`
+    jobs queued or running; further uploads wait in Redis and are dispatched
+    as that owner's earlier jobs finish, so one uploader cannot fill the
+    queues ahead of everybody else.
+
+    Slots expire after `ttl` unless the running job calls touch(); held jobs
+    of owners whose slots expired are dispatched by dispatch_stranded().
+    """
+
+    def __init__(self, redis_client, small_job_max_images=10, max_active_per_owner=1, ttl=7200):
+        self.redis_client = redis_client
+        self.small_job_max_images = small_job_max_images
+        self.max_active_per_owner = max_active_per_owner
+        self.ttl = ttl
+        self._claim = redis_client.register_script(CLAIM_SLOT_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SLOT_SCRIPT)
+        self._requeue = redis_client.register_script(REQUEUE_HELD_SCRIPT)
+        self._drain = redis_client.register_script(DRAIN_HELD_SCRIPT)
+
+    def tier_for(self, image_count):
+        return SMALL_QUEUE if image_count <= self.small_job_max_images else LARGE_QUEUE
+
+    def _load_job(self, session_id):
+        data = self.redis_client.get(f"sched:job:{session_id}")
+        return json.loads(data) if data else None
+
+    def _save_job(self, job):
+        self.redis_client.set(f"sched:job:{job['session_id']}", json.dumps(job), ex=self.ttl)
+
+    def _slot_keys(self, owner):
+        return [f"sched:active:{owner}", f"sched:held:{owner}"]
+
+    def _dispatch(self, job, dispatch):
+        job['queued_at'] = time.time()
+        self._save_job(job)
+        self.redis_client.zadd(f"sched:queue:{job['tier']}", {job['session_id']: job['queued_at']})
+        try:
+            dispatch(job['args'], queue=job['tier'])
+        except Exception:
+            self.redis_client.zrem(f"sched:queue:{job['tier']}", job['session_id'])
+            raise
+        logger.info(f"Dispatched job {job['session_id']} to {job['tier']}")
+
+    def _dispatch_or_release(self, job, dispatch):
+        """Dispatch a job on the slot it holds; if sending fails, free the slot and re-raise"""
+        try:
+            self._dispatch(job, dispatch)
+        except Exception:
+            self.finished(job['session_id'], dispatch)
+            raise
+
+    def _release_slot(self, owner, dispatch):
+        """Hand one of the owner's slots to their next held job, or free it"""
+        next_session_id = self._release(keys=self._slot_keys(owner), args=[self.ttl])
+        if next_session_id:
+            self._dispatch_held(next_session_id.decode(), owner, dispatch)
+
+    def _dispatch_held(self, session_id, owner, dispatch):
+        """Dispatch a held job that was just given a slot; True if it was sent.
+
+        The slot of a job whose record expired goes to the next held job; a
+        job that cannot be sent is held again, for dispatch_stranded().
+        """
+        job = self._load_job(session_id)
+        if not job:
+            self._release_slot(owner, dispatch)
+            return False
+        try:
+            self._dispatch(job, dispatch)
+            return True
+        except Exception as e:
+            logger.error(f"Error dispatching held job {session_id}, holding it again: {e}")
+            self._requeue(keys=self._slot_keys(owner), args=[session_id, self.ttl])
+            return False
+
+    def reserve(self, session_id, owner, tier=LARGE_QUEUE):
+        """Take one of the owner's slots for a job whose upload is still arriving.
+
+        True if the job holds a slot, taken now or by an earlier call: work on
+        it may start before submit(), which then dispatches on that slot.
+        False, holding nothing, while the owner is at the fair-share limit.
+        """
+        job = self._load_job(session_id)
+        if job:
+            return bool(job.get('reserved'))
+
+        claimed = self._claim(
+            keys=self._slot_keys(owner),
+            args=[self.max_active_per_owner, session_id, self.ttl, 0]
+        )
+        if not int(claimed):
+            return False
+        self._save_job({
+            'session_id': session_id,
+            'owner': owner,
+            'tier': tier,
+            'reserved': True,
+            'submitted_at': time.time()
+        })
+        logger.info(f"Reserved a slot of {owner} for job {session_id} while it uploads")
+        return True
+
+    def submit(self, session_id, owner, image_count, args, dispatch):
+        """Queue a job now, or hold it while its owner is at the fair-share limit.
+
+        `dispatch(args, queue=...)` sends the Celery task. Returns the state,
+        'queued' or 'held'. A job that reserve() gave a slot is queued on it.
+        If `dispatch` raises, the slot is released before the error propagates.
+        """
+        reserved = self._load_job(session_id)
+        job = {
+            'session_id': session_id,
+            'owner': owner,
+            'tier': self.tier_for(image_count),
+            'image_count': image_count,
+            'args': args,
+            'submitted_at': time.time()
+        }
+        self._save_job(job)
+
+        if reserved and reserved.get('reserved'):
+            self._dispatch_or_release(job, dispatch)
+            return 'queued'
+
+        claimed = self._claim(
+            keys=self._slot_keys(owner),
+            args=[self.max_active_per_owner, session_id, self.ttl, 1]
+        )
+        if int(claimed):
+            self._dispatch_or_release(job, dispatch)
+            return 'queued'
+
+        logger.info(f"Holding job {session_id}: {owner} is at {self.max_active_per_owner} active jobs")
+        return 'held'
+
+    def started(self, session_id):
+        """Mark a job as picked up by a worker; returns its queue (None if unscheduled)"""
+        try:
+            job = self._load_job(session_id)
+            if not job:
+                return None
+            self.redis_client.zrem(f"sched:queue:{job['tier']}", session_id)
+            if 'started_at' not in job:
+                job['started_at'] = time.time()
+                self._save_job(job)
+                logger.info(f"Job {session_id} waited {job['started_at'] - job['submitted_at']:.1f}s "
+                            f"in {job['tier']}")
+            self.touch(session_id, job)
+            return job['tier']
+        except Exception as e:
+            logger.error(f"Error marking job started: {e}")
+            return None
+
+    def touch(self, session_id, job=None):
+        """Keep a running job's slot, and its owner's held jobs, from expiring"""
+        try:
+            job = job or self._load_job(session_id)
+            if not job or job.get('finished'):
+                return
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in self._slot_keys(job['owner']) + [f"sched:job:{session_id}"]:
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error refreshing job slot: {e}")
+
+    def finished(self, session_id, dispatch):
+        """Free the owner's slot and dispatch their next held job, if any"""
+        try:
+            job = self._load_job(session_id)
+            if not job or job.get('finished'):
+                return
+            job['finished'] = True
+            self._save_job(job)
+
+            self._release_slot(job['owner'], dispatch)
+        except Exception as e:
+            logger.error(f"Error releasing job slot: {e}")
+
+    def dispatch_stranded(self, dispatch):
+        """Dispatch held jobs of owners with free slots; returns how many were sent.
+
+        An owner's active count expires with a job that never called
+        finished() (its worker was killed), which would otherwise leave the
+        owner's held jobs waiting for a release that never comes.
+        """
+        sent = 0
+        for key in self.redis_client.scan_iter(match='sched:held:*'):
+            owner = key.decode()[len('sched:held:'):]
+            try:
+                for session_id in self._drain(keys=self._slot_keys(owner),
+                                              args=[self.max_active_per_owner, self.ttl]):
+                    if self._dispatch_held(session_id.decode(), owner, dispatch):
+                        logger.info(f"Dispatched stranded job {session_id.decode()} of {owner}")
+                        sent += 1
+            except Exception as e:
+                logger.error(f"Error dispatching held jobs of {owner}: {e}")
+        return sent
+
+    def queue_status(self, session_id):
+        """Queue, state ('held', 'queued', 'running'), position and seconds spent waiting"""
+        try:
+            job = self._load_job(session_id)
+            if not job:
+                return None
+
+            status = {'queue': job['tier'], 'position': None}
+            if 'started_at' in job:
+                status['state'] = 'running'
+                status['wait_seconds'] = round(job['started_at'] - job['submitted_at'], 1)
+                return status
+
+            status['wait_seconds'] = round(time.time() - job['submitted_at'], 1)
+            rank = self.redis_client.zrank(f"sched:queue:{job['tier']}", session_id)
+            if rank is not None:
+                status['state'] = 'queued'
+                status['position'] = rank + 1
+            else:
+                held = [s.decode() for s in self.redis_client.lrange(f"sched:held:{job['owner']}", 0, -1)]
+                status['state'] = 'held'
+                if session_id in held:
+                    status['position'] = (self.redis_client.zcard(f"sched:queue:{job['tier']}")
+                                          + held.index(session_id) + 1)
+            return status
+        except Exception as e:
+            logger.error(f"Error getting queue status: {e}")
+            return None
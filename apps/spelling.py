@@ -0,0 +1,311 @@
+# apps/spelling.py
+import os
+import math
+import logging
+import threading
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+from .dictionary_index import (WORD_PATTERN, PREFIX_LENGTH, build_deletes, deletions, load_dictionary,
+                               read_dictionary)
+
+logger = logging.getLogger('apps')
+
+Suggestion = namedtuple('Suggestion', ['term', 'distance', 'count'])
+
+VOWELS = set('aeiouy')
+
+# Candidate scores: each edit costs CHANGE_COST, a dictionary bigram with a
+# neighbour earns CONTEXT_BONUS, frequency adds FREQUENCY_WEIGHT * log(count).
+# A word missing from the dictionary starts at -UNKNOWN_PENALTY, and a fix is
+# only chosen when it beats the runner-up by MIN_MARGIN.
+CHANGE_COST = 2.0
+CONTEXT_BONUS = 3.0
+FREQUENCY_WEIGHT = 0.3
+UNKNOWN_PENALTY = 2.5
+MIN_MARGIN = 0.5
+
+
+@lru_cache(maxsize=65536)
+def strip_accents(text):
+    """Text without Vietnamese diacritics (đ becomes d)"""
+    decomposed = unicodedata.normalize('NFD', text.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _distance_within_one(a, b):
+    """edit_distance(a, b, 1) with slice comparisons instead of the full table"""
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        if i == len(a):
+            return 0
+        if a[i + 1:] == b[i + 1:]:
+            return 1
+        if a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2] and a[i + 2:] == b[i + 2:]:
+            return 1
+        return 2
+    return 1 if a[i:] == b[i + 1:] else 2
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded"""
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if max_distance == 1:
+        return _distance_within_one(a, b)
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class SpellingCorrector:
+    """Dictionary corrector with a SymSpell-style deletion index and bigram context.
+
+    Every dictionary word is indexed under the strings obtained by deleting
+    up to `max_distance` characters from its first `prefix_length`
+    characters. A lookup generates the same deletions of the token, so
+    candidates come from a few dictionary probes instead of a scan; only
+    those candidates get a real edit distance. Words are lowercase NFC, so
+    a wrong or missing diacritic is one substitution.
+
+    Many wrong diacritics still spell a real word ("Hà Nôi"), so candidates
+    are scored against the neighbouring words with the dictionary's bigrams.
+    One neighbour is weak evidence ("Công an tỉnh" would become "tịnh"), so
+    such fixes to dictionary words are proposed unless asked to be applied.
+
+    The tables are built from `counts` and `bigrams` unless a prebuilt
+    `deletes` index is given, in which case they are used as they are (see
+    from_compiled).
+    """
+
+    def __init__(self, counts, bigrams=(), max_distance=2, prefix_length=PREFIX_LENGTH, memo_size=65536,
+                 deletes=None):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        if deletes is None:
+            counts, bigrams = dict(counts), set(bigrams)
+            deletes = build_deletes(counts, max_distance, prefix_length)
+        self.counts = counts
+        self.bigrams = bigrams
+        self.deletes = deletes
+        self.lookup = lru_cache(maxsize=memo_size)(self._lookup)
+        self._correct_text = lru_cache(maxsize=memo_size)(self._correct_text)
+
+    @classmethod
+    def from_files(cls, paths, **kwargs):
+        counts, bigrams = read_dictionary(paths)
+        return cls(counts, bigrams, **kwargs)
+
+    @classmethod
+    def from_compiled(cls, compiled, memo_size=65536):
+        """Corrector reading the tables of a CompiledDictionary in place"""
+        return cls(compiled.counts, compiled.bigrams, compiled.max_distance, compiled.prefix_length, memo_size,
+                   deletes=compiled.deletes)
+
+    def __contains__(self, word):
+        return word.lower() in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _deletions(self, word, max_distance=None):
+        if max_distance is None:
+            max_distance = self.max_distance
+        return deletions(word, max_distance, self.prefix_length)
+
+    def _lookup(self, token, max_distance=None):
+        """Dictionary words within max_distance of token, best first.
+
+        Ranked by distance, then words that differ from the token only in
+        diacritics, then frequency.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        max_distance = min(max_distance, self.max_distance)
+        word = unicodedata.normalize('NFC', token).lower()
+
+        candidates = set()
+        for key in self._deletions(word, max_distance):
+            entry = self.deletes.get(key)
+            if entry is None:
+                continue
+            if isinstance(entry, str):
+                candidates.add(entry)
+            else:
+                candidates.update(entry)
+
+        skeleton = strip_accents(word)
+        ranked = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) > max_distance:
+                continue
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                ranked.append((distance, strip_accents(candidate) != skeleton, -self.counts[candidate], candidate))
+        ranked.sort()
+        return [Suggestion(candidate, distance, -negative_count)
+                for distance, _, negative_count, candidate in ranked]
+
+    def _is_word(self, token):
+        """Tokens worth correcting: longer than one letter and with a vowel (not an acronym like TP)"""
+        return len(token) > 1 and bool(VOWELS & set(strip_accents(token.lower())))
+
+    def _score(self, candidate, distance, left, right_forms):
+        score = -CHANGE_COST * distance + FREQUENCY_WEIGHT * math.log1p(self.counts.get(candidate, 0))
+        if left and f"{left} {candidate}" in self.bigrams:
+            score += CONTEXT_BONUS
+        if any(f"{candidate} {right}" in self.bigrams for right in right_forms):
+            score += CONTEXT_BONUS
+        return score
+
+    def _choose(self, word, max_distance, left, right):
+        """Best form of `word` between its left (already chosen) and right neighbours.
+
+        Diacritic-only fixes are preferred whenever one exists, and a word
+        that is in the dictionary only gets diacritic fixes. A neighbour that
+        is not in the dictionary counts in any of its diacritic variants.
+        """
+        skeleton = strip_accents(word)
+        candidates = self.lookup(word, max_distance)
+        same_skeleton = [s for s in candidates if strip_accents(s.term) == skeleton]
+        if same_skeleton or word in self.counts:
+            candidates = same_skeleton
+
+        right_forms = ()
+        if right:
+            right_forms = [right]
+            if right not in self.counts:
+                right_skeleton = strip_accents(right)
+                right_forms += [s.term for s in self.lookup(right, max_distance)
+                                if strip_accents(s.term) == right_skeleton]
+
+        scored = [(self._score(s.term, s.distance, left, right_forms), s.term) for s in candidates]
+        if word not in self.counts:
+            scored.append((-UNKNOWN_PENALTY, word))
+        scored.sort(reverse=True)
+
+        best_score, best = scored[0]
+        if best != word and len(scored) > 1 and best_score - scored[1][0] < MIN_MARGIN:
+            return word
+        return best
+
+    def _correct_text(self, text, max_distance, apply_context):
+        tokens = list(WORD_PATTERN.finditer(text))
+        words = [match.group(0).lower() if self._is_word(match.group(0)) else None for match in tokens]
+
+        parts = []
+        changes = []
+        proposals = []
+        position = 0
+        left = None
+        for i, match in enumerate(tokens):
+            token, word = match.group(0), words[i]
+            chosen = word
+            if word is not None:
+                right = words[i + 1] if i + 1 < len(words) else None
+                chosen = self._choose(word, max_distance, left, right)
+            parts.append(text[position:match.start()])
+            if chosen != word and (apply_context or word not in self.counts):
+                fixed = match_case(chosen, token)
+                changes.append((token, fixed))
+                parts.append(fixed)
+            else:
+                if chosen != word:
+                    proposals.append((token, match_case(chosen, token)))
+                    chosen = word
+                parts.append(token)
+            position = match.end()
+            left = chosen
+        parts.append(text[position:])
+        return ''.join(parts), tuple(changes), tuple(proposals)
+
+    def correct_word(self, token, max_distance=1):
+        """Fix for a single word, without context"""
+        return self.correct_text(token, max_distance)[0]
+
+    def correct_text(self, text, max_distance=1, apply_context=False):
+        """Fix text word by word; returns (text, changes, proposals).
+
+        Words missing from the dictionary are fixed when one candidate is
+        clearly best. Dictionary words that only the context says are wrong
+        are fixed if `apply_context`, else listed in proposals. Changes and
+        proposals are (word, fix) pairs.
+        """
+        if not text:
+            return text, [], []
+        corrected, changes, proposals = self._correct_text(
+            unicodedata.normalize('NFC', text), max_distance, apply_context)
+        return corrected, list(changes), list(proposals)
+
+    def suggest_text(self, text, max_distance=None, limit=5):
+        """Suggestions for each word of text that is not in the dictionary"""
+        return {token: self.lookup(token, max_distance)[:limit]
+                for token in WORD_PATTERN.findall(unicodedata.normalize('NFC', text or ''))
+                if token not in self}
+
+
+def match_case(word, template):
+    """word with the capitalization of template (UPPER, Title or lower)"""
+    if template.isupper():
+        return word.upper()
+    if template[:1].isupper():
+        return word[:1].upper() + word[1:]
+    return word
+
+
+_correctors = {}
+_correctors_lock = threading.Lock()
+
+
+def _files_signature(paths):
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def get_corrector(paths, index_path=None, max_distance=2, prefix_length=PREFIX_LENGTH):
+    """SpellingCorrector for the dictionary files, loaded once per process.
+
+    With `index_path`, the tables are read from the compiled index (see
+    load_dictionary), compiled first if missing or older than the files.
+    The files are checked with a stat on each call and the corrector is
+    loaded again when they change.
+    """
+    key = (tuple(paths), index_path, max_distance, prefix_length)
+    signature = _files_signature(paths)
+    with _correctors_lock:
+        entry = _correctors.get(key)
+        if entry is None or entry[1] != signature:
+            if index_path:
+                compiled = load_dictionary(paths, index_path, max_distance, prefix_length)
+                corrector = SpellingCorrector.from_compiled(compiled)
+            else:
+                corrector = SpellingCorrector.from_files(paths, max_distance=max_distance,
+                                                         prefix_length=prefix_length)
+            entry = _correctors[key] = (corrector, signature)
+            logger.info(f"Loaded spelling dictionary: {len(corrector)} words, {len(corrector.deletes)} index keys"
+                        + (f" from {index_path}" if index_path else ""))
+        return entry[0]
@@ -1,83 +1,459 @@
 # tasks.py
-from celery import shared_task
+from celery import shared_task, chord
+from celery.signals import worker_init, worker_process_init
 import os
 import json
+import time
 import logging
 from django.conf import settings
-from .views import process_zip_file, redis_client, update_progress
+from .views import (
+    process_zip_file, process_zip_chunk, list_zip_images, zip_image_counts, publish_image_results,
+    get_checkpoint, clear_session_results, get_stream_claims, summarize_image_result,
+    process_image_batch_with_results, redis_client, update_progress, job_scheduler, upload_store, GEMINI_MODEL
+)
+from .llm_pool import get_llm, reset_pool
+from .scheduling import LARGE_QUEUE
+from .zip_stream import LocalEntry, read_local_entry
+from .zip_archive import ZipArchive
+from .async_engine import run_zip_file_async
 
 logger = logging.getLogger('apps')
 
-@shared_task
+# Seconds a run may hold fanout:{session_id} while it sends the chord; a
+# claim still "dispatching" after that belongs to a run that died
+FANOUT_DISPATCH_TIMEOUT = 60
+
+# Seconds between checks for entries streamed during the upload
+STREAM_POLL_SECONDS = 5
+
+@worker_init.connect
+@worker_process_init.connect
+def init_llm_pool(**kwargs):
+    """Create the shared LLM client once per worker process (the main process for --pool threads)"""
+    try:
+        reset_pool()
+        api_key = os.getenv('GOOGLE_API_KEY') or settings.GOOGLE_API_KEY
+        get_llm(api_key, GEMINI_MODEL, request_timeout=30, max_retries=1)
+    except Exception as e:
+        logger.error(f"Error initializing LLM pool: {e}")
+
+def get_api_key():
+    """Gemini API key from the environment or settings"""
+    return os.getenv('GOOGLE_API_KEY') or settings.GOOGLE_API_KEY
+
+def save_result_summary(session_id, image_results, total_records, processing_type, excel_filename,
+                        skipped_images=0):
+    """Write the final summary; the rows are already in result_items:{session_id}"""
+    result = {
+        'success': True,
+        'image_results': image_results,
+        'processing_type': processing_type,
+        'excel_filename': excel_filename,
+        'session_id': session_id,
+        'total_images': len(image_results),
+        'successful_images': sum(1 for r in image_results if r['success']),
+        'total_records': total_records,
+        'skipped_images': skipped_images
+    }
+    
+    redis_client.set(
+        f"result:{session_id}", 
+        json.dumps(result, ensure_ascii=False), 
+        ex=7200
+    )
+
+def remove_temp_file(temp_file_path):
+    """Delete the uploaded ZIP"""
+    if os.path.exists(temp_file_path):
+        os.remove(temp_file_path)
+        logger.info(f"Cleaned up: {temp_file_path}")
+
+def list_fanout_chunks(temp_file_path, max_images=None):
+    """Split the ZIP's images into subtask chunks, or None if it is small enough for one task"""
+    min_images = getattr(settings, 'OCR_FANOUT_MIN_IMAGES', None)
+    if not min_images:
+        return None
+    
+    with ZipArchive(temp_file_path) as archive:
+        filenames = [entry.filename for entry in list_zip_images(archive, max_images)]
+    if len(filenames) < min_images:
+        return None
+    
+    chunk_size = max(1, getattr(settings, 'OCR_MAX_BATCH_SIZE', 15))
+    return [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+
+def collect_prior_results(session_id, names):
+    """Checkpointed results of entries finished by an earlier attempt or during the upload"""
+    checkpoint = get_checkpoint(session_id)
+    prior_results = []
+    for name in sorted(names):
+        if name in checkpoint:
+            prior_results.append(checkpoint[name])
+        else:
+            logger.warning(f"Streamed entry {name} did not finish")
+            prior_results.append({
+                'filename': os.path.basename(name),
+                'success': False,
+                'error': 'Hết thời gian xử lý',
+                'data_count': 0
+            })
+    return prior_results
+
+def complete_job(session_id, temp_file_path, processing_type, excel_filename, image_results, skipped_images):
+    """Store the summary, then delete the ZIP and report the final progress"""
+    total_records = sum(r['data_count'] for r in image_results)
+    save_result_summary(session_id, image_results, total_records, processing_type, excel_filename,
+                        skipped_images)
+    
+    # Cleanup, only once the summary is stored
+    remove_temp_file(temp_file_path)
+    
+    success_count = sum(1 for r in image_results if r['success'])
+    update_progress(
+        session_id, 
+        len(image_results), 
+        len(image_results), 
+        finished_message(success_count, len(image_results), skipped_images),
+        extra={'status': 'done'}
+    )
+    
+    logger.info(f"Task completed: {success_count}/{len(image_results)} images")
+    return f"Success: {success_count}/{len(image_results)}"
+
+def record_job_error(session_id, processing_type, error):
+    """Store a failed job's result so the result page shows the error"""
+    logger.error(f"Task error: {error}")
+    
+    error_result = {
+        'success': False,
+        'error': str(error),
+        'data': [],
+        'image_results': [],
+        'processing_type': processing_type,
+        'session_id': session_id
+    }
+    
+    redis_client.set(
+        f"result:{session_id}", 
+        json.dumps(error_result, ensure_ascii=False), 
+        ex=3600
+    )
+    
+    update_progress(session_id, 0, 0, f"Lỗi: {str(error)}", extra={'status': 'error'})
+
+def finished_message(success_count, total_images, skipped_images):
+    """Final progress message"""
+    message = f"Xong! {success_count}/{total_images} ảnh"
+    if skipped_images:
+        message += f" (bỏ qua {skipped_images} ảnh vượt giới hạn)"
+    return message
+
+def dispatch_images_task(args, queue):
+    """Send process_images_task to the queue picked by the scheduler"""
+    process_images_task.apply_async(args=args, queue=queue)
+
+def finish_job(session_id):
+    """Release the owner's scheduler slot, starting their next held upload"""
+    job_scheduler.finished(session_id, dispatch_images_task)
+
+# acks_late + reject_on_worker_lost: if the worker dies mid-ZIP the message goes
+# back to the queue and the next run resumes from the checkpoint
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def process_images_task(session_id, temp_file_path, processing_type, excel_filename):
     """Process images from ZIP file"""
+    # A fanned-out or still-streaming job keeps its slot until the chord
+    # callback or finish_streamed_job_task is done with it
+    handed_off = False
     try:
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            api_key = settings.GOOGLE_API_KEY
+        api_key = get_api_key()
+        queue = job_scheduler.started(session_id)
         
         logger.info(f"Starting task for session {session_id}")
         logger.info(f"File path: {temp_file_path}")
         
-        extracted_data, image_results = process_zip_file(
+        # Redelivered after the summary was written but before the ack
+        if redis_client.exists(f"result:{session_id}"):
+            logger.info(f"Session {session_id} already completed")
+            return "Already completed"
+        
+        # Rows are published per image while the job runs; a redelivered job
+        # keeps them and skips the entries it already finished
+        completed = get_checkpoint(session_id)
+        streamed = get_stream_claims(session_id)
+        if completed or streamed:
+            logger.info(f"Resuming session {session_id} after {len(completed)} checkpointed images "
+                        f"({len(streamed)} sent to OCR during the upload)")
+        else:
+            clear_session_results(session_id)
+        
+        # Images beyond OCR_MAX_IMAGES_PER_SESSION are reported, not silently dropped
+        found_images, used_images = zip_image_counts(temp_file_path)
+        skipped_images = found_images - used_images
+        if skipped_images:
+            logger.warning(f"Session {session_id}: skipping {skipped_images} of {found_images} images")
+            redis_client.set(f"result_skipped:{session_id}", skipped_images, ex=7200)
+        
+        # Entries streamed during the upload are already spread over the workers
+        chunks = None if streamed else list_fanout_chunks(temp_file_path)
+        if chunks:
+            total_images = sum(len(chunk) for chunk in chunks)
+            fanout_key = f"fanout:{session_id}"
+            if not redis_client.set(fanout_key, 'dispatching', nx=True, ex=FANOUT_DISPATCH_TIMEOUT):
+                # The run holding the claim, or the chord it sent, finishes the job
+                handed_off = True
+                if redis_client.get(fanout_key) == b'dispatched':
+                    logger.info(f"Session {session_id} was already fanned out")
+                    return "Already dispatched"
+                # Still dispatching, or that run died: look again once its claim has expired
+                logger.info(f"Session {session_id} is being fanned out, checking again later")
+                process_images_task.apply_async(
+                    args=[session_id, temp_file_path, processing_type, excel_filename],
+                    queue=queue, countdown=FANOUT_DISPATCH_TIMEOUT
+                )
+                return "Dispatch pending"
+            
+            try:
+                if not completed:
+                    redis_client.delete(f"result_done:{session_id}")
+                update_progress(session_id, 0, total_images, f"Xử lý {total_images} ảnh ({len(chunks)} phần)...")
+                
+                # Subtasks stay in the job's size tier
+                options = {'queue': queue} if queue else {}
+                chord(
+                    process_chunk_task.s(session_id, temp_file_path, processing_type, chunk, total_images).set(**options)
+                    for chunk in chunks
+                )(finish_fanout_task.s(session_id, temp_file_path, processing_type, excel_filename).set(**options))
+            except Exception:
+                redis_client.delete(fanout_key)
+                raise
+            redis_client.set(fanout_key, 'dispatched', ex=7200)
+            handed_off = True
+            
+            logger.info(f"Fanned out {total_images} images into {len(chunks)} subtasks")
+            return f"Dispatched: {total_images} images in {len(chunks)} chunks"
+        
+        if getattr(settings, 'OCR_EXTRACTION_ENGINE', 'threads') == 'asyncio':
+            run_extraction = run_zip_file_async
+        else:
+            run_extraction = process_zip_file
+        
+        done_elsewhere = set(completed) | streamed
+        extracted_data, image_results = run_extraction(
             temp_file_path, 
             api_key, 
             processing_type, 
             session_id, 
-            max_images=50
+            completed=done_elsewhere
         )
         
-        result = {
-            'success': True,
-            'data': extracted_data,
-            'image_results': image_results,
-            'processing_type': processing_type,
-            'excel_filename': excel_filename,
-            'session_id': session_id,
-            'total_images': len(image_results),
-            'successful_images': sum(1 for r in image_results if r['success']),
-            'total_records': len(extracted_data)
-        }
-        
-        redis_client.set(
-            f"result:{session_id}", 
-            json.dumps(result, ensure_ascii=False), 
-            ex=7200
-        )
+        # Streamed entries may still be in flight on other workers; wait for
+        # them by re-enqueueing rather than by holding this worker
+        if streamed and not streamed <= get_checkpoint(session_id).keys():
+            finish_streamed_job_task.apply_async(
+                args=[session_id, temp_file_path, processing_type, excel_filename, sorted(done_elsewhere),
+                      image_results, skipped_images, time.time() + max(60, len(streamed) * 30), queue],
+                queue=queue
+            )
+            handed_off = True
+            return f"Waiting for {len(streamed)} streamed images"
+        
+        # Merge entries finished by an earlier attempt, then the final checkpoint
+        image_results = collect_prior_results(session_id, done_elsewhere) + image_results
+        return complete_job(session_id, temp_file_path, processing_type, excel_filename, image_results,
+                            skipped_images)
+        
+    except Exception as e:
+        record_job_error(session_id, processing_type, e)
+        raise e
+    
+    finally:
+        if not handed_off:
+            finish_job(session_id)
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def finish_streamed_job_task(session_id, temp_file_path, processing_type, excel_filename, prior_names,
+                             image_results, skipped_images, deadline, queue):
+    """Write the summary of a streamed job once its streamed entries are checkpointed.
+    
+    Checks again every STREAM_POLL_SECONDS by re-enqueueing itself, so no
+    worker waits; entries still missing at `deadline` are reported as timed out.
+    """
+    waiting = False
+    try:
+        if not get_stream_claims(session_id) <= get_checkpoint(session_id).keys() and time.time() < deadline:
+            finish_streamed_job_task.apply_async(
+                args=[session_id, temp_file_path, processing_type, excel_filename, prior_names,
+                      image_results, skipped_images, deadline, queue],
+                queue=queue, countdown=STREAM_POLL_SECONDS
+            )
+            job_scheduler.touch(session_id)
+            waiting = True
+            return "Waiting for streamed images"
+        
+        image_results = collect_prior_results(session_id, prior_names) + image_results
+        return complete_job(session_id, temp_file_path, processing_type, excel_filename, image_results,
+                            skipped_images)
+    
+    except Exception as e:
+        record_job_error(session_id, processing_type, e)
+        raise e
+    
+    finally:
+        if not waiting:
+            finish_job(session_id)
+
+@shared_task(bind=True, max_retries=None, acks_late=True, reject_on_worker_lost=True)
+def process_chunk_task(self, session_id, temp_file_path, processing_type, filenames, total_images):
+    """Extract one chunk of a fanned-out ZIP, retrying independently of the other chunks"""
+    can_retry = self.request.retries < getattr(settings, 'OCR_FANOUT_MAX_RETRIES', 3)
+    countdown = 5 * 2 ** self.request.retries
+    
+    # A redelivered chunk whose outcomes were already published only reports them
+    checkpoint = get_checkpoint(session_id)
+    done_results = [checkpoint[name] for name in filenames if name in checkpoint]
+    filenames = [name for name in filenames if name not in checkpoint]
+    if not filenames:
+        return done_results
+    
+    try:
+        outcomes = process_zip_chunk(temp_file_path, filenames, get_api_key(), processing_type, session_id)
+    except Exception as e:
+        if can_retry:
+            logger.warning(f"Chunk of {len(filenames)} images failed, retrying in {countdown}s: {e}")
+            raise self.retry(exc=e, countdown=countdown)
+        logger.error(f"Chunk of {len(filenames)} images failed: {e}")
+        outcomes = [(filename, {
+            'filename': os.path.basename(filename),
+            'success': False,
+            'error': str(e),
+            'data_count': 0
+        }, []) for filename in filenames]
+    else:
+        # Images that did succeed are in the OCR cache, so a retry only pays for the rest
+        overloaded = [r for _, r, _ in outcomes if not r['success'] and r.get('overloaded')]
+        if overloaded and can_retry:
+            logger.warning(f"{len(overloaded)} images hit API limits, retrying chunk in {countdown}s")
+            raise self.retry(countdown=countdown)
+    
+    publish_image_results(session_id, outcomes)
+    
+    done_key = f"result_done:{session_id}"
+    processed_count = redis_client.incrby(done_key, len(outcomes))
+    redis_client.expire(done_key, 7200)
+    success_count = sum(1 for _, r, _ in outcomes if r['success'])
+    update_progress(session_id, min(processed_count, total_images), total_images,
+                    f"✓ {success_count}/{len(outcomes)} ảnh trong phần vừa xong")
+    
+    return done_results + [image_result for _, image_result, _ in outcomes]
+
+@shared_task
+def finish_fanout_task(chunk_results, session_id, temp_file_path, processing_type, excel_filename):
+    """Chord callback: merge chunk outcomes into result:{session_id}"""
+    try:
+        image_results = [image_result for chunk in chunk_results for image_result in chunk]
+        total_records = sum(r['data_count'] for r in image_results)
+        skipped_images = int(redis_client.get(f"result_skipped:{session_id}") or 0)
+        save_result_summary(session_id, image_results, total_records, processing_type, excel_filename,
+                            skipped_images)
         
-        # Cleanup
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            logger.info(f"Cleaned up: {temp_file_path}")
+        # Cleanup, only once the summary is stored
+        remove_temp_file(temp_file_path)
         
         success_count = sum(1 for r in image_results if r['success'])
         update_progress(
             session_id, 
             len(image_results), 
             len(image_results), 
-            f"Xong! {success_count}/{len(image_results)} ảnh"
+            finished_message(success_count, len(image_results), skipped_images),
+            extra={'status': 'done'}
         )
         
-        logger.info(f"Task completed: {success_count}/{len(image_results)} images")
+        logger.info(f"Fan-out completed: {success_count}/{len(image_results)} images")
         return f"Success: {success_count}/{len(image_results)}"
         
     except Exception as e:
-        logger.error(f"Task error: {e}")
-        
-        error_result = {
-            'success': False,
-            'error': str(e),
-            'data': [],
-            'image_results': [],
-            'processing_type': processing_type,
-            'session_id': session_id
-        }
-        
-        redis_client.set(
-            f"result:{session_id}", 
-            json.dumps(error_result, ensure_ascii=False), 
-            ex=3600
+        logger.error(f"Fan-out merge error: {e}")
+        update_progress(session_id, 0, 0, f"Lỗi: {str(e)}", extra={'status': 'error'})
+        raise e
+    
+    finally:
+        finish_job(session_id)
+
+def dispatch_stream_entries(session_id, zip_path, processing_type, entries, owner):
+    """Claim entries found while a ZIP is uploading and send them to OCR.
+    
+    Streaming counts against the owner's fair share: nothing is sent unless
+    the job holds one of the owner's scheduler slots, and at most
+    OCR_STREAM_MAX_TASKS stream tasks per job are queued or running, so
+    concurrent uploads cannot take every large-queue worker. Entries not
+    sent are left to process_images_task.
+    """
+    # Streaming is only used for big uploads, which belong in the large-job queue
+    if not job_scheduler.reserve(session_id, owner, LARGE_QUEUE):
+        return
+    
+    in_flight_key = f"stream_in_flight:{session_id}"
+    room = getattr(settings, 'OCR_STREAM_MAX_TASKS', 4) - int(redis_client.get(in_flight_key) or 0)
+    batch_size = max(1, getattr(settings, 'OCR_LLM_BATCH_IMAGES', 1))
+    batches = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)][:max(0, room)]
+    if not batches:
+        return
+    
+    claims_key = f"stream_claimed:{session_id}"
+    redis_client.sadd(claims_key, *[entry.filename for batch in batches for entry in batch])
+    redis_client.expire(claims_key, 7200)
+    redis_client.incrby(in_flight_key, len(batches))
+    redis_client.expire(in_flight_key, 7200)
+    
+    for batch in batches:
+        process_stream_entries_task.apply_async(
+            args=[session_id, zip_path, processing_type, [entry._asdict() for entry in batch]],
+            queue=LARGE_QUEUE
         )
+    logger.info(f"Session {session_id}: {sum(len(batch) for batch in batches)} of {len(entries)} images "
+                f"sent to OCR during upload")
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def process_stream_entries_task(session_id, zip_path, processing_type, entries):
+    """OCR entries of a ZIP that is still being uploaded, located by their local headers"""
+    try:
+        checkpoint = get_checkpoint(session_id)
+        outcomes = []
+        batch = []
+        for index, entry in enumerate(entries):
+            if entry['filename'] in checkpoint:
+                continue
+            try:
+                batch.append((read_local_entry(zip_path, LocalEntry(**entry)), entry['filename'], index))
+            except Exception as e:
+                logger.error(f"Error reading {entry['filename']}: {e}")
+                outcomes.append((entry['filename'], {
+                    'filename': os.path.basename(entry['filename']),
+                    'success': False,
+                    'error': str(e),
+                    'data_count': 0
+                }, []))
+        
+        if batch:
+            for result in process_image_batch_with_results(batch, get_api_key(), processing_type, session_id):
+                outcomes.append((result["filename"], summarize_image_result(result),
+                                 result["data"] if result["success"] else []))
         
-        update_progress(session_id, 0, 0, f"Lỗi: {str(e)}")
-        raise e
\ No newline at end of file
+        publish_image_results(session_id, outcomes)
+        return len(outcomes)
+    finally:
+        redis_client.decr(f"stream_in_flight:{session_id}")
+
+@shared_task
+def purge_abandoned_uploads_task():
+    """Periodic: delete the files of chunked uploads that expired unfinished"""
+    purged = upload_store.purge_abandoned()
+    for metadata in purged:
+        # Streaming may have reserved one of the owner's slots for the upload
+        finish_job(metadata['session_id'])
+    return len(purged)
+
+@shared_task
+def dispatch_stranded_jobs_task():
+    """Periodic: dispatch held uploads whose owner's slot expired with a dead job"""
+    return job_scheduler.dispatch_stranded(dispatch_images_task)
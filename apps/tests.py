@@ -1,3 +1,1480 @@
-from django.test import TestCase
+import io
+import os
+import asyncio
+import time
+import shutil
+import hashlib
+import datetime
+import json
+import zlib
+import zipfile
+import tempfile
+import tracemalloc
+import multiprocessing
+import unicodedata
+import pandas as pd
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from PIL import Image
+from openpyxl import load_workbook
+from google.api_core import exceptions as google_exceptions
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+from .imaging import ImagePreprocessor, image_mime_type, preprocess_for_ocr
+from .concurrency import AIMDLimiter, is_overload_error
+from .rate_limit import RedisTokenBucket
+from .pipeline import run_pipeline
+from .excel_export import ExportCache
+from .row_store import RowStore
+from .chunked_upload import ChunkedUploadStore, UploadError
+from .zip_stream import inflate_entry, read_local_entry, scan_local_entries
+from .zip_archive import ZipArchive, is_zip_image_name
+from .scheduling import JobScheduler, LARGE_QUEUE
+from .ocr_cache import OCRResultCache
+from .date_normalizer import expand_year, normalize_date, normalize_date_series, _normalize
+from .spelling import SpellingCorrector, edit_distance, get_corrector, read_dictionary
+from .dictionary_index import CompiledDictionary, load_dictionary
+from . import views, async_engine, llm_pool
+from .views import (
+    clean_date_string, image_content_part, store_image, failed_batch_results, process_zip_chunk,
+    with_failed_reads, correct_certificate_fields, clean_sbd, process_transcript_dataframe
+)
 
-# Create your tests here.
+try:
+    import fakeredis
+    import fakeredis.aioredis
+except ImportError:
+    fakeredis = None
+
+
+def make_scan(width=1700, height=2400):
+    """Noisy RGB JPEG roughly the size of a phone scan"""
+    image = Image.merge('RGB', [Image.effect_noise((width, height), 40) for _ in range(3)])
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def traced_peak(func, *args, **kwargs):
+    """Run func and return (result, peak bytes allocated by Python while it ran)"""
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+class ImageRequestAllocationTests(SimpleTestCase):
+    """Per-image allocation ceilings on the request-building path"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.image_bytes = make_scan()
+        cls.media_root = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_image_part_references_bytes(self):
+        part, peak = traced_peak(image_content_part, self.image_bytes)
+        self.assertEqual(part["type"], "media")
+        self.assertEqual(part["mime_type"], "image/jpeg")
+        self.assertIs(part["data"], self.image_bytes)
+        self.assertLess(peak, 64 * 1024)
+
+    def test_store_image_does_not_copy(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            path, peak = traced_peak(store_image, self.image_bytes, 'dir/scan 01.jpg', 'alloc-test')
+            with open(os.path.join(self.media_root, path), 'rb') as f:
+                self.assertEqual(f.read(), self.image_bytes)
+        self.assertLess(peak, 64 * 1024)
+
+    def test_store_image_again_reuses_the_file(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            first = store_image(self.image_bytes, 'retry/scan.jpg', 'store-test')
+            self.assertEqual(store_image(self.image_bytes, 'retry/scan.jpg', 'store-test'), first)
+            other = store_image(b'other bytes', 'retry/scan.jpg', 'store-test')
+            self.assertNotEqual(other, first)
+            self.assertEqual(store_image(b'other bytes', 'retry/scan.jpg', 'store-test'), other)
+            self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'ocr_sessions', 'store-test'))), 2)
+
+    def test_preprocess_keeps_one_output_copy(self):
+        output, peak = traced_peak(preprocess_for_ocr, self.image_bytes, grayscale=True)
+        self.assertLess(len(output), len(self.image_bytes))
+        # The optimizing JPEG encoder buffers one byte per output pixel; beyond that only the result is kept
+        width, height = Image.open(io.BytesIO(output)).size
+        self.assertLess(peak, width * height + len(output) + 512 * 1024)
+
+
+def encode_jpeg(image, quality, orientation=None):
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, exif=exif)
+    return output.getvalue()
+
+
+class PreprocessForOCRTests(SimpleTestCase):
+    """A small, heavily compressed original must still be normalized"""
+
+    def setUp(self):
+        self.image = Image.merge('RGB', [Image.effect_noise((300, 200), 40) for _ in range(3)])
+
+    def test_rotated_original_is_made_upright(self):
+        image_bytes = encode_jpeg(self.image, 10, orientation=6)
+        output = Image.open(io.BytesIO(preprocess_for_ocr(image_bytes)))
+        self.assertEqual(output.size, (200, 300))
+
+    def test_oversized_original_is_scaled_down(self):
+        image_bytes = encode_jpeg(self.image, 10)
+        output = Image.open(io.BytesIO(preprocess_for_ocr(image_bytes, long_edge=150)))
+        self.assertEqual(max(output.size), 150)
+
+    def test_color_original_is_made_grayscale(self):
+        image_bytes = encode_jpeg(self.image, 10)
+        output = Image.open(io.BytesIO(preprocess_for_ocr(image_bytes, grayscale=True)))
+        self.assertEqual(output.mode, 'L')
+
+    def test_normalized_original_is_kept(self):
+        image_bytes = encode_jpeg(self.image, 10)
+        self.assertIs(preprocess_for_ocr(image_bytes), image_bytes)
+
+    def test_mime_type_of_unknown_formats(self):
+        output = io.BytesIO()
+        self.image.save(output, format='BMP')
+        self.assertEqual(image_mime_type(output.getvalue()), 'image/bmp')
+        self.assertEqual(image_mime_type(b'not an image'), 'application/octet-stream')
+
+
+def preprocess_in_child(preprocessor, image_bytes, connection):
+    try:
+        connection.send(preprocessor.preprocess(image_bytes, grayscale=True))
+    except BaseException as e:
+        connection.send(e)
+    finally:
+        connection.close()
+
+
+class ImagePreprocessorTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.image_bytes = make_scan(600, 800)
+        cls.expected = preprocess_for_ocr(cls.image_bytes, grayscale=True)
+
+    def test_daemonic_process_preprocesses_inline(self):
+        # Celery prefork children are daemonic and may not start a process pool
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(target=preprocess_in_child,
+                                args=(ImagePreprocessor(processes=2), self.image_bytes, sender), daemon=True)
+        child.start()
+        sender.close()
+        result = receiver.recv()
+        child.join()
+        self.assertEqual(result, self.expected)
+
+    def test_pool_failure_falls_back_inline_and_drops_pool(self):
+        class FailingExecutor:
+            def submit(self, *args):
+                raise RuntimeError("cannot start workers")
+
+            def shutdown(self, **kwargs):
+                pass
+
+        preprocessor = ImagePreprocessor(processes=2)
+        preprocessor._executor = FailingExecutor()
+        self.assertEqual(preprocessor.preprocess(self.image_bytes, grayscale=True), self.expected)
+        self.assertIsNone(preprocessor._executor)
+
+    def test_threads_pool_worker_uses_process_pool(self):
+        # start_celery.sh runs the OCR workers with --pool threads: tasks share the parent's pool
+        preprocessor = ImagePreprocessor(processes=2)
+        self.addCleanup(preprocessor.shutdown)
+        app = Celery('preprocess-test', broker='memory://', backend='cache+memory://')
+
+        @app.task(name='preprocess')
+        def preprocess_task(data):
+            return preprocessor.preprocess(bytes.fromhex(data), grayscale=True).hex()
+
+        with start_worker(app, pool='threads', concurrency=2, perform_ping_check=False):
+            outputs = [preprocess_task.delay(self.image_bytes.hex()) for _ in range(3)]
+            outputs = [bytes.fromhex(output.get(timeout=60)) for output in outputs]
+        self.assertEqual(outputs, [self.expected] * 3)
+        self.assertIsNotNone(preprocessor._executor)
+
+
+def get_llm_in_child(connection):
+    connection.send(type(llm_pool.get_llm('key', 'gemini-test', request_timeout=7)).__name__)
+    connection.close()
+
+
+class LLMPoolTests(SimpleTestCase):
+    def setUp(self):
+        llm_pool.reset_pool()
+        self.addCleanup(llm_pool.reset_pool)
+
+    def test_one_client_per_set_of_arguments(self):
+        client = llm_pool.get_llm('key', 'gemini-test', request_timeout=30, max_retries=1)
+        self.assertIs(llm_pool.get_llm('key', 'gemini-test', request_timeout=30, max_retries=1), client)
+        self.assertIsNot(llm_pool.get_llm('key', 'gemini-test', request_timeout=30, max_retries=3), client)
+        self.assertIsNot(llm_pool.get_llm('key', 'gemini-test', request_timeout=30, max_retries=1,
+                                          top_p=0.5), client)
+        self.assertIsNot(llm_pool.get_llm('key', 'gemini-test', request_timeout=30, max_retries=1,
+                                          safety_settings={}), client)
+        self.assertEqual(client.max_retries, 1)
+
+    def test_forked_child_gets_a_fresh_lock(self):
+        # Another thread of the parent holds the lock while a worker is forked
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        with llm_pool._clients_lock:
+            child = context.Process(target=get_llm_in_child, args=(sender,), daemon=True)
+            child.start()
+        self.addCleanup(child.kill)
+        sender.close()
+        self.assertTrue(receiver.poll(30), "get_llm deadlocked in the forked child")
+        self.assertEqual(receiver.recv(), 'ChatGoogleGenerativeAI')
+        child.join()
+
+
+class UnavailableRedis:
+    """Redis client whose every command fails, to exercise the disk fallback"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('Redis is down')
+        return fail
+
+
+class OCRResultCacheTests(SimpleTestCase):
+    """Hits, misses and LRU eviction in Redis and on disk"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def make_cache(self, redis_client, **kwargs):
+        return OCRResultCache(redis_client, self.cache_dir, **kwargs)
+
+    def test_disk_hit_and_miss(self):
+        cache = self.make_cache(UnavailableRedis())
+        self.assertIsNone(cache.get('a' * 64))
+        cache.set('a' * 64, [{'Sbd': '00001'}])
+        self.assertEqual(cache.get('a' * 64), [{'Sbd': '00001'}])
+
+    def test_disk_expired_entry_is_a_miss(self):
+        cache = self.make_cache(UnavailableRedis(), ttl=60)
+        cache.set('a' * 64, [])
+        old = time.time() - 120
+        os.utime(cache._disk_path('a' * 64), (old, old))
+        self.assertIsNone(cache.get('a' * 64))
+        self.assertFalse(os.path.exists(cache._disk_path('a' * 64)))
+
+    def test_disk_evicts_least_recently_used(self):
+        cache = self.make_cache(UnavailableRedis(), max_entries=10)
+        keys = [f"{i:02d}" * 32 for i in range(11)]
+        for age, key in enumerate(keys[:10]):
+            cache.set(key, [age])
+            mtime = time.time() - 100 + age
+            os.utime(cache._disk_path(key), (mtime, mtime))
+        cache.set(keys[10], [10])
+
+        remaining = [key for key in keys if os.path.exists(cache._disk_path(key))]
+        self.assertEqual(remaining, keys[-9:])
+        self.assertEqual(cache._disk_count, 9)
+
+    def test_disk_writes_below_limit_do_not_walk(self):
+        cache = self.make_cache(UnavailableRedis(), max_entries=10)
+        cache.set('a' * 64, [])
+        cache._disk_entries = None
+        for i in range(5):
+            cache.set(f"{i}" * 64, [])
+        self.assertEqual(cache._disk_count, 6)
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_redis_hit_miss_and_eviction(self):
+        redis_client = fakeredis.FakeRedis()
+        cache = self.make_cache(redis_client, max_entries=10)
+        self.assertIsNone(cache.get('missing'))
+        for i in range(10):
+            cache.set(f"key{i}", [i])
+            redis_client.zadd(cache.LRU_KEY, {f"key{i}": time.time() - 100 + i})
+        self.assertEqual(cache.get('key0'), [0])
+        cache.set('key10', [10])
+
+        self.assertEqual(redis_client.zcard(cache.LRU_KEY), 9)
+        self.assertIsNone(cache.get('key1'))
+        self.assertIsNone(cache.get('key2'))
+        self.assertEqual(cache.get('key0'), [0])
+        self.assertEqual(cache.get('key10'), [10])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_redis_prunes_expired_members(self):
+        redis_client = fakeredis.FakeRedis()
+        cache = self.make_cache(redis_client, ttl=60)
+        redis_client.zadd(cache.LRU_KEY, {'expired': time.time() - 120})
+        cache.set('fresh', [1])
+        self.assertEqual(redis_client.zrange(cache.LRU_KEY, 0, -1), [b'fresh'])
+
+
+class OverloadErrorTests(SimpleTestCase):
+    def test_api_limits_and_timeouts_are_overload(self):
+        for error in (google_exceptions.ResourceExhausted('quota'), google_exceptions.ServiceUnavailable('busy'),
+                      google_exceptions.DeadlineExceeded('slow'), TimeoutError()):
+            self.assertTrue(is_overload_error(error), error)
+
+    def test_wrapped_api_error_is_overload(self):
+        try:
+            try:
+                raise google_exceptions.ResourceExhausted('quota')
+            except Exception as e:
+                raise RuntimeError('request failed') from e
+        except RuntimeError as e:
+            self.assertTrue(is_overload_error(e))
+
+    def test_numbers_in_message_are_not_overload(self):
+        for error in (ValueError('image 500.jpg has 429 pixels'), ValueError('no timeout configured'),
+                      google_exceptions.InvalidArgument('quota 503')):
+            self.assertFalse(is_overload_error(error), error)
+
+    def test_limiter_backs_off_only_on_overload(self):
+        limiter = AIMDLimiter(initial=8)
+        limiter.acquire()
+        limiter.release(0.1, ValueError('HTTP 500 in filename'))
+        self.assertEqual(limiter.window, 8)
+        limiter.acquire()
+        limiter.release(0.1, google_exceptions.ResourceExhausted('quota'))
+        self.assertEqual(limiter.window, 4)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class RedisTokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.bucket = RedisTokenBucket(self.redis, requests_per_minute=60, tokens_per_minute=6000)
+        self.key_id = self.bucket._key_id('key')
+
+    def server_time(self):
+        seconds, microseconds = self.redis.time()
+        return seconds + microseconds / 1e6
+
+    def test_takes_tokens_until_empty(self):
+        self.assertEqual(self.bucket._try_acquire(self.key_id, 3000), 0)
+        self.assertEqual(self.bucket._try_acquire(self.key_id, 3000), 0)
+        self.assertGreater(self.bucket._try_acquire(self.key_id, 3000), 0)
+
+    def test_failed_attempts_do_not_refill_twice(self):
+        key = f"ratelimit:{self.key_id}:requests"
+        self.redis.hset(key, mapping={'tokens': 0, 'ts': self.server_time() - 0.5})
+        first = self.bucket._try_acquire(self.key_id, 1)
+        second = self.bucket._try_acquire(self.key_id, 1)
+        self.assertGreater(first, 0.4)
+        self.assertGreater(second, 0.4)
+        self.assertLess(float(self.redis.hget(key, 'tokens')), 0.6)
+
+    def test_timestamp_from_a_fast_clock_is_not_moved_back(self):
+        key = f"ratelimit:{self.key_id}:requests"
+        ahead = self.server_time() + 30
+        self.redis.hset(key, mapping={'tokens': 0, 'ts': ahead})
+        self.assertGreater(self.bucket._try_acquire(self.key_id, 1), 0)
+        self.assertEqual(float(self.redis.hget(key, 'tokens')), 0)
+        self.assertAlmostEqual(float(self.redis.hget(key, 'ts')), ahead, places=2)
+
+
+class PipelineTests(SimpleTestCase):
+    @staticmethod
+    def extract(batch):
+        if 3 in batch:
+            raise ValueError('bad batch')
+        return [n * 10 for n in batch]
+
+    def test_stage_error_becomes_output_of_that_item(self):
+        outputs = run_pipeline(
+            iter([[1], [2], [3], [4]]),
+            [("double", lambda batch: batch * 2, 1), ("extract", self.extract, 2)],
+            on_error=lambda stage, batch, error: [f"{stage}: {error}"] * len(batch)
+        )
+        self.assertEqual(sorted(map(str, outputs)),
+                         sorted(['[10, 10]', '[20, 20]', '[40, 40]', "['extract: bad batch', 'extract: bad batch']"]))
+
+    def test_stage_error_is_raised_without_handler(self):
+        with self.assertRaises(ValueError):
+            list(run_pipeline(iter([[1], [3]]), [("extract", self.extract, 1)]))
+
+    def test_failed_batch_keeps_prepared_results(self):
+        cached = {"success": True, "data": [{}], "filename": "a.jpg"}
+        prepared = {
+            'order': [0, 1],
+            'results': {0: cached},
+            'pending': [("anh_1", b"", "b.jpg", "path", "key", 1)]
+        }
+        results = failed_batch_results("extract", prepared, RuntimeError("boom"))
+        self.assertEqual(results[0], cached)
+        self.assertEqual((results[1]["filename"], results[1]["success"], results[1]["error"]), ("b.jpg", False, "boom"))
+
+        results = failed_batch_results("prepare", [(b"", "c.jpg", 0)], RuntimeError("boom"))
+        self.assertEqual([(r["filename"], r["success"]) for r in results], [("c.jpg", False)])
+
+
+class ZipReadFailureTests(SimpleTestCase):
+    """Unreadable entries are outcomes like any other result"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.directory, 'scans.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as zf:
+            zf.writestr('dir/bad.jpg', b'B' * 1000)
+        # Corrupt the stored data so the CRC check fails on read
+        with open(self.zip_path, 'rb') as f:
+            data = bytearray(f.read())
+        start = data.index(b'B' * 1000)
+        data[start:start + 4] = b'CCCC'
+        with open(self.zip_path, 'wb') as f:
+            f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_chunk_outcome_for_unreadable_entry(self):
+        outcomes = process_zip_chunk(self.zip_path, ['dir/bad.jpg'], 'key', 'certificate', 'read-test')
+        self.assertEqual(len(outcomes), 1)
+        name, image_result, data = outcomes[0]
+        self.assertEqual(name, 'dir/bad.jpg')
+        self.assertEqual((image_result['filename'], image_result['success'], data), ('bad.jpg', False, []))
+
+    def test_failed_reads_join_the_results(self):
+        failed_reads = [{"success": False, "data": [], "filename": "a.jpg", "error": "Bad CRC"}]
+
+        def results_stream():
+            yield [{"success": True, "data": [], "filename": "b.jpg"}]
+            failed_reads.append({"success": False, "data": [], "filename": "c.jpg", "error": "Bad CRC"})
+
+        names = [result["filename"] for results in with_failed_reads(results_stream(), failed_reads)
+                 for result in results]
+        self.assertEqual(names, ['a.jpg', 'b.jpg', 'c.jpg'])
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class JobSchedulerReservationTests(SimpleTestCase):
+    """Work streamed during an upload counts against the owner's fair share"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.scheduler = JobScheduler(self.redis, max_active_per_owner=1)
+        self.dispatched = []
+
+    def dispatch(self, args, queue):
+        self.dispatched.append((args, queue))
+
+    def test_reserved_job_is_queued_on_its_slot(self):
+        self.assertTrue(self.scheduler.reserve('upload', 'owner'))
+        self.assertTrue(self.scheduler.reserve('upload', 'owner'))
+        self.assertEqual(self.scheduler.submit('upload', 'owner', 50, ['upload'], self.dispatch), 'queued')
+        self.assertEqual(self.dispatched, [(['upload'], LARGE_QUEUE)])
+        self.assertEqual(int(self.redis.get('sched:active:owner')), 1)
+
+    def test_no_reservation_beyond_the_fair_share(self):
+        self.assertEqual(self.scheduler.submit('first', 'owner', 50, ['first'], self.dispatch), 'queued')
+        self.assertFalse(self.scheduler.reserve('upload', 'owner'))
+        self.assertEqual(self.redis.llen('sched:held:owner'), 0)
+        self.assertTrue(self.scheduler.reserve('other', 'other owner'))
+
+    def test_reservation_holds_the_owners_next_upload(self):
+        self.scheduler.reserve('upload', 'owner')
+        self.assertEqual(self.scheduler.submit('second', 'owner', 5, ['second'], self.dispatch), 'held')
+        self.scheduler.finished('upload', self.dispatch)
+        self.assertEqual(self.dispatched, [(['second'], 'ocr_small')])
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class JobSchedulerSlotLeakTests(SimpleTestCase):
+    """Every path out of a job gives its owner's slot back"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.scheduler = JobScheduler(self.redis, max_active_per_owner=1, ttl=60)
+        self.dispatched = []
+
+    def dispatch(self, args, queue):
+        self.dispatched.append(args)
+
+    def failing_dispatch(self, args, queue):
+        raise ConnectionError('broker is down')
+
+    def test_failed_dispatch_releases_the_slot(self):
+        with self.assertRaises(ConnectionError):
+            self.scheduler.submit('first', 'owner', 5, ['first'], self.failing_dispatch)
+        self.assertFalse(self.redis.exists('sched:active:owner'))
+        self.assertEqual(self.scheduler.submit('second', 'owner', 5, ['second'], self.dispatch), 'queued')
+
+    def test_failed_handoff_holds_the_job_again(self):
+        self.scheduler.submit('first', 'owner', 5, ['first'], self.dispatch)
+        self.scheduler.submit('second', 'owner', 5, ['second'], self.dispatch)
+        self.scheduler.finished('first', self.failing_dispatch)
+        self.assertFalse(self.redis.exists('sched:active:owner'))
+        self.assertEqual(self.scheduler.queue_status('second')['state'], 'held')
+        self.assertEqual(self.scheduler.dispatch_stranded(self.dispatch), 1)
+        self.assertEqual(self.dispatched, [['first'], ['second']])
+
+    def test_expired_held_job_passes_the_slot_on(self):
+        self.scheduler.submit('first', 'owner', 5, ['first'], self.dispatch)
+        self.scheduler.submit('expired', 'owner', 5, ['expired'], self.dispatch)
+        self.scheduler.submit('third', 'owner', 5, ['third'], self.dispatch)
+        self.redis.delete('sched:job:expired')
+        self.scheduler.finished('first', self.dispatch)
+        self.assertEqual(self.dispatched, [['first'], ['third']])
+        self.assertEqual(int(self.redis.get('sched:active:owner')), 1)
+
+    def test_expired_slot_dispatches_held_jobs(self):
+        # The worker running 'first' was killed: finished() never comes and the slot expires
+        self.scheduler.submit('first', 'owner', 5, ['first'], self.dispatch)
+        self.scheduler.submit('second', 'owner', 5, ['second'], self.dispatch)
+        self.assertEqual(self.scheduler.dispatch_stranded(self.dispatch), 0)
+        self.redis.delete('sched:active:owner')
+        self.assertEqual(self.scheduler.dispatch_stranded(self.dispatch), 1)
+        self.assertEqual(self.dispatched, [['first'], ['second']])
+        self.assertEqual(int(self.redis.get('sched:active:owner')), 1)
+
+    def test_touch_refreshes_the_running_jobs_slot(self):
+        self.scheduler.submit('first', 'owner', 5, ['first'], self.dispatch)
+        self.scheduler.submit('second', 'owner', 5, ['second'], self.dispatch)
+        for key in ('sched:active:owner', 'sched:held:owner', 'sched:job:first'):
+            self.redis.expire(key, 5)
+        self.scheduler.touch('first')
+        for key in ('sched:active:owner', 'sched:held:owner', 'sched:job:first'):
+            self.assertGreater(self.redis.ttl(key), 5)
+
+    def test_finalizing_a_non_zip_upload_releases_the_reservation(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        store = ChunkedUploadStore(self.redis, media_root)
+        state = store.create('scan.zip', 8, 'user:1', {'session_id': 'upload', 'stream': True},
+                             path=os.path.join(media_root, 'upload.part'))
+        store.write_chunk(state['upload_id'], 'user:1', 0, io.BytesIO(b'not zip!'), 8,
+                          hashlib.sha256(b'not zip!').hexdigest())
+        self.assertTrue(self.scheduler.reserve('upload', 'user:1'))
+
+        request = RequestFactory().post(f"/upload/{state['upload_id']}/finalize/")
+        request.user = SimpleNamespace(is_authenticated=True, pk=1)
+        with override_settings(MEDIA_ROOT=media_root), \
+                mock.patch.object(views, 'upload_store', store), \
+                mock.patch.object(views, 'job_scheduler', self.scheduler):
+            response = views.upload_finalize(request, state['upload_id'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.redis.exists('sched:active:user:1'))
+        self.assertTrue(self.scheduler.reserve('next upload', 'user:1'))
+
+
+class ExportCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.cache = ExportCache(self.directory, max_age=3600)
+
+    def build(self, session_id, version=1):
+        return self.cache.get_or_build(session_id, version, lambda f: f.write(b'xlsx'))
+
+    def test_building_removes_expired_exports(self):
+        expired, served = self.build('expired'), self.build('served')
+        old = time.time() - 7200
+        for path in (expired, served):
+            os.utime(path, (old, old))
+        self.build('served')
+        fresh = self.build('fresh')
+        self.assertFalse(os.path.exists(expired))
+        self.assertTrue(os.path.exists(served))
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_new_version_replaces_old(self):
+        first = self.build('session', 1)
+        second = self.build('session', 2)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class RowStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.store = RowStore(self.redis, ttl=600)
+        self.store.start('session', 'certificate', 'vanbang.xlsx')
+
+    def test_append_adds_rows_after_the_stored_ones_and_keeps_edits(self):
+        self.assertEqual(self.store.append('session', [{'Ho_ten': 'A'}, {'Ho_ten': 'B'}], 0, 1), 2)
+        self.store.update('session', [(0, 'Ho_ten', 'A sửa')])
+
+        self.assertEqual(self.store.append('session', [{'Ho_ten': 'C', 'Nganh': 'Luật'}], 1, 2), 3)
+        self.assertEqual(self.store.meta('session')['entries'], 2)
+        self.assertEqual(self.store.rows('session'),
+                         [{'Ho_ten': 'A sửa'}, {'Ho_ten': 'B'}, {'Ho_ten': 'C', 'Nganh': 'Luật'}])
+
+    def test_append_from_a_stale_offset_is_dropped(self):
+        # Two result pages read the same new entries; only the first stores them
+        self.store.append('session', [{'Ho_ten': 'A'}], 0, 1)
+        version = self.store.meta('session')['version']
+        self.assertEqual(self.store.append('session', [{'Ho_ten': 'A'}], 0, 1), 1)
+        self.assertEqual(self.store.meta('session')['version'], version)
+        self.assertEqual(self.store.rows('session'), [{'Ho_ten': 'A'}])
+
+    def test_entries_without_rows_advance_the_offset(self):
+        self.store.append('session', [], 0, 3)
+        meta = self.store.meta('session')
+        self.assertEqual((meta['count'], meta['entries'], meta['version']), (0, 3, 0))
+
+    def test_update_bumps_the_version(self):
+        self.store.append('session', [{'Thi': 5.0}], 0, 1)
+        version = self.store.meta('session')['version']
+        self.assertEqual(self.store.update('session', [(0, 'Thi', 7.5)]), version + 1)
+        self.assertEqual(self.store.meta('session')['version'], version + 1)
+        self.assertEqual(self.store.rows('session'), [{'Thi': 7.5}])
+
+    def test_rows_keep_column_order(self):
+        self.store.append('session', [{'Ho_ten': 'A', 'Date_birth_VN': '01/01/2000'},
+                                      {'Nganh': 'Luật', 'Ho_ten': 'B'}], 0, 2)
+        self.store.update('session', [(0, 'Ghi_chu', 'x')])
+        meta = self.store.meta('session')
+        self.assertEqual(meta['columns'], ['Ho_ten', 'Date_birth_VN', 'Nganh', 'Ghi_chu'])
+        self.assertEqual([list(row) for row in self.store.rows('session')],
+                         [['Ho_ten', 'Date_birth_VN', 'Ghi_chu'], ['Ho_ten', 'Nganh']])
+        self.assertEqual(self.store.rows('session', 1, 2), [{'Ho_ten': 'B', 'Nganh': 'Luật'}])
+        self.assertEqual((meta['processing_type'], meta['excel_filename']), ('certificate', 'vanbang.xlsx'))
+
+    def test_clear_removes_every_key(self):
+        self.store.append('session', [{'Ho_ten': str(i)} for i in range(2500)], 0, 1)
+        self.store.clear('session')
+        self.assertEqual(self.redis.keys('*'), [])
+        self.assertEqual(self.store.meta('session')['count'], 0)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class SessionResultTests(SimpleTestCase):
+    """The result page reads only the published entries its rows do not cover yet"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.store = RowStore(self.redis)
+        self.store.start('session', 'transcript', 'ketqua.xlsx')
+        patcher = mock.patch.multiple(views, redis_client=self.redis, row_store=self.store,
+                                      job_scheduler=JobScheduler(self.redis))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish(self, name, rows):
+        views.publish_image_results('session', [(name, {'filename': name, 'success': True,
+                                                        'data_count': len(rows), 'error': None}, rows)])
+
+    def show_results(self):
+        request = RequestFactory().get('/result/')
+        request.session = {'session_id': 'session'}
+        self.assertEqual(views.result_page(request).status_code, 200)
+        return self.store.rows('session')
+
+    def test_reads_entries_from_the_stored_offset(self):
+        self.publish('a.jpg', [{'Sbd': '00001', 'Thi': 5.0}])
+        self.publish('b.jpg', [{'Sbd': '00002', 'Thi': 6.0}, {'Sbd': '00003', 'Thi': 7.0}])
+        result = views.load_session_result('session')
+        self.assertEqual((len(result['data']), result['entries'], result['partial']), (3, 2, True))
+
+        self.publish('c.jpg', [{'Sbd': '00004', 'Thi': 8.0}])
+        result = views.load_session_result('session', 2)
+        self.assertEqual((result['data'], result['entries']), ([{'Sbd': '00004', 'Thi': 8.0}], 3))
+        self.assertEqual(sorted(r['filename'] for r in result['image_results']), ['a.jpg', 'b.jpg', 'c.jpg'])
+
+    def test_result_page_adds_only_new_rows(self):
+        self.assertIsNone(views.load_session_result('session'))
+        self.publish('a.jpg', [{'Sbd': '00001', 'Thi': 5.0}])
+        self.assertEqual(len(self.show_results()), 1)
+        self.store.update('session', [(0, 'Thi', 9.0)])
+
+        self.publish('b.jpg', [{'Sbd': '00002', 'Thi': 6.0}])
+        with mock.patch.object(self.redis, 'lrange', wraps=self.redis.lrange) as lrange:
+            rows = self.show_results()
+        lrange.assert_called_once_with('result_items:session', 1, -1)
+        self.assertEqual(rows, [{'Sbd': '00001', 'Thi': 9.0}, {'Sbd': '00002', 'Thi': 6.0}])
+
+        self.assertEqual(self.show_results(), rows)
+        self.assertEqual(self.store.meta('session')['entries'], 2)
+
+
+class ExcelExportTests(SimpleTestCase):
+    """Layout of the workbooks written by write_export, read back with openpyxl"""
+
+    def export(self, rows, processing_type):
+        target = io.BytesIO()
+        views.write_export(target, rows, processing_type)
+        target.seek(0)
+        return load_workbook(target).active
+
+    def assertHeader(self, sheet, row, columns):
+        cells = sheet[row]
+        self.assertEqual([cell.value for cell in cells], columns)
+        for cell in cells:
+            self.assertTrue(cell.font.b)
+            self.assertEqual((cell.border.left.style, cell.border.top.style), ('thin', 'thin'))
+            self.assertEqual(cell.alignment.horizontal, 'center')
+
+    def test_transcript_layout(self):
+        sheet = self.export([
+            {'Sbd': '123', 'Thi': '7.5'},
+            {'Sbd': 'abc', 'Thi': '9'},
+            {'Sbd': '00042', 'Thi': 'vắng'},
+            {'Sbd': '54321'},
+        ], 'transcript')
+        self.assertHeader(sheet, 1, views.TRANSCRIPT_COLUMNS)
+
+        sbd, thi = views.TRANSCRIPT_COLUMNS.index('SBD') + 1, views.TRANSCRIPT_COLUMNS.index('Thi') + 1
+        data = list(sheet.iter_rows(min_row=2))
+        # Rows with an invalid SBD are left out; TT keeps the position among all rows
+        self.assertEqual([row[0].value for row in data], [1, 3, 4])
+        self.assertEqual([row[sbd - 1].value for row in data], ['00123', '00042', '54321'])
+        self.assertEqual([row[thi - 1].value for row in data], [7.5, 0, 0])
+        for row in data:
+            self.assertEqual(row[sbd - 1].number_format, '@')
+            self.assertEqual(row[thi - 1].number_format, '0.0')
+            self.assertIsNone(row[1].value)
+
+    def test_certificate_layout(self):
+        sheet = self.export([
+            {'Ho_ten': 'Nguyễn Văn A', 'Date_birth_VN': '01/02/2000', 'Bang_cap': 'Cử nhân',
+             'Nganh': 'Kế toán', 'Noi_cap': 'Hà Nội'},
+            {'Ho_ten': 'Trần Thị B', 'Nganh': ''},
+        ], 'certificate')
+        # start_row=9: nine blank rows above the header
+        self.assertTrue(all(cell.value is None for row in sheet.iter_rows(max_row=9) for cell in row))
+        self.assertHeader(sheet, 10, views.CERTIFICATE_COLUMNS)
+        data = [[cell.value for cell in row] for row in sheet.iter_rows(min_row=11)]
+        self.assertEqual(data[0][:11], [1, 'Viện ĐT&PT học tập suốt đời', None, None, None, 'Nguyễn Văn A',
+                                        '01/02/2000', None, 'Cử nhân', 'Kế toán', 'Hà Nội'])
+        self.assertEqual(data[1][:11], [2, 'Viện ĐT&PT học tập suốt đời', None, None, None, 'Trần Thị B',
+                                        None, None, None, None, None])
+        self.assertEqual(len(data), 2)
+
+    def test_unknown_processing_type(self):
+        with self.assertRaises(ValueError):
+            views.write_export(io.BytesIO(), [], 'receipt')
+
+    @skipUnless(fakeredis, "fakeredis is not installed")
+    def test_edit_invalidates_the_cached_export(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        store = RowStore(fakeredis.FakeRedis())
+        cache = ExportCache(directory, max_age=3600)
+        store.start('session', 'transcript', 'ketqua.xlsx')
+        store.append('session', [{'Sbd': '00001', 'Thi': 5.0}, {'Sbd': '00002', 'Thi': 6.0}], 0, 1)
+
+        factory = RequestFactory()
+
+        def download():
+            request = factory.get('/download/')
+            request.session = {'session_id': 'session'}
+            response = views.download_excel(request)
+            self.addCleanup(response.close)
+            content = b''.join(response.streaming_content)
+            return response.filename, load_workbook(io.BytesIO(content)).active
+
+        with mock.patch.object(views, 'row_store', store), mock.patch.object(views, 'export_cache', cache):
+            _, sheet = download()
+            self.assertEqual(sheet['L2'].value, 5.0)
+            first = os.listdir(directory)
+            _, sheet = download()
+            self.assertEqual(os.listdir(directory), first)
+
+            request = factory.post('/edit/', json.dumps([{'row_index': 0, 'field_name': 'Thi', 'new_value': '8.5'}]),
+                                   content_type='application/json')
+            request.session = {'session_id': 'session'}
+            self.assertEqual(json.loads(views.edit_record(request).content), [{'success': True, 'row_index': 0}])
+
+            filename, sheet = download()
+            self.assertEqual(filename, 'ketqua.xlsx')
+            self.assertEqual((sheet['L2'].value, sheet['L3'].value), (8.5, 6.0))
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertNotEqual(os.listdir(directory), first)
+
+
+class UnseekableWriter(io.RawIOBase):
+    """Write-only stream without seek/tell, so zipfile writes data descriptors"""
+
+    def __init__(self):
+        self.output = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.output.write(data)
+
+
+def build_zip(entries, compression=zipfile.ZIP_DEFLATED, seekable=True, force_zip64=False):
+    """ZIP bytes with (name, data) entries, written the way zipfile does it"""
+    stream = io.BytesIO() if seekable else UnseekableWriter()
+    with zipfile.ZipFile(stream, 'w', compression) as zf:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, (2024, 1, 1, 0, 0, 0))
+            info.compress_type = compression
+            with zf.open(info, 'w', force_zip64=force_zip64) as f:
+                f.write(data)
+    return (stream if seekable else stream.output).getvalue()
+
+
+ZIP_ENTRIES = [
+    ('scan_01.jpg', b'\xff\xd8' + bytes(range(256)) * 40),
+    ('thư mục/ảnh 02.png', b'\x89PNG' + b'abc' * 3000),
+    ('empty.txt', b''),
+]
+
+
+class ZipStreamTests(SimpleTestCase):
+    """Local-header scanning finds the entries and bytes zipfile reads from the central directory"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def save(self, data):
+        path = os.path.join(self.directory, 'upload.zip')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def scan(self, data, offset=0, available=None):
+        return scan_local_entries(io.BytesIO(data), offset, len(data) if available is None else available)
+
+    def assertMatchesZipfile(self, data):
+        path = self.save(data)
+        entries, offset, finished = self.scan(data)
+        self.assertTrue(finished)
+        with zipfile.ZipFile(path) as zf:
+            infos = zf.infolist()
+            self.assertEqual([e.filename for e in entries], [info.filename for info in infos])
+            self.assertEqual([e.header_offset for e in entries], [info.header_offset for info in infos])
+            for entry, info in zip(entries, infos):
+                self.assertEqual((entry.file_size, entry.compress_size, entry.crc),
+                                 (info.file_size, info.compress_size, info.CRC))
+                self.assertEqual(read_local_entry(path, entry), zf.read(info))
+
+    def test_stored_entries(self):
+        self.assertMatchesZipfile(build_zip(ZIP_ENTRIES, zipfile.ZIP_STORED))
+
+    def test_deflated_entries(self):
+        self.assertMatchesZipfile(build_zip(ZIP_ENTRIES))
+
+    def test_zip64_sizes(self):
+        data = build_zip(ZIP_ENTRIES, force_zip64=True)
+        entries, _, _ = self.scan(data)
+        self.assertEqual([e.file_size for e in entries], [len(d) for _, d in ZIP_ENTRIES])
+        self.assertMatchesZipfile(data)
+
+    def test_cp437_and_utf8_names(self):
+        # zipfile writes non-ASCII names as UTF-8 with flag 0x800; older tools write cp437
+        data = build_zip([('A.jpg', b'cp437'), ('Ảnh.jpg', b'utf-8')])
+        data = data.replace(b'A.jpg', '\u00c7.jpg'.encode('cp437'))
+        entries, _, _ = self.scan(data)
+        self.assertEqual([e.filename for e in entries], ['\u00c7.jpg', 'Ảnh.jpg'])
+        self.assertMatchesZipfile(data)
+
+    def test_stops_at_data_descriptor(self):
+        data = build_zip(ZIP_ENTRIES, seekable=False)
+        self.assertEqual(self.scan(data), ([], 0, True))
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertTrue(all(info.flag_bits & 0x08 for info in zf.infolist()))
+
+    def test_stops_at_encrypted_entry(self):
+        data = bytearray(build_zip(ZIP_ENTRIES))
+        with zipfile.ZipFile(io.BytesIO(bytes(data))) as zf:
+            second = zf.infolist()[1].header_offset
+        data[second + 6] |= 0x01
+        entries, offset, finished = self.scan(bytes(data))
+        self.assertEqual([e.filename for e in entries], ['scan_01.jpg'])
+        self.assertEqual((offset, finished), (second, True))
+
+    def test_truncated_prefixes_resume_to_the_same_entries(self):
+        data = build_zip(ZIP_ENTRIES)
+        expected, _, _ = self.scan(data)
+        for available in range(0, len(data) + 1, 97):
+            with self.subTest(available=available):
+                entries, offset, finished = self.scan(data, 0, available)
+                self.assertFalse(finished and available < expected[-1].data_offset)
+                self.assertTrue(all(e.data_offset + e.compress_size <= available for e in entries))
+                rest, _, finished = self.scan(data, offset)
+                self.assertEqual(entries + rest, expected)
+                self.assertTrue(finished)
+
+    def test_inflate_checks_crc_and_size(self):
+        content = b'image bytes' * 100
+        raw = zlib.compress(content)[2:-4]
+        self.assertEqual(inflate_entry(raw, 'a.jpg', zipfile.ZIP_DEFLATED, len(content), zlib.crc32(content)),
+                         content)
+        with self.assertRaises(zipfile.BadZipFile):
+            inflate_entry(raw, 'a.jpg', zipfile.ZIP_DEFLATED, len(content), zlib.crc32(content) ^ 1)
+        with self.assertRaises(zipfile.BadZipFile):
+            inflate_entry(content, 'a.jpg', zipfile.ZIP_STORED, len(content) - 1, zlib.crc32(content))
+        with self.assertRaises(zipfile.BadZipFile):
+            inflate_entry(raw, 'a.jpg', zipfile.ZIP_BZIP2, len(content), zlib.crc32(content))
+
+
+class ZipArchiveTests(SimpleTestCase):
+    """ZipArchive reads the same image entries and bytes as zipfile"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def save(self, entries, **kwargs):
+        path = os.path.join(self.directory, 'upload.zip')
+        with open(path, 'wb') as f:
+            f.write(build_zip(entries, **kwargs))
+        return path
+
+    def assertReadsLikeZipfile(self, path, mapped=True, workers=4):
+        with zipfile.ZipFile(path) as zf, ZipArchive(path) as archive:
+            expected = [(info.filename, zf.read(info)) for info in zf.infolist()
+                        if is_zip_image_name(info.filename)]
+            self.assertEqual([(e.filename, archive.read(e)) for e in archive.images], expected)
+            self.assertEqual([archive.read(name) for name, _ in expected], [data for _, data in expected])
+            self.assertEqual(list(archive.read_ahead(archive.images, workers)),
+                             [(data, None) for _, data in expected])
+            self.assertEqual(archive._map is not None, mapped)
+            self.assertEqual(not archive._handles, mapped)
+
+    def test_stored_and_deflated_entries_from_the_map(self):
+        for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with self.subTest(compression=compression):
+                self.assertReadsLikeZipfile(self.save(ZIP_ENTRIES, compression=compression))
+
+    def test_other_compression_uses_a_zipfile_handle(self):
+        for compression in (zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA):
+            with self.subTest(compression=compression):
+                self.assertReadsLikeZipfile(self.save(ZIP_ENTRIES, compression=compression), mapped=False)
+
+    def test_only_image_entries(self):
+        path = self.save([
+            ('a.jpg', b'a'), ('B.JPEG', b'b'), ('c.webp', b'c'), ('notes.txt', b'n'),
+            ('__MACOSX/._a.jpg', b'm'), ('.hidden.png', b'h'), ('dir/.thumb.png', b't'), ('dir/d.png', b'd'),
+        ])
+        with ZipArchive(path) as archive:
+            self.assertEqual([e.filename for e in archive.images], ['a.jpg', 'B.JPEG', 'c.webp', 'dir/d.png'])
+            self.assertNotIn('notes.txt', archive)
+            with self.assertRaises(KeyError):
+                archive.getinfo('notes.txt')
+        self.assertReadsLikeZipfile(path)
+
+    def test_read_ahead_reports_errors_in_order(self):
+        data = bytearray(build_zip([('a.jpg', b'a' * 5000), ('b.jpg', b'b' * 5000), ('c.jpg', b'c' * 5000)],
+                                   compression=zipfile.ZIP_STORED))
+        with zipfile.ZipFile(io.BytesIO(bytes(data))) as zf:
+            broken = zf.getinfo('b.jpg')
+        data[broken.header_offset + 30 + len('b.jpg') + 100] ^= 0xFF
+        path = os.path.join(self.directory, 'broken.zip')
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        for workers in (1, 4):
+            with self.subTest(workers=workers), ZipArchive(path) as archive:
+                outcomes = list(archive.read_ahead(archive.images, workers))
+                self.assertEqual([image for image, _ in outcomes], [b'a' * 5000, None, b'c' * 5000])
+                self.assertIsNone(outcomes[0][1])
+                self.assertIsInstance(outcomes[1][1], zipfile.BadZipFile)
+                self.assertIsNone(outcomes[2][1])
+
+
+class FakeAsyncLLM:
+    """ainvoke() answering per image: 'ok' returns one row, 'slow' never answers"""
+
+    def __init__(self):
+        self.calls = []
+        self.cancelled = []
+
+    async def ainvoke(self, messages):
+        image = messages[0].content[1]['data']
+        self.calls.append(image)
+        if image == b'ok':
+            return SimpleNamespace(content=json.dumps({'items': [{'Sbd': '12345', 'Thi': 8}]}))
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(image)
+            raise
+
+
+class AsyncEngineTests(SimpleTestCase):
+    """aprocess_zip_file with a fake LLM: per-request deadline, job deadline and cancellation"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.zip_path = os.path.join(directory, 'upload.zip')
+        with open(self.zip_path, 'wb') as f:
+            f.write(build_zip([('a.jpg', b'ok'), ('b.jpg', b'slow'), ('c.jpg', b'ok')]))
+
+        self.llm = FakeAsyncLLM()
+        self.published = []
+        patcher = mock.patch.multiple(
+            async_engine,
+            get_async_llm=lambda *args, **kwargs: self.llm,
+            rate_limiter=SimpleNamespace(acquire=lambda *args: None),
+            prepare_image=lambda data, filename, *args: ('key', data, filename),
+            get_cached_result=lambda *args: None,
+            build_items_result=lambda items, filename, image_path, key: {
+                'success': True, 'data': items, 'filename': filename, 'image_path': image_path},
+            publish_image_results=lambda session_id, outcomes: self.published.extend(outcomes),
+            update_progress=lambda *args, **kwargs: None,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_engine(self, **kwargs):
+        return asyncio.run(async_engine.aprocess_zip_file(self.zip_path, 'key', 'transcript', 'session', **kwargs))
+
+    def test_request_deadline_fails_only_the_slow_image(self):
+        data, results = self.run_engine(request_deadline=0.2, job_deadline=30)
+        by_name = {r['filename']: r for r in results}
+        self.assertEqual(data, [{'Sbd': '12345', 'Thi': 8.0}] * 2)
+        self.assertTrue(by_name['a.jpg']['success'] and by_name['c.jpg']['success'])
+        self.assertFalse(by_name['b.jpg']['success'])
+        self.assertIn('0.2s', by_name['b.jpg']['error'])
+        # Two attempts, each cancelled by wait_for at the deadline
+        self.assertEqual(self.llm.calls.count(b'slow'), 2)
+        self.assertEqual(self.llm.cancelled, [b'slow', b'slow'])
+        self.assertEqual(sorted(name for name, _, _ in self.published), ['a.jpg', 'b.jpg', 'c.jpg'])
+
+    def test_job_deadline_cancels_unfinished_images(self):
+        data, results = self.run_engine(request_deadline=30, job_deadline=0.2)
+        by_name = {r['filename']: r for r in results}
+        self.assertEqual(len(data), 2)
+        self.assertEqual(by_name['b.jpg'], {'filename': 'b.jpg', 'success': False,
+                                            'error': 'Hết thời gian xử lý', 'data_count': 0})
+        self.assertEqual(self.llm.cancelled, [b'slow'])
+        # Timed-out images are not checkpointed, so a resumed job retries them
+        self.assertEqual(sorted(name for name, _, _ in self.published), ['a.jpg', 'c.jpg'])
+
+    def test_completed_entries_are_skipped(self):
+        data, results = self.run_engine(request_deadline=0.2, completed={'b.jpg'})
+        self.assertEqual(sorted(r['filename'] for r in results), ['a.jpg', 'c.jpg'])
+        self.assertNotIn(b'slow', self.llm.calls)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class ProgressEventsTests(SimpleTestCase):
+    """The SSE progress stream ends when the job completes or fails"""
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        self.async_redis = fakeredis.aioredis.FakeRedis(server=server)
+        self.progress = {'current': 1, 'total': 4, 'percentage': 25.0, 'message': 'Xử lý 4 ảnh...'}
+        patcher = mock.patch.multiple(
+            views,
+            redis_client=self.redis,
+            aioredis=SimpleNamespace(Redis=SimpleNamespace(from_url=lambda url: self.async_redis)),
+            get_progress=lambda session_id: dict(self.progress),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, *updates):
+        """Data frames of progress_events, publishing `updates` once the stream is subscribed"""
+        async def collect():
+            events = views.progress_events('session')
+            frames = [await events.__anext__()]
+            for current, total, message, extra in updates:
+                views.update_progress('session', current, total, message, extra)
+            frames += [frame async for frame in events]
+            return frames
+
+        frames = asyncio.run(asyncio.wait_for(collect(), timeout=10))
+        return [json.loads(frame[len('data: '):]) for frame in frames if frame.startswith('data: ')]
+
+    def test_ends_when_the_job_fails(self):
+        frames = self.stream((2, 4, '✓ a.jpg', None), (0, 0, 'Lỗi: hết hạn mức', {'status': 'error'}))
+        self.assertEqual([frame['message'] for frame in frames],
+                         ['Xử lý 4 ảnh...', '✓ a.jpg', 'Lỗi: hết hạn mức'])
+        self.assertEqual(frames[-1]['status'], 'error')
+
+    def test_ends_when_the_job_completes(self):
+        frames = self.stream((4, 4, 'Xong! 4/4 ảnh', {'status': 'done'}))
+        self.assertEqual([frame['percentage'] for frame in frames], [25.0, 100.0])
+
+    def test_ends_at_once_for_a_finished_job(self):
+        self.progress = {'current': 0, 'total': 0, 'percentage': 0, 'message': 'Lỗi: x', 'status': 'error'}
+        self.assertEqual(len(self.stream()), 1)
+
+    def test_progress_stream_needs_asgi(self):
+        factory = RequestFactory()
+        response = asyncio.run(views.progress_stream(factory.get('/progress_stream/', {'session_id': 'session'})))
+        self.assertEqual(response.status_code, 503)
+        response = asyncio.run(views.progress_stream(factory.get('/progress_stream/')))
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class ChunkedUploadStoreTests(SimpleTestCase):
+    """Chunks land at their offsets only once verified"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.redis = fakeredis.FakeRedis()
+        self.store = ChunkedUploadStore(self.redis, self.directory, chunk_size=4)
+        self.data = b'0123456789'
+        self.state = self.store.create('scan.zip', len(self.data), 'owner', {'session_id': 'upload'})
+
+    def write(self, index, data=None, sha256=None):
+        data = self.data[index * 4:index * 4 + 4] if data is None else data
+        return self.store.write_chunk(self.state['upload_id'], 'owner', index, io.BytesIO(data), len(data),
+                                      sha256 or hashlib.sha256(data).hexdigest())
+
+    def file_bytes(self):
+        with open(self.state['path'], 'rb') as f:
+            return f.read()
+
+    def test_chunks_written_out_of_order(self):
+        self.write(2)
+        self.write(0)
+        self.write(1)
+        self.assertEqual(self.file_bytes(), self.data)
+
+    def test_resume_from_the_verified_prefix(self):
+        state = self.write(0)
+        self.assertEqual(self.store.contiguous_bytes(state), 4)
+        state = self.write(2)
+        self.assertEqual(state['received'], [0, 2])
+        self.assertEqual(self.store.contiguous_bytes(state), 4)
+
+        # After an interruption the client asks what arrived and sends the gap
+        state = self.store.get(self.state['upload_id'], 'owner')
+        self.assertEqual(state['received'], [0, 2])
+        state = self.write(1)
+        self.assertEqual(self.store.contiguous_bytes(state), len(self.data))
+
+    def test_checksum_mismatch_writes_nothing(self):
+        with self.assertRaises(UploadError):
+            self.write(0, b'XXXX', hashlib.sha256(b'0123').hexdigest())
+        self.assertEqual(self.file_bytes(), bytes(len(self.data)))
+        self.assertEqual(self.store.get(self.state['upload_id'], 'owner')['received'], [])
+
+    def test_short_body_is_rejected(self):
+        with self.assertRaises(UploadError):
+            self.store.write_chunk(self.state['upload_id'], 'owner', 0, io.BytesIO(b'01'), 4,
+                                   hashlib.sha256(b'01').hexdigest())
+        self.assertEqual(self.store.get(self.state['upload_id'], 'owner')['received'], [])
+
+    def test_verified_chunk_is_not_overwritten(self):
+        self.write(0)
+        self.write(0)
+        with self.assertRaises(UploadError):
+            self.write(0, b'XXXX')
+        self.assertEqual(self.file_bytes()[:4], b'0123')
+        self.assertEqual(self.store.get(self.state['upload_id'], 'owner')['received'], [0])
+
+    def test_complete_moves_the_file_and_forgets_the_upload(self):
+        self.write(0)
+        self.write(1)
+        with self.assertRaises(UploadError):
+            self.store.complete(self.state['upload_id'], 'owner', os.path.join(self.directory, 'scan.zip'))
+        self.write(2)
+
+        target = os.path.join(self.directory, 'scan.zip')
+        self.store.complete(self.state['upload_id'], 'owner', target)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(self.state['path']))
+        self.assertEqual(self.redis.keys('upload:*') + self.redis.keys('upload_digests:*'), [])
+        with self.assertRaises(UploadError):
+            self.store.get(self.state['upload_id'], 'owner')
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class ChunkedUploadPurgeTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.redis = fakeredis.FakeRedis()
+        self.store = ChunkedUploadStore(self.redis, self.directory, chunk_size=4)
+
+    def test_purges_only_expired_uploads(self):
+        expired = self.store.create('old.zip', 8, 'owner', {'session_id': 'old'})
+        active = self.store.create('new.zip', 8, 'owner', {'session_id': 'new'})
+        self.redis.delete(f"upload:{expired['upload_id']}")
+
+        self.assertEqual(self.store.purge_abandoned(), [{'session_id': 'old'}])
+        self.assertFalse(os.path.exists(expired['path']))
+        self.assertTrue(os.path.exists(active['path']))
+        self.assertEqual(self.store.purge_abandoned(), [])
+
+    def test_completed_upload_is_not_purged(self):
+        state = self.store.create('done.zip', 4, 'owner', {'session_id': 'done'})
+        self.store.write_chunk(state['upload_id'], 'owner', 0, io.BytesIO(b'data'), 4,
+                               hashlib.sha256(b'data').hexdigest())
+        target = os.path.join(self.directory, 'done.zip')
+        self.store.complete(state['upload_id'], 'owner', target)
+
+        self.assertEqual(self.store.purge_abandoned(), [])
+        self.assertTrue(os.path.exists(target))
+
+
+class DateNormalizerTests(SimpleTestCase):
+    """normalize_date keeps every format clean_date_string accepted and adds OCR variants"""
+
+    def assertNormalized(self, cases):
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(normalize_date(value), expected)
+
+    def test_previous_formats(self):
+        self.assertNormalized([
+            ('12/05/2000', '12/05/2000'),
+            ('1/2/2000', '01/02/2000'),
+            ('01-02-2000', '01/02/2000'),
+            ('01.02.2000', '01/02/2000'),
+            ('2000-02-01', '01/02/2000'),
+            ('  29/02/2004  ', '29/02/2004'),
+            ('5 tháng 3 năm 2000', '05/03/2000'),
+            ('05 THÁNG 03 NĂM 1999', '05/03/1999'),
+        ])
+
+    def test_ocr_variants(self):
+        self.assertNormalized([
+            ('Ngày 05 tháng 03 năm 2000', '05/03/2000'),
+            ('ngày 5 tháng 3 năm 2000 tại Hà Nội', '05/03/2000'),
+            ('ngay 5 thang 3 nam 2000', '05/03/2000'),
+            (unicodedata.normalize('NFD', '5 tháng 3 năm 2000'), '05/03/2000'),
+            ('12 / 05 / 2000', '12/05/2000'),
+            ('12 05 2000', '12/05/2000'),
+            ('12/05-2000', '12/05/2000'),
+            ('12/05/2000.', '12/05/2000'),
+            ('Ngày 12/05/2000', '12/05/2000'),
+            ('2000/5/1', '01/05/2000'),
+            ('12/05/99', '12/05/1999'),
+        ])
+
+    def test_rejects_non_dates(self):
+        self.assertNormalized([
+            ('31/02/2000', ''),
+            ('1/13/2000', ''),
+            ('12/05/20000', ''),
+            ('32 tháng 1 năm 2000', ''),
+            ('không rõ', ''),
+            ('', ''),
+            (None, ''),
+            (20000512, ''),
+        ])
+
+    def test_two_digit_years_are_not_in_the_future(self):
+        this_year = datetime.date.today().year
+        self.assertEqual(expand_year(this_year % 100), this_year)
+        self.assertEqual(expand_year((this_year + 1) % 100), this_year - 99)
+        self.assertEqual(expand_year(1987), 1987)
+
+    def test_repeated_values_are_memoized(self):
+        _normalize.cache_clear()
+        for _ in range(3):
+            normalize_date('7/8/1990')
+        info = _normalize.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 2))
+
+    def test_series_matches_scalar(self):
+        values = pd.Series(['1/2/2000', None, 5, '1/2/2000', float('nan'), '3 tháng 4 năm 2001'],
+                           index=list('abcdef'), name='Date_birth_VN')
+        result = normalize_date_series(values)
+        self.assertEqual(result.tolist(), [normalize_date(v) for v in values])
+        self.assertEqual(list(result.index), list('abcdef'))
+        self.assertEqual(result.name, 'Date_birth_VN')
+
+    def test_clean_date_string_uses_normalizer(self):
+        self.assertEqual(clean_date_string('ngày 1 tháng 2 năm 2003'), '01/02/2003')
+
+
+def process_transcript_by_row(df):
+    """process_transcript_dataframe as it was, with clean_sbd applied per row"""
+    if df.empty:
+        return df
+    df['Sbd'] = df['Sbd'].astype(str).apply(clean_sbd)
+    return df[df['Sbd'].apply(lambda x: len(x) == 5 and x.isdigit())]
+
+
+class TranscriptSBDTests(SimpleTestCase):
+    """The vectorized SBD cleaning gives the frame the per-row apply gave"""
+
+    def assertSameAsByRow(self, sbd):
+        df = pd.DataFrame({'Sbd': sbd, 'Ho_ten': [f'Thí sinh {i}' for i in range(len(sbd))],
+                           'Diem': [float(i) for i in range(len(sbd))]},
+                          index=range(10, 10 + len(sbd)))
+        expected = process_transcript_by_row(df.copy())
+        actual = process_transcript_dataframe(df.copy())
+        self.assertTrue(actual.equals(expected), f"\n{actual}\n!=\n{expected}")
+        self.assertEqual(list(actual.index), list(expected.index))
+
+    def test_string_values(self):
+        self.assertSameAsByRow([
+            '01234', '12345', '1234', '7', '123456789', '12-345', ' 12 345 ', 'SBD: 00042', '',
+            'abc', 'None', '٠١٢٣٤', '¹²³⁴⁵', '1234a', '00000',
+        ])
+
+    def test_missing_values(self):
+        self.assertSameAsByRow(['12345', None, float('nan'), '', '54321'])
+
+    def test_float_and_int_columns(self):
+        self.assertSameAsByRow([1234.0, 12345.0, float('nan'), 7.5, 123456.0])
+        self.assertSameAsByRow([1, 12345, 123456, 0])
+
+    def test_all_valid_and_all_invalid(self):
+        self.assertSameAsByRow(['00001', '00002', '99999'])
+        self.assertSameAsByRow(['', 'abc', None])
+
+    def test_empty_frame(self):
+        df = pd.DataFrame({'Sbd': []})
+        self.assertTrue(process_transcript_dataframe(df.copy()).equals(process_transcript_by_row(df.copy())))
+
+
+class SpellingCorrectorTests(SimpleTestCase):
+    """Dictionary fixes for OCR'd names, majors and issuers"""
+
+    ENTRIES = ['Hà Nội', 'cái nôi', 'công nghệ', 'thông tin', 'kỹ thuật', 'thuột', 'xuẩn',
+               'hiền', 'hiện']
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as f:
+            f.write('\n'.join(self.ENTRIES * 2 + ['thuật', 'kỹ thuật'] + ['Xuân'] * 20))
+        self.addCleanup(os.remove, f.name)
+        self.corrector = SpellingCorrector.from_files([f.name], max_distance=1)
+
+    def test_read_dictionary(self):
+        counts, bigrams = read_dictionary([])
+        self.assertEqual((len(counts), bigrams), (0, set()))
+        self.assertEqual(self.corrector.counts['thuật'], 4)
+        self.assertIn('hà nội', self.corrector.bigrams)
+        self.assertIn('Hà', self.corrector)
+
+    def test_edit_distance(self):
+        for a, b, expected in [('thuật', 'thuật', 0), ('thuât', 'thuật', 1), ('thuat', 'thuật', 1),
+                               ('thuật', 'tuhật', 1), ('thuật', 'thật', 1), ('thuật', 'thuậtt', 1),
+                               ('thuật', 'thuộc', 2), ('ab', 'abcd', 2)]:
+            with self.subTest(a=a, b=b):
+                self.assertEqual(edit_distance(a, b, 1), min(expected, 2))
+                self.assertEqual(edit_distance(a, b, 3), expected)
+
+    def test_lookup_prefers_diacritic_fixes(self):
+        suggestions = self.corrector.lookup('xuan')
+        self.assertEqual([(s.term, s.distance, s.count) for s in suggestions],
+                         [('xuân', 1, 20), ('xuẩn', 1, 2)])
+
+    def test_fixes_words_missing_from_dictionary(self):
+        self.assertEqual(self.corrector.correct_text('KỸ THUÂT'), ('KỸ THUẬT', [('THUÂT', 'THUẬT')], []))
+        self.assertEqual(self.corrector.correct_word('Xuan'), 'Xuân')
+
+    def test_ambiguous_words_are_kept(self):
+        self.assertEqual(self.corrector.correct_text('Hièn'), ('Hièn', [], []))
+
+    def test_context_fixes_are_proposed(self):
+        self.assertEqual(self.corrector.correct_text('Hà Nôi'), ('Hà Nôi', [], [('Nôi', 'Nội')]))
+        self.assertEqual(self.corrector.correct_text('Hà Nôi', apply_context=True)[0], 'Hà Nội')
+        self.assertEqual(self.corrector.correct_text('Công nghê thông tin', apply_context=True)[0],
+                         'Công nghệ thông tin')
+
+    def test_correct_text_keeps_other_characters(self):
+        self.assertEqual(self.corrector.correct_text('  TP. Hà Nội - 2020 ')[0], '  TP. Hà Nội - 2020 ')
+        self.assertEqual(self.corrector.correct_text(''), ('', [], []))
+
+
+class CertificateFieldCorrectionTests(SimpleTestCase):
+    """Against the bundled word lists: majors and issuers are fixed, names never are"""
+
+    NAMES = ['Giàng A Páo', 'Hờ A Dình', 'Lò Văn Pọm', "Ksor H'Bia", 'Vàng Thị Mỷ', 'Sùng Mí Chớ',
+             'Nguyễn Thị Ngọc Diệp']
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.corrector = SpellingCorrector.from_files(settings.OCR_DICTIONARY_FILES, max_distance=1)
+
+    def test_rare_and_minority_names_are_kept(self):
+        for name in self.NAMES:
+            with self.subTest(name=name):
+                item = {"Ho_ten": name, "Nganh": "Kế toán", "Noi_cap": "Sở Giáo dục và Đào tạo"}
+                self.assertEqual(correct_certificate_fields(item, self.corrector)["Ho_ten"], name)
+
+    def test_major_and_issuer_are_fixed(self):
+        item = {"Ho_ten": "Giàng A Páo", "Nganh": "Kỹ thuât phần mềm", "Noi_cap": "Sở Giáo dục và Đào tạọ"}
+        item = correct_certificate_fields(item, self.corrector)
+        self.assertEqual((item["Nganh"], item["Noi_cap"]), ("Kỹ thuật phần mềm", "Sở Giáo dục và Đào tạo"))
+
+
+class CompiledDictionaryTests(SimpleTestCase):
+    """The memory-mapped index answers like the tables parsed from the word lists"""
+
+    ENTRIES = SpellingCorrectorTests.ENTRIES + ['thuật', 'kỹ thuật'] + ['Xuân'] * 20
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, 'words.txt')
+        self.write_source(self.ENTRIES)
+        self.index_path = os.path.join(self.directory, 'index', 'words.idx')
+
+    def write_source(self, entries):
+        with open(self.source, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(entries))
+
+    def load(self):
+        compiled = load_dictionary([self.source], self.index_path, 1)
+        self.addCleanup(compiled.close)
+        return compiled
+
+    def test_matches_parsed_tables(self):
+        compiled = self.load()
+        parsed = SpellingCorrector.from_files([self.source], max_distance=1)
+        self.assertEqual(len(compiled.counts), len(parsed.counts))
+        for word, count in parsed.counts.items():
+            self.assertEqual(compiled.counts[word], count)
+        for bigram in parsed.bigrams:
+            self.assertIn(bigram, compiled.bigrams)
+        for key, entry in parsed.deletes.items():
+            words = [entry] if isinstance(entry, str) else entry
+            self.assertEqual(sorted(compiled.deletes.get(key)), sorted(words))
+        self.assertNotIn('xuan', compiled.counts)
+        self.assertIsNone(compiled.counts.get('xuan'))
+        self.assertNotIn('nội hà', compiled.bigrams)
+        self.assertIsNone(compiled.deletes.get('qqq'))
+
+        corrector = SpellingCorrector.from_compiled(compiled)
+        for text in ['KỸ THUÂT', 'Xuan', 'Hièn', 'Hà Nôi', 'Công nghê thông tin']:
+            with self.subTest(text=text):
+                self.assertEqual(corrector.correct_text(text, apply_context=True),
+                                 parsed.correct_text(text, apply_context=True))
+
+    def test_rebuilt_only_when_source_changes(self):
+        fingerprint = self.load().fingerprint
+        mtime = os.stat(self.index_path).st_mtime_ns
+        self.assertEqual(self.load().fingerprint, fingerprint)
+        self.assertEqual(os.stat(self.index_path).st_mtime_ns, mtime)
+
+        self.write_source(self.ENTRIES + ['Hà Tĩnh'])
+        compiled = self.load()
+        self.assertNotEqual(compiled.fingerprint, fingerprint)
+        self.assertIn('tĩnh', compiled.counts)
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            CompiledDictionary(self.source)
+
+    def test_get_corrector_reloads_changed_files(self):
+        corrector = get_corrector([self.source], index_path=self.index_path, max_distance=1)
+        self.assertIs(get_corrector([self.source], index_path=self.index_path, max_distance=1), corrector)
+        self.assertNotIn('tĩnh', corrector)
+
+        self.write_source(self.ENTRIES + ['Hà Tĩnh'])
+        os.utime(self.source, ns=(0, 0))
+        reloaded = get_corrector([self.source], index_path=self.index_path, max_distance=1)
+        self.assertIsNot(reloaded, corrector)
+        self.assertIn('tĩnh', reloaded)
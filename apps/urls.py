@@ -7,8 +7,13 @@ from . import views
 urlpatterns = [
     path('', views.upload_file, name='home'),
     path('upload/', views.upload_file, name='upload_file'),
+    path('upload/chunked/', views.upload_init, name='upload_init'),
+    path('upload/chunked/<str:upload_id>/', views.upload_status, name='upload_status'),
+    path('upload/chunked/<str:upload_id>/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('upload/chunked/<str:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
     path('result/', views.result_page, name='result_page'),
     path('get_progress/', views.get_progress_status, name='get_progress_status'),
+    path('progress_stream/', views.progress_stream, name='progress_stream'),
     path('edit_record/', views.edit_record, name='edit_record'),
     path('replace_image/', views.replace_image, name='replace_image'),
     path('download_excel/', views.download_excel, name='download_excel'),
@@ -1,34 +1,99 @@
 import os
 import zipfile
-import io
 import json
 import time
 import re
 import base64
 import pandas as pd
 import logging
-import datetime
 import uuid
+import hashlib
+import shutil
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse
 from django.conf import settings
-from openpyxl.utils import get_column_letter
-from .forms import UploadZipForm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from .forms import UploadZipForm, ChunkedUploadInitForm
+from .ocr_cache import OCRResultCache
+from .llm_pool import get_llm
+from .concurrency import AIMDLimiter, is_overload_error
+from .rate_limit import RedisTokenBucket
+from .pipeline import run_pipeline
+from .imaging import ImagePreprocessor, image_mime_type
+from .scheduling import JobScheduler
+from .chunked_upload import ChunkedUploadStore, UploadError
+from .row_store import RowStore
+from .excel_export import ExportCache, XLSX_CONTENT_TYPE, write_xlsx
+from .zip_stream import scan_local_entries
+from .zip_archive import ZipArchive, is_zip_image_name
+from .date_normalizer import normalize_date
+from .spelling import get_corrector
 from django.views.decorators.csrf import csrf_exempt
-from PIL import Image
-from django.core.files.storage import default_storage
+from django.core.files.storage import default_storage, FileSystemStorage
 from django.core.files.base import ContentFile
 import redis
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 
 # Redis client
 redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
 
+# OCR result cache
+ocr_cache = OCRResultCache(
+    redis_client,
+    getattr(settings, 'OCR_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'ocr')),
+    ttl=getattr(settings, 'OCR_CACHE_TTL', 7 * 24 * 3600),
+    max_entries=getattr(settings, 'OCR_CACHE_MAX_ENTRIES', 10000)
+)
+
+# In-flight LLM requests, shared by all images in this worker process
+llm_limiter = AIMDLimiter(
+    initial=getattr(settings, 'OCR_LLM_CONCURRENCY_INITIAL', 3),
+    max_limit=getattr(settings, 'OCR_LLM_CONCURRENCY_MAX', 12),
+    latency_target=getattr(settings, 'OCR_LLM_LATENCY_TARGET', 20.0)
+)
+
+# OCR image preprocessing off the network threads
+image_preprocessor = ImagePreprocessor(
+    getattr(settings, 'OCR_PREPROCESS_PROCESSES', None),
+    long_edge=getattr(settings, 'OCR_IMAGE_LONG_EDGE', 2000),
+    byte_budget=getattr(settings, 'OCR_IMAGE_BYTE_BUDGET', 1536 * 1024),
+    image_format=getattr(settings, 'OCR_IMAGE_FORMAT', 'JPEG')
+)
+
+# Gemini quota per API key, shared by all workers
+rate_limiter = RedisTokenBucket(
+    redis_client,
+    requests_per_minute=getattr(settings, 'OCR_RATE_LIMIT_RPM', 1000),
+    tokens_per_minute=getattr(settings, 'OCR_RATE_LIMIT_TPM', 1000000)
+)
+
+# Size-tiered queues with a per-owner fair share
+job_scheduler = JobScheduler(
+    redis_client,
+    small_job_max_images=getattr(settings, 'OCR_SMALL_JOB_MAX_IMAGES', 10),
+    max_active_per_owner=getattr(settings, 'OCR_MAX_ACTIVE_JOBS_PER_OWNER', 1)
+)
+
+# Resumable chunked uploads, written straight to disk
+upload_store = ChunkedUploadStore(
+    redis_client,
+    os.path.join(settings.MEDIA_ROOT, 'temp', 'chunks'),
+    chunk_size=getattr(settings, 'OCR_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+    max_size=getattr(settings, 'OCR_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+)
+
+# Extracted rows for the result page, edits and downloads (the Django session only holds the id)
+row_store = RowStore(redis_client)
+
+# Excel exports keyed by the row store version, so repeated downloads skip the rebuild
+export_cache = ExportCache(getattr(settings, 'OCR_EXPORT_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'exports')),
+                           max_age=row_store.ttl)
+
 # Setup logging
 logger = logging.getLogger('apps')
 
 # --- LLM Setup ---
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 
 # --- Pydantic models ---
@@ -52,6 +117,8 @@ class CertificateItem(BaseModel):
 class CertificateData(BaseModel):
     items: List[CertificateItem]
 
+GEMINI_MODEL = "gemini-2.0-flash"
+
 # Prompts
 TRANSCRIPT_PROMPT = """
 Trích xuất danh sách sinh viên từ ảnh bảng điểm.
@@ -72,7 +139,13 @@ Trả về JSON: {
 }
 """
 
-def update_progress(session_id, current, total, message=""):
+BATCH_PROMPT_TEMPLATE = """{prompt}
+Có {count} ảnh, mỗi ảnh đứng ngay sau nhãn của nó (anh_1, anh_2, ...).
+Xử lý từng ảnh riêng biệt theo yêu cầu trên.
+Trả về một JSON theo nhãn ảnh: {{"anh_1": {{"items": [...]}}, "anh_2": {{"items": [...]}}}}
+"""
+
+def update_progress(session_id, current, total, message="", extra=None):
     """Update progress in Redis"""
     try:
         percentage = (current / total * 100) if total > 0 else 0
@@ -83,8 +156,16 @@ def update_progress(session_id, current, total, message=""):
             'message': message,
             'timestamp': time.time()
         }
-        redis_client.set(f"progress:{session_id}", json.dumps(progress_data), ex=3600)
-        logger.info(f"Progress: {session_id} - {current}/{total} ({percentage:.1f}%)")
+        if extra:
+            progress_data.update(extra)
+        payload = json.dumps(progress_data)
+        
+        # Latest state for polling, plus a push to anyone streaming this session
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(f"progress:{session_id}", payload, ex=3600)
+        pipe.publish(f"progress_channel:{session_id}", payload)
+        pipe.execute()
+        logger.debug(f"Progress: {session_id} - {current}/{total} ({percentage:.1f}%)")
     except Exception as e:
         logger.error(f"Error updating progress: {e}")
 
@@ -93,11 +174,117 @@ def get_progress(session_id):
     try:
         data = redis_client.get(f"progress:{session_id}")
         if data:
-            return json.loads(data)
+            progress_data = json.loads(data)
+            progress_data['cache'] = ocr_cache.get_stats(session_id)
+            progress_data['upload'] = get_upload_stats(session_id)
+            progress_data['queue'] = job_scheduler.queue_status(session_id)
+            return progress_data
     except Exception as e:
         logger.error(f"Error getting progress: {e}")
     
-    return {'current': 0, 'total': 0, 'percentage': 0, 'message': 'Đang khởi tạo...'}
+    return {'current': 0, 'total': 0, 'percentage': 0, 'message': 'Đang khởi tạo...',
+            'queue': job_scheduler.queue_status(session_id)}
+
+def progress_finished(progress_data):
+    """True once a job has stopped for good: complete, or failed (status 'error')"""
+    return progress_data.get('status') in ('done', 'error') or progress_data.get('percentage', 0) >= 100
+
+def record_upload_bytes(session_id, filename, original_bytes, upload_bytes):
+    """Log bytes saved by preprocessing and add them to the session totals"""
+    saved = original_bytes - upload_bytes
+    logger.info(f"Preprocessed {os.path.basename(filename)}: {original_bytes // 1024} KB -> "
+                f"{upload_bytes // 1024} KB (saved {saved // 1024} KB)")
+    try:
+        stats_key = f"upload_stats:{session_id}"
+        redis_client.hincrby(stats_key, "original_bytes", original_bytes)
+        redis_client.hincrby(stats_key, "upload_bytes", upload_bytes)
+        redis_client.expire(stats_key, 3600)
+    except Exception as e:
+        logger.error(f"Error recording upload stats: {e}")
+
+def get_upload_stats(session_id):
+    """Get original and upload byte totals for the session"""
+    try:
+        stats = redis_client.hgetall(f"upload_stats:{session_id}")
+        original_bytes = int(stats.get(b'original_bytes', 0))
+        upload_bytes = int(stats.get(b'upload_bytes', 0))
+        return {
+            'original_bytes': original_bytes,
+            'upload_bytes': upload_bytes,
+            'saved_bytes': original_bytes - upload_bytes
+        }
+    except Exception as e:
+        logger.error(f"Error getting upload stats: {e}")
+        return {'original_bytes': 0, 'upload_bytes': 0, 'saved_bytes': 0}
+
+def publish_image_result(session_id, entry_name, image_result, data):
+    """Append one image's outcome to the session's result list as soon as it is known"""
+    publish_image_results(session_id, [(entry_name, image_result, data)])
+
+def publish_image_results(session_id, outcomes):
+    """Append (entry_name, image_result, data) outcomes to the session's results.
+    
+    The rows and the per-entry checkpoint are written in one transaction, so
+    a resumed job never skips an entry whose rows were lost or repeats one
+    whose rows were kept.
+    """
+    if not outcomes:
+        return
+    try:
+        entries = [json.dumps({'image_result': image_result, 'data': data}, ensure_ascii=False)
+                   for _, image_result, data in outcomes]
+        checkpoints = {entry_name: json.dumps(image_result, ensure_ascii=False)
+                       for entry_name, image_result, _ in outcomes}
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.rpush(f"result_items:{session_id}", *entries)
+        pipe.hset(f"result_checkpoint:{session_id}", mapping=checkpoints)
+        pipe.expire(f"result_items:{session_id}", 7200)
+        pipe.expire(f"result_checkpoint:{session_id}", 7200)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Error publishing result: {e}")
+    # A job still producing results keeps its scheduler slot
+    job_scheduler.touch(session_id)
+
+def get_checkpoint(session_id):
+    """Image results of ZIP entries already completed, keyed by entry name"""
+    try:
+        checkpoint = redis_client.hgetall(f"result_checkpoint:{session_id}")
+        return {name.decode('utf-8'): json.loads(image_result) for name, image_result in checkpoint.items()}
+    except Exception as e:
+        logger.error(f"Error reading checkpoint: {e}")
+        return {}
+
+def clear_session_results(session_id):
+    """Drop published rows and checkpoints before a job starts from scratch"""
+    redis_client.delete(f"result_items:{session_id}", f"result_checkpoint:{session_id}")
+
+def load_session_result(session_id, start=0):
+    """Merge the final summary with the per-image results published from entry `start` on.
+    
+    Returns None if nothing has arrived yet. 'data' holds the rows of the
+    entries from `start`, and 'entries' is where the next read starts.
+    'partial' is True until the task has written its summary to
+    result:{session_id}.
+    """
+    # The summary is written after the last item, so read it first
+    summary = redis_client.get(f"result:{session_id}")
+    entries = redis_client.lrange(f"result_items:{session_id}", start, -1)
+    if summary is None and not entries and not start:
+        return None
+    
+    result = json.loads(summary) if summary else {'success': True}
+    if 'data' not in result:
+        data = []
+        for raw in entries:
+            data.extend(json.loads(raw)['data'])
+        result['data'] = data
+        result['entries'] = start + len(entries)
+        if 'image_results' not in result:
+            # Every finished entry, without reading the rows of those already stored
+            result['image_results'] = list(get_checkpoint(session_id).values())
+    result['partial'] = summary is None
+    return result
 
 def clean_sbd(raw_value: str) -> str:
     """Clean and format SBD to 5 digits"""
@@ -113,61 +300,79 @@ def clean_sbd(raw_value: str) -> str:
 
 def clean_date_string(date_str: str) -> str:
     """Clean date string to dd/mm/yyyy format"""
-    if not isinstance(date_str, str):
-        return ""
-    
-    formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
-    for fmt in formats:
-        try:
-            dt_obj = datetime.datetime.strptime(date_str.strip(), fmt)
-            return dt_obj.strftime("%d/%m/%Y")
-        except ValueError:
-            continue
-    
-    match = re.match(r'(\d{1,2})\s*tháng\s*(\d{1,2})\s*năm\s*(\d{4})', date_str, re.IGNORECASE)
-    if match:
-        day, month, year = match.groups()
-        return f"{day.zfill(2)}/{month.zfill(2)}/{year}"
-    
-    return ""
+    return normalize_date(date_str)
+
+def clean_sbd_series(values):
+    """clean_sbd over a Series of strings, with pandas string methods"""
+    digits = values.str.replace(r"\D+", "", regex=True)
+    return digits.str.zfill(5).str[:5].where(digits != "", values)
 
 def process_transcript_dataframe(df):
     """Process DataFrame to ensure SBD has correct format"""
     if df.empty:
         return df
     
-    df['Sbd'] = df['Sbd'].astype(str).apply(clean_sbd)
-    
-    invalid_sbd = df[~df['Sbd'].apply(lambda x: len(x) == 5 and x.isdigit())]
-    if not invalid_sbd.empty:
-        logger.warning(f"Found {len(invalid_sbd)} invalid SBD entries")
+    sbd = df['Sbd'].astype(str)
+    # SBDs of exactly 5 decimal digits are already clean; only the rest go through the regex
+    valid = sbd.str.len().eq(5) & sbd.str.isdecimal()
+    if not valid.all():
+        noisy = ~valid
+        cleaned = clean_sbd_series(sbd[noisy])
+        sbd[noisy] = cleaned.to_numpy()
+        valid[noisy] = (cleaned.str.len().eq(5) & cleaned.str.isdigit()).to_numpy()
+    df['Sbd'] = sbd
     
-    df = df[df['Sbd'].apply(lambda x: len(x) == 5 and x.isdigit())]
+    invalid_count = int((~valid).sum())
+    if invalid_count:
+        logger.warning(f"Found {invalid_count} invalid SBD entries")
     
-    return df
+    return df[valid]
 
-def compress_image(image_bytes, max_size_mb=5):
-    """Compress image if too large"""
+def stored_file_matches(name, data):
+    """True if default_storage already holds exactly `data` under `name`"""
     try:
-        if len(image_bytes) <= max_size_mb * 1024 * 1024:
-            return image_bytes
-        
-        image = Image.open(io.BytesIO(image_bytes))
-        if image.width > 2000 or image.height > 2000:
-            ratio = min(2000/image.width, 2000/image.height)
-            new_size = (int(image.width * ratio), int(image.height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        output = io.BytesIO()
-        image.save(output, format='JPEG', quality=85, optimize=True)
-        return output.getvalue()
-        
-    except Exception as e:
-        logger.warning(f"Failed to compress image: {e}")
-        return image_bytes
+        if not default_storage.exists(name) or default_storage.size(name) != len(data):
+            return False
+        with default_storage.open(name, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+def save_storage_file(file_path, data):
+    """Save bytes to default_storage, writing local files straight from a memoryview
+    
+    The name depends only on file_path and the data: saving the same bytes
+    again (a retried chunk, a resumed job) returns the stored file instead of
+    adding a suffixed copy, and different bytes under a taken name go to
+    `<name>_<digest>`.
+    """
+    root, ext = os.path.splitext(file_path)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    for name in (file_path, f"{root}_{digest}{ext}"):
+        if stored_file_matches(name, data):
+            return name
+        if default_storage.exists(name):
+            continue
+        if not isinstance(default_storage, FileSystemStorage):
+            return default_storage.save(name, ContentFile(data))
+        try:
+            with open(default_storage.path(name), 'xb') as f:
+                f.write(memoryview(data))
+            return name
+        except FileExistsError:
+            if stored_file_matches(name, data):
+                return name
+    
+    if not isinstance(default_storage, FileSystemStorage):
+        return default_storage.save(file_path, ContentFile(data))
+    while True:
+        name = default_storage.get_available_name(file_path)
+        try:
+            with open(default_storage.path(name), 'xb') as f:
+                f.write(memoryview(data))
+            return name
+        except FileExistsError:
+            continue
 
 def store_image(image_bytes, filename, session_id):
     """Store image and return path"""
@@ -180,95 +385,190 @@ def store_image(image_bytes, filename, session_id):
         clean_filename = re.sub(r'\s+', '_', clean_filename)
         file_path = os.path.join(storage_path, clean_filename)
         
-        content_file = ContentFile(image_bytes)
-        saved_path = default_storage.save(file_path, content_file)
-        
-        return saved_path
+        return save_storage_file(file_path, image_bytes)
         
     except Exception as e:
         logger.error(f"Error storing image {filename}: {e}")
         return None
 
+def get_prompt(processing_type):
+    """Return extraction prompt for processing type"""
+    return TRANSCRIPT_PROMPT if processing_type == "transcript" else CERTIFICATE_PROMPT
+
+def estimate_request_tokens(prompt, image_count):
+    """Rough token cost of a request, for the rate limiter"""
+    tokens_per_image = getattr(settings, 'OCR_RATE_LIMIT_TOKENS_PER_IMAGE', 1500)
+    return len(prompt) // 3 + image_count * tokens_per_image
+
+def parse_response_content(content):
+    """Strip markdown fences from LLM response and parse JSON"""
+    content = content.strip().replace('```json', '').replace('```', '')
+    return json.loads(content)
+
+CORRECTED_CERTIFICATE_FIELDS = ("Nganh", "Noi_cap")
+# Legal names: rare and ethnic-minority names are missing from the word lists
+# ("Giàng A Páo" would become "Giàng A Pao"), so fixes are only logged
+PROPOSED_CERTIFICATE_FIELDS = ("Ho_ten",)
+
+def get_spelling_corrector():
+    """Corrector over OCR_DICTIONARY_FILES, or None if dictionary correction is off or unavailable"""
+    if not getattr(settings, 'OCR_DICTIONARY_CORRECTION', True):
+        return None
+    files = getattr(settings, 'OCR_DICTIONARY_FILES', [])
+    try:
+        return get_corrector(files, index_path=getattr(settings, 'OCR_DICTIONARY_INDEX', None),
+                             max_distance=getattr(settings, 'OCR_DICTIONARY_MAX_DISTANCE', 1))
+    except OSError as e:
+        logger.warning(f"Spelling dictionary unavailable: {e}")
+        return None
+
+def correct_certificate_fields(item, corrector):
+    """Fix OCR spelling of the certificate's major and issuer against the dictionary; log fixes for the name"""
+    apply_context = getattr(settings, 'OCR_DICTIONARY_CONTEXT_FIXES', False)
+    for field in CORRECTED_CERTIFICATE_FIELDS + PROPOSED_CERTIFICATE_FIELDS:
+        corrected, changes, proposals = corrector.correct_text(item[field], apply_context=apply_context)
+        if field in PROPOSED_CERTIFICATE_FIELDS:
+            changes, proposals = [], changes + proposals
+        if changes:
+            logger.info(f"Dictionary fix {field}: {item[field]!r} -> {corrected!r}")
+            item[field] = corrected
+        if proposals:
+            logger.info(f"Dictionary proposal {field} {item[field]!r}: "
+                        + ", ".join(f"{word} -> {fix}" for word, fix in proposals))
+    return item
+
+def clean_extracted_items(data, processing_type):
+    """Clean items returned by the LLM"""
+    items = []
+    if processing_type == "transcript":
+        for item in data.get("items", []):
+            sbd = clean_sbd(item.get("Sbd", ""))
+            thi = item.get("Thi", 0)
+            if sbd and len(sbd) == 5:
+                items.append({"Sbd": sbd, "Thi": float(thi) if thi else 0.0})
+    else:
+        corrector = get_spelling_corrector()
+        for item in data.get("items", []):
+            date_str = clean_date_string(item.get("Date_birth_VN", ""))
+            if date_str:
+                cleaned = {
+                    "Bang_cap": item.get("Bang_cap", "").strip(),
+                    "Nganh": item.get("Nganh", "").strip(),
+                    "Noi_cap": item.get("Noi_cap", "").strip(),
+                    "Ho_ten": item.get("Ho_ten", "").strip(),
+                    "Date_birth_VN": date_str
+                }
+                if corrector is not None:
+                    correct_certificate_fields(cleaned, corrector)
+                items.append(cleaned)
+    return items
+
+def image_content_part(image_bytes):
+    """Build image part of a multimodal message.
+    
+    Uses an inline-bytes media part so the image is not base64-encoded
+    into a data URI; OCR_INLINE_IMAGE_PARTS = False restores the data URI.
+    """
+    mime_type = image_mime_type(image_bytes)
+    if getattr(settings, 'OCR_INLINE_IMAGE_PARTS', True):
+        return {"type": "media", "mime_type": mime_type, "data": image_bytes}
+    
+    image_b64 = base64.b64encode(image_bytes).decode("ascii")
+    return {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_b64}"}}
+
+def prepare_image(image_bytes, filename, processing_type, session_id):
+    """Preprocess and store image, return cache key, prepared bytes and stored path"""
+    cache_key = ocr_cache.make_key(image_bytes, processing_type, get_prompt(processing_type), GEMINI_MODEL)
+    original_size = len(image_bytes)
+    image_bytes = image_preprocessor.preprocess(image_bytes, grayscale=(processing_type == "transcript"))
+    record_upload_bytes(session_id, filename, original_size, len(image_bytes))
+    image_path = store_image(image_bytes, filename, session_id)
+    return cache_key, image_bytes, image_path
+
+def get_cached_result(cache_key, filename, image_path, session_id):
+    """Return result from OCR cache or None"""
+    cached_items = ocr_cache.get(cache_key)
+    ocr_cache.record(session_id, cached_items is not None)
+    if cached_items is None:
+        return None
+    
+    logger.info(f"✓ {os.path.basename(filename)}: {len(cached_items)} items (cache)")
+    return {
+        "success": True,
+        "data": cached_items,
+        "filename": filename,
+        "image_path": image_path,
+        "cached": True
+    }
+
+def build_items_result(items, filename, image_path, cache_key):
+    """Build image result from cleaned items and cache successful ones"""
+    if len(items) > 0:
+        ocr_cache.set(cache_key, items)
+        logger.info(f"✓ {os.path.basename(filename)}: {len(items)} items")
+        return {
+            "success": True,
+            "data": items,
+            "filename": filename,
+            "image_path": image_path
+        }
+    
+    return {
+        "success": False,
+        "data": [],
+        "filename": filename,
+        "error": "Không trích xuất được dữ liệu"
+    }
+
+def extract_single_image(image_bytes, filename, image_path, cache_key, api_key, processing_type):
+    """Call the LLM for one prepared image"""
+    # One SDK attempt: a 429 must reach llm_limiter instead of being retried inside the client
+    llm = get_llm(api_key, GEMINI_MODEL, request_timeout=30, max_retries=1)
+    prompt = get_prompt(processing_type)
+    
+    message = HumanMessage(content=[
+        {"type": "text", "text": prompt},
+        image_content_part(image_bytes)
+    ])
+    
+    last_error = None
+    overloaded = False
+    for attempt in range(2):
+        try:
+            rate_limiter.acquire(api_key, estimate_request_tokens(prompt, 1))
+            with llm_limiter.slot():
+                response = llm.invoke([message])
+            data = parse_response_content(response.content)
+            items = clean_extracted_items(data, processing_type)
+            return build_items_result(items, filename, image_path, cache_key)
+            
+        except json.JSONDecodeError as e:
+            last_error = f"Lỗi JSON: {str(e)}"
+            overloaded = False
+        except Exception as e:
+            last_error = f"Lỗi API: {str(e)}"
+            overloaded = is_overload_error(e)
+            if attempt < 1:
+                time.sleep(1)
+    
+    return {
+        "success": False, 
+        "data": [], 
+        "filename": filename, 
+        "error": last_error or "Thất bại",
+        "overloaded": overloaded
+    }
+
 def process_single_image_with_results(image_bytes, filename, api_key, processing_type, session_id, index):
     """Process single image and return detailed results"""
     try:
-        image_bytes = compress_image(image_bytes, max_size_mb=3)
-        image_path = store_image(image_bytes, filename, session_id)
-        
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            temperature=0,
-            google_api_key=api_key,
-            request_timeout=30,
-            max_retries=3
-        )
-        
-        prompt = TRANSCRIPT_PROMPT if processing_type == "transcript" else CERTIFICATE_PROMPT
+        cache_key, image_bytes, image_path = prepare_image(image_bytes, filename, processing_type, session_id)
         
-        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-        data_uri = f"data:image/jpeg;base64,{image_b64}"
-        
-        message = HumanMessage(content=[
-            {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": data_uri}}
-        ])
-        
-        last_error = None
-        for attempt in range(2):
-            try:
-                response = llm.invoke([message])
-                content = response.content.strip().replace('```json', '').replace('```', '')
-                data = json.loads(content)
-                
-                if processing_type == "transcript":
-                    items = []
-                    for item in data.get("items", []):
-                        sbd = clean_sbd(item.get("Sbd", ""))
-                        thi = item.get("Thi", 0)
-                        if sbd and len(sbd) == 5:
-                            items.append({"Sbd": sbd, "Thi": float(thi) if thi else 0.0})
-                else:
-                    items = []
-                    for item in data.get("items", []):
-                        date_str = clean_date_string(item.get("Date_birth_VN", ""))
-                        if date_str:
-                            items.append({
-                                "Bang_cap": item.get("Bang_cap", "").strip(),
-                                "Nganh": item.get("Nganh", "").strip(),
-                                "Noi_cap": item.get("Noi_cap", "").strip(),
-                                "Ho_ten": item.get("Ho_ten", "").strip(),
-                                "Date_birth_VN": date_str
-                            })
-                
-                if len(items) > 0:
-                    logger.info(f"✓ {os.path.basename(filename)}: {len(items)} items")
-                    return {
-                        "success": True,
-                        "data": items,
-                        "filename": filename,
-                        "image_path": image_path
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "data": [],
-                        "filename": filename,
-                        "error": "Không trích xuất được dữ liệu"
-                    }
-                
-            except json.JSONDecodeError as e:
-                last_error = f"Lỗi JSON: {str(e)}"
-            except Exception as e:
-                last_error = f"Lỗi API: {str(e)}"
-                if attempt < 1:
-                    time.sleep(1)
+        cached_result = get_cached_result(cache_key, filename, image_path, session_id)
+        if cached_result:
+            return cached_result
         
-        return {
-            "success": False, 
-            "data": [], 
-            "filename": filename, 
-            "error": last_error or "Thất bại"
-        }
+        return extract_single_image(image_bytes, filename, image_path, cache_key, api_key, processing_type)
         
     except Exception as e:
         logger.error(f"Error processing {filename}: {e}")
@@ -279,105 +579,308 @@ def process_single_image_with_results(image_bytes, filename, api_key, processing
             "error": str(e)
         }
 
-def process_zip_file(zip_path, api_key, processing_type, session_id, max_images=50):
-    """Process ZIP file with images"""
+def request_batch_sections(pending, api_key, processing_type):
+    """Send several labelled images in one request, return response sections by label"""
+    llm = get_llm(api_key, GEMINI_MODEL, request_timeout=30, max_retries=1)
+    
+    prompt = BATCH_PROMPT_TEMPLATE.format(prompt=get_prompt(processing_type), count=len(pending))
+    
+    content = [{"type": "text", "text": prompt}]
+    for label, image_bytes, *_ in pending:
+        content.append({"type": "text", "text": f"{label}:"})
+        content.append(image_content_part(image_bytes))
+    
+    rate_limiter.acquire(api_key, estimate_request_tokens(prompt, len(pending)))
+    with llm_limiter.slot():
+        response = llm.invoke([HumanMessage(content=content)])
+    data = parse_response_content(response.content)
+    if not isinstance(data, dict):
+        raise ValueError("Batch response is not a JSON object")
+    return data
+
+def prepare_batch(batch, processing_type, session_id):
+    """Compress, store and look up cached results for (image_bytes, filename, index) tuples.
+    
+    The returned dict holds only the prepared bytes, so the original
+    buffers can be freed as soon as this returns.
+    """
+    results = {}
+    pending = []
+    for image_bytes, filename, index in batch:
+        try:
+            cache_key, prepared_bytes, image_path = prepare_image(image_bytes, filename, processing_type, session_id)
+            cached_result = get_cached_result(cache_key, filename, image_path, session_id)
+            if cached_result:
+                results[index] = cached_result
+            else:
+                label = f"anh_{len(pending) + 1}"
+                pending.append((label, prepared_bytes, filename, image_path, cache_key, index))
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {e}")
+            results[index] = {"success": False, "data": [], "filename": filename, "error": str(e)}
+    
+    return {
+        'order': [index for _, _, index in batch],
+        'results': results,
+        'pending': pending
+    }
+
+def extract_prepared_batch(prepared, api_key, processing_type):
+    """Extract items for a prepared batch, one LLM request when it holds several images.
+    
+    Images whose section of the batch response is missing or unusable
+    are retried with single-image requests.
+    """
+    results = prepared['results']
+    pending = prepared['pending']
+    
+    sections = {}
+    if len(pending) > 1:
+        try:
+            sections = request_batch_sections(pending, api_key, processing_type)
+            logger.info(f"Batch of {len(pending)} images: {len(sections)} sections returned")
+        except Exception as e:
+            logger.warning(f"Batch request failed, falling back to single images: {e}")
+    
+    for label, prepared_bytes, filename, image_path, cache_key, index in pending:
+        items = None
+        section = sections.get(label)
+        if isinstance(section, dict):
+            try:
+                items = clean_extracted_items(section, processing_type)
+            except Exception as e:
+                logger.warning(f"Invalid batch section for {filename}: {e}")
+        
+        try:
+            if items:
+                results[index] = build_items_result(items, filename, image_path, cache_key)
+            else:
+                results[index] = extract_single_image(
+                    prepared_bytes, filename, image_path, cache_key, api_key, processing_type
+                )
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {e}")
+            results[index] = {"success": False, "data": [], "filename": filename, "error": str(e)}
+    
+    return [results[index] for index in prepared['order']]
+
+def failed_batch_results(stage, item, error):
+    """Pipeline on_error: failed results for the images of a batch that a stage could not handle.
+    
+    Results prepare_batch already had (cache hits, per-image errors) are kept.
+    """
+    if stage == "prepare":
+        order = [(filename, None) for _, filename, _ in item]
+    else:
+        filenames = {index: filename for _, _, filename, _, _, index in item['pending']}
+        order = [(filenames.get(index), item['results'].get(index)) for index in item['order']]
+    return [
+        result or {"success": False, "data": [], "filename": filename, "error": str(error)}
+        for filename, result in order
+    ]
+
+def process_image_batch_with_results(batch, api_key, processing_type, session_id):
+    """Process (image_bytes, filename, index) tuples, several images per LLM request"""
+    return extract_prepared_batch(prepare_batch(batch, processing_type, session_id), api_key, processing_type)
+
+def group_image_batches(entries, batch_size, max_bytes):
+    """Group (index, ZipInfo) pairs into batches bounded by image count and size"""
+    batches = []
+    current = []
+    current_bytes = 0
+    for index, entry in entries:
+        if current and (len(current) >= batch_size or current_bytes + entry.file_size > max_bytes):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append((index, entry))
+        current_bytes += entry.file_size
+    
+    if current:
+        batches.append(current)
+    return batches
+
+def read_zip_batches(archive, batches, failed_reads, workers=None):
+    """Yield batches of (image_bytes, filename, index), reading entries only when requested.
+    
+    Up to `workers` entries (OCR_ZIP_READ_WORKERS) are inflated ahead in
+    parallel. Unreadable entries are appended to failed_reads as failed
+    extraction results and skipped.
+    """
+    if workers is None:
+        workers = getattr(settings, 'OCR_ZIP_READ_WORKERS', 4)
+    reads = archive.read_ahead((entry for batch_entries in batches for _, entry in batch_entries), workers)
+    
+    for batch_entries in batches:
+        batch = []
+        for i, entry in batch_entries:
+            image_bytes, error = next(reads)
+            if error is not None:
+                logger.error(f"Error reading {entry.filename}: {error}")
+                failed_reads.append({"success": False, "data": [], "filename": entry.filename, "error": str(error)})
+            elif len(image_bytes) > 0:
+                batch.append((image_bytes, entry.filename, i))
+        
+        if batch:
+            yield batch
+        del batch
+
+def with_failed_reads(results_stream, failed_reads):
+    """Lists of results from the pipeline, with the read failures recorded meanwhile in between"""
+    for results in results_stream:
+        while failed_reads:
+            yield [failed_reads.pop(0)]
+        yield results
+    while failed_reads:
+        yield [failed_reads.pop(0)]
+
+def get_max_images():
+    """Images processed per upload (OCR_MAX_IMAGES_PER_SESSION)"""
+    return getattr(settings, 'OCR_MAX_IMAGES_PER_SESSION', 100)
+
+def list_zip_images(archive, max_images=None):
+    """Return supported image entries of an open ZipArchive, smallest first, capped at max_images
+    
+    The cap keeps the first entries in archive order, so whole folders are
+    processed rather than the smallest files from everywhere.
+    """
+    if max_images is None:
+        max_images = get_max_images()
+    image_files = list(archive.images)
+    
+    if len(image_files) > max_images:
+        logger.warning(f"Limiting to {max_images} images, skipping {len(image_files) - max_images}")
+        image_files = image_files[:max_images]
+    
+    image_files.sort(key=lambda x: x.file_size)
+    return image_files
+
+def zip_image_counts(zip_path, max_images=None):
+    """(images found, images that will be processed), reading only the ZIP directory"""
+    if max_images is None:
+        max_images = get_max_images()
+    try:
+        with ZipArchive(zip_path) as archive:
+            found = len(archive)
+        return found, min(found, max_images)
+    except zipfile.BadZipFile:
+        return 0, 0
+
+def is_large_archive(total_images):
+    """Large-archive mode: rows stay out of worker memory, results and progress go out per chunk"""
+    return total_images >= getattr(settings, 'OCR_LARGE_ARCHIVE_MIN_IMAGES', 200)
+
+def process_zip_file(zip_path, api_key, processing_type, session_id, max_images=None, batch_size=None,
+                     completed=None):
+    """Process ZIP file with images
+    
+    Entries named in `completed` were checkpointed by an earlier attempt and
+    are skipped; the returned lists only cover this run. In large-archive
+    mode the rows are only published to Redis and the returned data is empty.
+    """
     all_data = []
     processed_count = 0
     image_results = []
     
+    if batch_size is None:
+        batch_size = getattr(settings, 'OCR_LLM_BATCH_IMAGES', 1)
+    batch_max_bytes = getattr(settings, 'OCR_LLM_BATCH_MAX_BYTES', 12 * 1024 * 1024)
+    
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zf:
-            image_files = []
-            supported_formats = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
-            
-            for entry in zf.infolist():
-                if (entry.filename.lower().endswith(supported_formats)
-                    and not entry.filename.startswith('__MACOSX/')
-                    and not entry.filename.startswith('.')
-                    and not '/.' in entry.filename):
-                    image_files.append(entry)
-            
-            image_files.sort(key=lambda x: x.file_size)
-            
-            if len(image_files) > max_images:
-                logger.warning(f"Limiting to {max_images} images")
-                image_files = image_files[:max_images]
+        with ZipArchive(zip_path) as archive:
+            image_files = list_zip_images(archive, max_images)
             
             total_images = len(image_files)
             if total_images == 0:
                 return [], []
             
-            logger.info(f"Processing {total_images} images")
-            update_progress(session_id, 0, total_images, f"Xử lý {total_images} ảnh...")
+            completed = completed or set()
+            processed_count = sum(1 for entry in image_files if entry.filename in completed)
+            if processed_count:
+                logger.info(f"Resuming: {processed_count}/{total_images} images already done")
             
-            max_workers = min(3, total_images)
+            large_archive = is_large_archive(total_images)
+            chunk_size = getattr(settings, 'OCR_MAX_BATCH_SIZE', 15) if large_archive else 1
+            pending_outcomes = []
             
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_filename = {}
-                
-                for i, entry in enumerate(image_files):
-                    try:
-                        if entry.file_size > 15 * 1024 * 1024:
-                            image_results.append({
-                                'filename': entry.filename,
-                                'success': False,
-                                'error': 'File quá lớn',
-                                'data_count': 0
-                            })
-                            continue
-                            
-                        with zf.open(entry.filename) as file:
-                            image_bytes = file.read()
-                            if len(image_bytes) > 0:
-                                future = executor.submit(
-                                    process_single_image_with_results,
-                                    image_bytes, entry.filename, api_key,
-                                    processing_type, session_id, i
-                                )
-                                future_to_filename[future] = entry.filename
-                                
-                    except Exception as e:
-                        logger.error(f"Error reading {entry.filename}: {e}")
-                        image_results.append({
-                            'filename': entry.filename,
-                            'success': False,
-                            'error': str(e),
-                            'data_count': 0
-                        })
-                
-                for future in as_completed(future_to_filename.keys(), timeout=total_images * 30):
-                    filename = future_to_filename[future]
-                    try:
-                        result = future.result(timeout=30)
-                        processed_count += 1
-                        
-                        image_result = {
-                            'filename': os.path.basename(filename),
-                            'success': result["success"],
-                            'data_count': len(result["data"]) if result["success"] else 0,
-                            'error': result.get("error") if not result["success"] else None
-                        }
-                        image_results.append(image_result)
-                        
-                        if result["success"]:
-                            all_data.extend(result["data"])
-                            update_progress(session_id, processed_count, total_images, 
-                                          f"✓ {os.path.basename(filename)}")
-                        else:
-                            update_progress(session_id, processed_count, total_images, 
-                                          f"✗ {os.path.basename(filename)}")
-                        
-                        time.sleep(0.2)
-                        
-                    except Exception as e:
-                        logger.error(f"Error: {e}")
-                        processed_count += 1
-                        image_results.append({
-                            'filename': os.path.basename(filename),
-                            'success': False,
-                            'error': str(e),
-                            'data_count': 0
-                        })
+            logger.info(f"Processing {total_images} images" + (" (large archive)" if large_archive else ""))
+            update_progress(session_id, processed_count, total_images, f"Xử lý {total_images} ảnh...")
+            
+            valid_entries = []
+            for i, entry in enumerate(image_files):
+                if entry.filename in completed:
+                    continue
+                if entry.file_size > 15 * 1024 * 1024:
+                    image_result = {
+                        'filename': entry.filename,
+                        'success': False,
+                        'error': 'File quá lớn',
+                        'data_count': 0
+                    }
+                    image_results.append(image_result)
+                    pending_outcomes.append((entry.filename, image_result, []))
+                    continue
+                valid_entries.append((i, entry))
+            
+            batches = group_image_batches(valid_entries, batch_size, batch_max_bytes)
+            
+            # Stages hand buffers on through small queues, so memory follows the
+            # number of workers rather than the number of images in the ZIP.
+            # LLM workers only wait on the limiter; its window decides how many requests run.
+            llm_workers = max(1, min(llm_limiter.max_limit, len(batches)))
+            prepare_workers = getattr(settings, 'OCR_PREPARE_WORKERS', None) or max(1, image_preprocessor.processes)
+            
+            # Filled by the pipeline's source thread, drained by this one
+            failed_reads = []
+            results_stream = run_pipeline(
+                read_zip_batches(archive, batches, failed_reads),
+                [
+                    ("prepare", lambda batch: prepare_batch(batch, processing_type, session_id), prepare_workers),
+                    ("extract", lambda prepared: extract_prepared_batch(prepared, api_key, processing_type), llm_workers),
+                ],
+                queue_size=getattr(settings, 'OCR_PIPELINE_QUEUE_SIZE', 2),
+                timeout=total_images * 30,
+                on_error=failed_batch_results
+            )
+            
+            for results in with_failed_reads(results_stream, failed_reads):
+                for result in results:
+                    processed_count += 1
+                    filename = result["filename"]
+                    
+                    image_result = {
+                        'filename': os.path.basename(filename),
+                        'success': result["success"],
+                        'data_count': len(result["data"]) if result["success"] else 0,
+                        'error': result.get("error") if not result["success"] else None
+                    }
+                    image_results.append(image_result)
+                    pending_outcomes.append((filename, image_result, result["data"] if result["success"] else []))
+                    if result["success"] and not large_archive:
+                        all_data.extend(result["data"])
+                    
+                    # One Redis round trip per image, or per chunk for large archives
+                    if len(pending_outcomes) < chunk_size and processed_count < total_images:
+                        continue
+                    publish_image_results(session_id, pending_outcomes)
+                    pending_outcomes = []
+                    
+                    progress_extra = {
+                        'concurrency': llm_limiter.window,
+                        'rate_limit_queue': rate_limiter.queue_depth(api_key)
+                    }
+                    if large_archive:
+                        update_progress(session_id, processed_count, total_images,
+                                      f"Phần {-(-processed_count // chunk_size)}/{-(-total_images // chunk_size)}",
+                                      extra=progress_extra)
+                    elif result["success"]:
+                        update_progress(session_id, processed_count, total_images, 
+                                      f"✓ {os.path.basename(filename)}", extra=progress_extra)
+                    else:
+                        update_progress(session_id, processed_count, total_images, 
+                                      f"✗ {os.path.basename(filename)}", extra=progress_extra)
+            
+            publish_image_results(session_id, pending_outcomes)
             
             success_count = sum(1 for r in image_results if r['success'])
             logger.info(f"Completed: {success_count}/{len(image_results)} success")
@@ -390,6 +893,73 @@ def process_zip_file(zip_path, api_key, processing_type, session_id, max_images=
         logger.error(f"Error processing ZIP: {e}")
         return [], []
 
+def summarize_image_result(result):
+    """Per-image entry of image_results for an extraction result"""
+    return {
+        'filename': os.path.basename(result["filename"]),
+        'success': result["success"],
+        'data_count': len(result["data"]) if result["success"] else 0,
+        'error': result.get("error") if not result["success"] else None,
+        'overloaded': bool(result.get("overloaded"))
+    }
+
+def process_zip_chunk(zip_path, filenames, api_key, processing_type, session_id, batch_size=None):
+    """Extract the named ZIP entries in order (one fan-out subtask).
+    
+    Returns a list of (entry_name, image_result, data) outcomes; nothing is
+    published, so a retried chunk does not leave duplicates behind.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'OCR_LLM_BATCH_IMAGES', 1)
+    batch_max_bytes = getattr(settings, 'OCR_LLM_BATCH_MAX_BYTES', 12 * 1024 * 1024)
+    
+    outcomes = []
+    failed_reads = []
+    with ZipArchive(zip_path) as archive:
+        entries = []
+        for i, name in enumerate(filenames):
+            entry = archive.getinfo(name)
+            if entry.file_size > 15 * 1024 * 1024:
+                failed_reads.append({"success": False, "data": [], "filename": entry.filename, "error": 'File quá lớn'})
+                continue
+            entries.append((i, entry))
+        batches = group_image_batches(entries, batch_size, batch_max_bytes)
+        for batch in read_zip_batches(archive, batches, failed_reads):
+            for result in process_image_batch_with_results(batch, api_key, processing_type, session_id):
+                outcomes.append((result["filename"], summarize_image_result(result),
+                                 result["data"] if result["success"] else []))
+    
+    outcomes.extend((result["filename"], summarize_image_result(result), []) for result in failed_reads)
+    return outcomes
+
+def job_owner(request):
+    """Fair-share identity of the uploader: the user if logged in, else the browser session"""
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    if not request.session.session_key:
+        request.session.save()
+    return f"session:{request.session.session_key}"
+
+def temp_zip_path(session_id, filename):
+    """Where an uploaded ZIP waits for processing"""
+    temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, f"{session_id}_{os.path.basename(filename)}")
+
+def enqueue_zip(request, session_id, temp_file_path, processing_type, excel_filename):
+    """Hand a stored ZIP to the scheduler and remember the session"""
+    from .tasks import dispatch_images_task
+    queue_state = job_scheduler.submit(
+        session_id, job_owner(request), zip_image_counts(temp_file_path)[1],
+        [session_id, temp_file_path, processing_type, excel_filename],
+        dispatch_images_task
+    )
+    
+    row_store.start(session_id, processing_type, excel_filename)
+    request.session['session_id'] = session_id
+    
+    return JsonResponse({'success': True, 'session_id': session_id, 'queue_state': queue_state})
+
 @csrf_exempt
 def upload_file(request):
     """Handle file upload"""
@@ -401,23 +971,18 @@ def upload_file(request):
                 processing_type = form.cleaned_data['processing_type']
                 excel_filename = form.cleaned_data['excel_filename']
                 session_id = str(uuid.uuid4())
+                temp_file_path = temp_zip_path(session_id, zip_file.name)
                 
-                temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp')
-                os.makedirs(temp_dir, exist_ok=True)
-                temp_file_path = os.path.join(temp_dir, f"{session_id}_{zip_file.name}")
-                
-                with open(temp_file_path, 'wb') as f:
-                    for chunk in zip_file.chunks():
-                        f.write(chunk)
-                
-                from .tasks import process_images_task
-                task = process_images_task.delay(session_id, temp_file_path, processing_type, excel_filename)
-                
-                request.session['session_id'] = session_id
-                request.session['processing_type'] = processing_type
-                request.session['excel_filename'] = excel_filename
+                # Uploads above FILE_UPLOAD_MAX_MEMORY_SIZE are already on disk; move, don't copy
+                if hasattr(zip_file, 'temporary_file_path'):
+                    zip_file.file.flush()
+                    shutil.move(zip_file.temporary_file_path(), temp_file_path)
+                else:
+                    with open(temp_file_path, 'wb') as f:
+                        for chunk in zip_file.chunks():
+                            f.write(chunk)
                 
-                return JsonResponse({'success': True, 'session_id': session_id, 'task_id': task.id})
+                return enqueue_zip(request, session_id, temp_file_path, processing_type, excel_filename)
                 
             return JsonResponse({'success': False, 'error': 'Form không hợp lệ'}, status=400)
             
@@ -431,6 +996,160 @@ def upload_file(request):
         'error_message': None
         })
 
+def ingest_upload_prefix(state):
+    """Send image entries that are completely uploaded to OCR while the rest is still arriving.
+    
+    Scans local file headers over the verified prefix of the file, resuming
+    where the previous chunk's scan stopped. Entries are claimed in
+    stream_claimed:{session_id} so the final task skips them.
+    """
+    upload_id = state['upload_id']
+    session_id = state['metadata']['session_id']
+    lock_key = f"upload_scan_lock:{upload_id}"
+    # A scan already running will be followed by the next chunk's scan
+    if not redis_client.set(lock_key, 1, nx=True, ex=60):
+        return
+    
+    try:
+        scan_key = f"upload_scan:{upload_id}"
+        scan = json.loads(redis_client.get(scan_key) or '{"offset": 0, "count": 0, "finished": false}')
+        if scan['finished']:
+            return
+        
+        with open(state['path'], 'rb') as f:
+            entries, scan['offset'], scan['finished'] = scan_local_entries(
+                f, scan['offset'], upload_store.contiguous_bytes(state)
+            )
+        
+        # Same selection as list_zip_images: images in archive order up to the session cap
+        entries = [e for e in entries if is_zip_image_name(e.filename)]
+        entries = entries[:max(0, get_max_images() - scan['count'])]
+        scan['count'] += len(entries)
+        redis_client.set(scan_key, json.dumps(scan), ex=upload_store.ttl)
+        
+        entries = [e for e in entries
+                   if 0 < e.file_size <= 15 * 1024 * 1024 and e.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)]
+        if entries:
+            from .tasks import dispatch_stream_entries
+            dispatch_stream_entries(session_id, state['path'], state['metadata']['processing_type'], entries,
+                                    state['owner'])
+    except Exception as e:
+        logger.error(f"Streaming ingest error for upload {upload_id}: {e}")
+    finally:
+        redis_client.delete(lock_key)
+
+def get_stream_claims(session_id):
+    """ZIP entries handed to OCR during the upload"""
+    return {name.decode('utf-8') for name in redis_client.smembers(f"stream_claimed:{session_id}")}
+
+@csrf_exempt
+def upload_init(request):
+    """Start a chunked upload; returns upload_id and chunk_size"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid'}, status=405)
+    
+    form = ChunkedUploadInitForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'error': 'Form không hợp lệ'}, status=400)
+    
+    try:
+        # The ZIP is written where processing reads it, so entries can be OCRed mid-upload
+        session_id = str(uuid.uuid4())
+        size = form.cleaned_data['size']
+        stream = (getattr(settings, 'OCR_STREAMING_INGEST', True)
+                  and size >= getattr(settings, 'OCR_STREAMING_MIN_SIZE', 20 * 1024 * 1024))
+        state = upload_store.create(
+            form.cleaned_data['filename'],
+            size,
+            job_owner(request),
+            {
+                'session_id': session_id,
+                'processing_type': form.cleaned_data['processing_type'],
+                'excel_filename': form.cleaned_data['excel_filename'],
+                'stream': stream
+            },
+            path=temp_zip_path(session_id, form.cleaned_data['filename'])
+        )
+        return JsonResponse({
+            'success': True,
+            'upload_id': state['upload_id'],
+            'chunk_size': state['chunk_size'],
+            'chunk_count': state['chunk_count']
+        })
+    except UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Upload init error: {e}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+@csrf_exempt
+def upload_status(request, upload_id):
+    """Chunks already received, so an interrupted upload can resume"""
+    try:
+        state = upload_store.get(upload_id, job_owner(request))
+        return JsonResponse({
+            'success': True,
+            'upload_id': upload_id,
+            'chunk_size': state['chunk_size'],
+            'chunk_count': state['chunk_count'],
+            'received': state['received']
+        })
+    except UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+
+@csrf_exempt
+def upload_chunk(request, upload_id, index):
+    """PUT one chunk; the body is checked against X-Chunk-SHA256, then written to disk"""
+    if request.method != 'PUT':
+        return JsonResponse({'success': False, 'error': 'Invalid'}, status=405)
+    
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        state = upload_store.write_chunk(
+            upload_id, job_owner(request), index, request, length,
+            request.headers.get('X-Chunk-SHA256')
+        )
+        if state['metadata'].get('stream'):
+            ingest_upload_prefix(state)
+        return JsonResponse({'success': True, 'index': index})
+    except UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Upload chunk error: {e}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+@csrf_exempt
+def upload_finalize(request, upload_id):
+    """Assemble a completed chunked upload and enqueue it for processing"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid'}, status=405)
+    
+    from .tasks import dispatch_images_task
+    session_id = None
+    try:
+        owner = job_owner(request)
+        state = upload_store.get(upload_id, owner)
+        temp_file_path = temp_zip_path(state['metadata']['session_id'], state['filename'])
+        upload_store.complete(upload_id, owner, temp_file_path)
+        # From here on the upload is gone: a failure must release the slot streaming may have reserved
+        session_id = state['metadata']['session_id']
+        
+        if not zipfile.is_zipfile(temp_file_path):
+            os.remove(temp_file_path)
+            job_scheduler.finished(session_id, dispatch_images_task)
+            return JsonResponse({'success': False, 'error': 'File ZIP không hợp lệ'}, status=400)
+        
+        metadata = state['metadata']
+        return enqueue_zip(request, session_id, temp_file_path,
+                           metadata['processing_type'], metadata['excel_filename'])
+    except UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Upload finalize error: {e}")
+        if session_id:
+            job_scheduler.finished(session_id, dispatch_images_task)
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
 @csrf_exempt
 def get_progress_status(request):
     """Get progress"""
@@ -441,6 +1160,56 @@ def get_progress_status(request):
     progress_data = get_progress(session_id)
     return JsonResponse(progress_data)
 
+async def progress_events(session_id):
+    """Yield Server-Sent Events frames with progress until processing finishes or fails"""
+    client = aioredis.Redis.from_url(settings.CELERY_BROKER_URL)
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading the current state so no update falls in between
+        await pubsub.subscribe(f"progress_channel:{session_id}")
+        progress_data = await sync_to_async(get_progress)(session_id)
+        yield f"data: {json.dumps(progress_data)}\n\n"
+        if progress_finished(progress_data):
+            return
+        
+        deadline = time.monotonic() + 3600
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15)
+            if message is None:
+                # Nothing is published while the job waits, so refresh its queue position
+                progress_data = await sync_to_async(get_progress)(session_id)
+                if (progress_data.get('queue') or {}).get('state') in ('queued', 'held'):
+                    yield f"data: {json.dumps(progress_data)}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+                continue
+            
+            payload = message['data'].decode('utf-8')
+            yield f"data: {payload}\n\n"
+            if progress_finished(json.loads(payload)):
+                return
+    except Exception as e:
+        logger.error(f"Progress stream error: {e}")
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+async def progress_stream(request):
+    """Stream progress as Server-Sent Events (needs the ASGI server)"""
+    session_id = request.GET.get('session_id')
+    if not session_id:
+        return JsonResponse({'error': 'Thiếu session_id'}, status=400)
+    
+    # A sync worker would buffer the whole stream; make the browser fall back to polling
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Cần máy chủ ASGI'}, status=503)
+    
+    return StreamingHttpResponse(
+        progress_events(session_id),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 def result_page(request):
     """Display results - FIXED VERSION"""
     logger.info("=== RESULT PAGE CALLED ===")
@@ -463,10 +1232,11 @@ def result_page(request):
         })
     
     try:
-        result_data = redis_client.get(f"result:{session_id}")
-        logger.info(f"Redis data found: {result_data is not None}")
+        stored = row_store.meta(session_id)
+        result = load_session_result(session_id, stored['entries'])
+        logger.info(f"Redis data found: {result is not None}")
         
-        if not result_data:
+        if not result:
             logger.warning("No result in Redis")
             return render(request, 'apps/results.html', {
                 'has_data': False,
@@ -480,18 +1250,19 @@ def result_page(request):
                 'error_message': 'Đang xử lý... Vui lòng đợi và tải lại trang'
             })
         
-        result = json.loads(result_data)
-        logger.info(f"Success: {result.get('success')}, Data count: {len(result.get('data', []))}")
+        is_partial = result['partial']
+        processing_type = result.get('processing_type') or stored['processing_type']
+        logger.info(f"Success: {result.get('success')}, New rows: {len(result.get('data', []))}, "
+                    f"partial: {is_partial}")
+        
+        if result.get('success') and 'entries' in result:
+            # Rows already stored keep their edits; only those of new entries are added
+            row_store.append(session_id, result['data'], stored['entries'], result['entries'])
         
-        if result.get('success') and result.get('data'):
-            data = result['data']
+        data = row_store.rows(session_id) if result.get('success') else []
+        if data:
             image_results = result.get('image_results', [])
             
-            # Save to session
-            request.session['extracted_data'] = data
-            request.session['processing_type'] = result.get('processing_type', 'transcript')
-            request.session['excel_filename'] = result.get('excel_filename', 'ocr_ketqua.xlsx')
-            
             # Get processed images
             processed_images = []
             error_image_filenames = []
@@ -526,19 +1297,33 @@ def result_page(request):
                 'has_data': True,
                 'df_rows': data,
                 'df_columns': columns,
-                'processing_type': result.get('processing_type', 'transcript'),
+                'processing_type': processing_type,
                 'processed_images': processed_images,
                 'image_results': image_results,
                 'session_id': session_id,
                 'error_image_filenames': error_image_filenames,
+                'is_partial': is_partial,
+                'progress': get_progress(session_id) if is_partial else None,
                 'error_message': None
             })
+        elif is_partial:
+            return render(request, 'apps/results.html', {
+                'has_data': False,
+                'processing_type': processing_type,
+                'df_rows': [],
+                'df_columns': [],
+                'processed_images': [],
+                'image_results': [],
+                'error_image_filenames': [],
+                'session_id': session_id,
+                'error_message': 'Đang xử lý... Vui lòng đợi và tải lại trang'
+            })
         else:
             error_msg = result.get('error', 'Không thể xử lý')
             logger.warning(f"Processing failed: {error_msg}")
             return render(request, 'apps/results.html', {
                 'has_data': False,
-                'processing_type': result.get('processing_type', 'transcript'),
+                'processing_type': processing_type,
                 'df_rows': [],
                 'df_columns': [],
                 'processed_images': [],
@@ -571,18 +1356,20 @@ def edit_record(request):
         try:
             changes = json.loads(request.body)
             results = []
-            extracted_data = request.session.get('extracted_data', [])
+            updates = []
+            session_id = request.session.get('session_id')
+            row_count = row_store.meta(session_id)['count'] if session_id else 0
             
             for change in changes:
                 row_index = change.get('row_index', -1)
                 field_name = change.get('field_name', '')
                 new_value = change.get('new_value', '')
                 
-                if 0 <= row_index < len(extracted_data):
+                if 0 <= row_index < row_count:
                     if field_name == 'Sbd':
                         cleaned_sbd = clean_sbd(new_value)
                         if len(cleaned_sbd) == 5 and cleaned_sbd.isdigit():
-                            extracted_data[row_index][field_name] = cleaned_sbd
+                            updates.append((row_index, field_name, cleaned_sbd))
                             results.append({'success': True, 'row_index': row_index})
                         else:
                             results.append({'success': False, 'error': 'SBD không hợp lệ', 'row_index': row_index})
@@ -590,7 +1377,7 @@ def edit_record(request):
                         try:
                             score = float(new_value)
                             if 0 <= score <= 10:
-                                extracted_data[row_index][field_name] = score
+                                updates.append((row_index, field_name, score))
                                 results.append({'success': True, 'row_index': row_index})
                             else:
                                 results.append({'success': False, 'error': 'Điểm 0-10', 'row_index': row_index})
@@ -599,18 +1386,18 @@ def edit_record(request):
                     elif field_name == 'Date_birth_VN':
                         cleaned_date = clean_date_string(new_value)
                         if cleaned_date:
-                            extracted_data[row_index][field_name] = cleaned_date
+                            updates.append((row_index, field_name, cleaned_date))
                             results.append({'success': True, 'row_index': row_index})
                         else:
                             results.append({'success': False, 'error': 'Ngày không hợp lệ', 'row_index': row_index})
                     else:
-                        extracted_data[row_index][field_name] = str(new_value).strip()
+                        updates.append((row_index, field_name, str(new_value).strip()))
                         results.append({'success': True, 'row_index': row_index})
                 else:
                     results.append({'success': False, 'error': 'Không tồn tại', 'row_index': row_index})
             
-            request.session['extracted_data'] = extracted_data
-            request.session.modified = True
+            if updates:
+                row_store.update(session_id, updates)
             
             return JsonResponse(results, safe=False)
             
@@ -657,95 +1444,62 @@ def replace_image(request):
     
     return JsonResponse({'success': False, 'error': 'Invalid'})
 
+TRANSCRIPT_COLUMNS = [
+    'TT', 'Lớp môn nhập AAIS', 'Tài khoản', 'SBD', 'Lớp', 'MSSV', 
+    'Họ và tên', 'Ngày sinh', 'X', 'QT', 'KT', 'Thi', 'Điểm học phần', 
+    'Thang điểm chữ', 'Thang điểm 4', 'Ghi chú'
+]
+
+CERTIFICATE_COLUMNS = [
+    "TT", "Đơn vị đào tạo", "Đơn vị liên kết", "Ngành học HOU", "Lớp", "Họ và tên", "Ngày sinh",
+    "Mã SV", "Văn Bằng", "Ngành", "Nơi cấp", "TT_2", "Tên Học Phần", "Mã môn", "Số TC", "Tài khoản học"
+]
+
+def write_export(target, extracted_data, processing_type):
+    """Write the Excel export of a session's rows to `target`"""
+    if processing_type == "transcript":
+        df = process_transcript_dataframe(pd.DataFrame(extracted_data))
+        if 'Thi' in df.columns:
+            scores = pd.to_numeric(df['Thi'], errors='coerce').fillna(0.0).tolist()
+        else:
+            scores = [0.0] * len(df)
+        
+        # TT keeps the row's position among all extracted rows
+        rows = ([idx + 1, None, None, sbd, None, None, None, None, None, None, None, score, None, None, None, None]
+                for idx, sbd, score in zip(df.index.tolist(), df['Sbd'].tolist(), scores))
+        write_xlsx(target, TRANSCRIPT_COLUMNS, rows, column_formats={'SBD': '@', 'Thi': '0.0'})
+    
+    elif processing_type == "certificate":
+        rows = ([i + 1, "Viện ĐT&PT học tập suốt đời", None, None, None,
+                 d.get("Ho_ten") or None, d.get("Date_birth_VN") or None, None, d.get("Bang_cap") or None,
+                 d.get("Nganh") or None, d.get("Noi_cap") or None, None, None, None, None, None]
+                for i, d in enumerate(extracted_data))
+        write_xlsx(target, CERTIFICATE_COLUMNS, rows, start_row=9)
+    
+    else:
+        raise ValueError(f"Unknown processing type: {processing_type}")
+
 def download_excel(request):
-    """Download Excel"""
-    extracted_data = request.session.get('extracted_data')
-    excel_filename = request.session.get('excel_filename', 'ocr_ketqua.xlsx')
-    processing_type = request.session.get('processing_type', 'transcript')
+    """Download Excel, built once per version of the session's rows and streamed from disk"""
+    session_id = request.session.get('session_id')
+    if not session_id:
+        return redirect('upload_file')
     
-    if not extracted_data:
+    meta = row_store.meta(session_id)
+    if not meta['count']:
         return redirect('upload_file')
 
     try:
-        if isinstance(extracted_data, str):
-            extracted_data = json.loads(extracted_data)
-        
-        df = pd.DataFrame(extracted_data)
-        
-        if df.empty:
-            return JsonResponse({'error': 'No data'}, status=400)
+        def build(target):
+            write_export(target, row_store.rows(session_id), meta['processing_type'])
         
-        if processing_type == "transcript":
-            df = process_transcript_dataframe(df)
-            if 'Thi' in df.columns:
-                df['Thi'] = pd.to_numeric(df['Thi'], errors='coerce').fillna(0.0)
-
-            output_cols = [
-                'TT', 'Lớp môn nhập AAIS', 'Tài khoản', 'SBD', 'Lớp', 'MSSV', 
-                'Họ và tên', 'Ngày sinh', 'X', 'QT', 'KT', 'Thi', 'Điểm học phần', 
-                'Thang điểm chữ', 'Thang điểm 4', 'Ghi chú'
-            ]
-            
-            rows = []
-            for idx, row in df.iterrows():
-                new_row = {col: None for col in output_cols}
-                new_row['TT'] = idx + 1
-                new_row['SBD'] = row.get('Sbd', '')
-                new_row['Thi'] = row.get('Thi', 0.0)
-                rows.append(new_row)
-                
-            df_final = pd.DataFrame(rows, columns=output_cols)
-
-        elif processing_type == "certificate":
-            df_final = pd.DataFrame([{
-                "TT": i + 1,
-                "Đơn vị đào tạo": "Viện ĐT&PT học tập suốt đời",
-                "Đơn vị liên kết": "",
-                "Ngành học HOU": "",
-                "Lớp": "",
-                "Họ và tên": d.get("Ho_ten", ""),
-                "Ngày sinh": d.get("Date_birth_VN", ""),
-                "Mã SV": "",
-                "Văn Bằng": d.get("Bang_cap", ""),
-                "Ngành": d.get("Nganh", ""),
-                "Nơi cấp": d.get("Noi_cap", ""),
-                "TT_2": "",
-                "Tên Học Phần": "",
-                "Mã môn": "",
-                "Số TC": "",
-                "Tài khoản học": ""
-            } for i, d in enumerate(extracted_data)])
-
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            if processing_type == "transcript":
-                df_final.to_excel(writer, index=False, sheet_name='Sheet1')
-                ws = writer.sheets['Sheet1']
-                
-                if 'SBD' in output_cols:
-                    sbd_col_idx = output_cols.index("SBD") + 1
-                    for i in range(2, ws.max_row + 1):
-                        sbd_cell = ws[f'{get_column_letter(sbd_col_idx)}{i}']
-                        sbd_cell.number_format = '@'
-                
-                if 'Thi' in output_cols:
-                    thi_col_idx = output_cols.index("Thi") + 1
-                    for i in range(2, ws.max_row + 1):
-                        thi_cell = ws[f'{get_column_letter(thi_col_idx)}{i}']
-                        thi_cell.number_format = '0.0'
-            else:
-                df_final.to_excel(writer, index=False, startrow=9, sheet_name='Sheet1')
-                
-        buffer.seek(0)
-        
-        response = HttpResponse(
-            buffer.read(), 
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        path = export_cache.get_or_build(session_id, meta['version'], build)
+        return FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=meta['excel_filename'],
+            content_type=XLSX_CONTENT_TYPE
         )
-        response['Content-Disposition'] = f'attachment; filename="{excel_filename}"'
-        
-        buffer.close()
-        return response
         
     except Exception as e:
         logger.error(f"Error in download_excel: {e}")
@@ -0,0 +1,128 @@
+# apps/zip_archive.py
+import mmap
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .zip_stream import LOCAL_HEADER, LOCAL_SIGNATURE, inflate_entry
+
+SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+
+def is_zip_image_name(filename):
+    """True for ZIP entry names of images we process"""
+    return (filename.lower().endswith(SUPPORTED_FORMATS)
+            and not filename.startswith('__MACOSX/')
+            and not filename.startswith('.')
+            and not '/.' in filename)
+
+
+class ZipArchive:
+    """Image entries of a ZIP, indexed once and readable from many threads.
+
+    The central directory is parsed when the archive is opened. Stored and
+    deflated entries are inflated straight from a read-only mmap of the file,
+    so threads share no file position and zlib runs without the GIL; other
+    compression methods fall back to a zipfile handle per thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path, 'r') as zf:
+            # Archive order, as in the central directory
+            self.images = [entry for entry in zf.infolist() if is_zip_image_name(entry.filename)]
+        self._by_name = {entry.filename: entry for entry in self.images}
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._handles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def getinfo(self, name):
+        """ZipInfo of an image entry by name; KeyError if there is none"""
+        return self._by_name[name]
+
+    def _mapped(self):
+        with self._lock:
+            if self._map is None:
+                self._file = open(self.path, 'rb')
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._map
+
+    def _thread_handle(self):
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = self._local.handle = zipfile.ZipFile(self.path, 'r')
+            with self._lock:
+                self._handles.append(handle)
+        return handle
+
+    def read(self, entry):
+        """Bytes of an entry, given its ZipInfo or name"""
+        if isinstance(entry, str):
+            entry = self.getinfo(entry)
+        if entry.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or entry.flag_bits & 0x01:
+            return self._thread_handle().read(entry.filename)
+
+        data = self._mapped()
+        offset = entry.header_offset
+        header = data[offset:offset + LOCAL_HEADER.size]
+        if len(header) != LOCAL_HEADER.size or header[:4] != LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local header for {entry.filename}")
+        name_length, extra_length = LOCAL_HEADER.unpack(header)[-2:]
+        start = offset + LOCAL_HEADER.size + name_length + extra_length
+        view = memoryview(data)[start:start + entry.compress_size]
+        try:
+            return inflate_entry(view, entry.filename, entry.compress_type, entry.file_size, entry.CRC)
+        finally:
+            view.release()
+
+    def read_ahead(self, entries, workers=4):
+        """Yield (image_bytes, error) for each entry in order, inflating up to `workers` ahead in threads"""
+        if workers <= 1:
+            for entry in entries:
+                try:
+                    yield self.read(entry), None
+                except Exception as e:
+                    yield None, e
+            return
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zip-read') as executor:
+            pending = deque()
+            for entry in entries:
+                pending.append(executor.submit(self.read, entry))
+                if len(pending) >= workers:
+                    yield self._outcome(pending.popleft())
+            while pending:
+                yield self._outcome(pending.popleft())
+
+    @staticmethod
+    def _outcome(future):
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
@@ -0,0 +1,94 @@
+# apps/zip_stream.py
+import zlib
+import struct
+import zipfile
+from collections import namedtuple
+
+LOCAL_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+# Encrypted, or sizes only known from a data descriptor after the data
+UNSTREAMABLE_FLAGS = 0x01 | 0x08
+UTF8_FLAG = 0x800
+
+LocalEntry = namedtuple('LocalEntry', [
+    'filename', 'header_offset', 'data_offset', 'compress_type', 'compress_size', 'file_size', 'crc'
+])
+
+
+def _zip64_sizes(extra, file_size, compress_size):
+    """Sizes from the ZIP64 extra field, for entries whose header says 0xFFFFFFFF"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, length = struct.unpack('<HH', extra[pos:pos + 4])
+        if header_id == 0x0001:
+            values = extra[pos + 4:pos + 4 + length]
+            if file_size == 0xFFFFFFFF and len(values) >= 8:
+                file_size = struct.unpack('<Q', values[:8])[0]
+                values = values[8:]
+            if compress_size == 0xFFFFFFFF and len(values) >= 8:
+                compress_size = struct.unpack('<Q', values[:8])[0]
+            break
+        pos += 4 + length
+    return file_size, compress_size
+
+
+def scan_local_entries(f, offset, available):
+    """Parse local file headers from `offset` for entries lying entirely within `available` bytes.
+
+    Returns (entries, next_offset, finished). `finished` is True once the
+    central directory is reached, or an entry cannot be located without it
+    (encrypted or written with a data descriptor); the rest of the archive
+    must then wait for the complete file.
+    """
+    entries = []
+    while offset + LOCAL_HEADER.size <= available:
+        f.seek(offset)
+        header = f.read(LOCAL_HEADER.size)
+        if header[:4] != LOCAL_SIGNATURE:
+            return entries, offset, True
+
+        (_, _, flags, compress_type, _, _, crc, compress_size, file_size,
+         name_length, extra_length) = LOCAL_HEADER.unpack(header)
+        if flags & UNSTREAMABLE_FLAGS:
+            return entries, offset, True
+
+        data_offset = offset + LOCAL_HEADER.size + name_length + extra_length
+        if data_offset > available:
+            break
+        name = f.read(name_length)
+        extra = f.read(extra_length)
+        if compress_size == 0xFFFFFFFF or file_size == 0xFFFFFFFF:
+            file_size, compress_size = _zip64_sizes(extra, file_size, compress_size)
+        if data_offset + compress_size > available:
+            break
+
+        # Same decoding as zipfile, so names match ZipInfo.filename
+        filename = name.decode('utf-8' if flags & UTF8_FLAG else 'cp437')
+        filename = filename.split('\x00', 1)[0]
+        entries.append(LocalEntry(filename, offset, data_offset, compress_type, compress_size, file_size, crc))
+        offset = data_offset + compress_size
+
+    return entries, offset, False
+
+
+def inflate_entry(data, filename, compress_type, file_size, crc):
+    """Decompress a stored or deflated entry's raw data, checking size and CRC"""
+    if compress_type == zipfile.ZIP_STORED:
+        content = bytes(data)
+    elif compress_type == zipfile.ZIP_DEFLATED:
+        content = zlib.decompress(data, -15)
+    else:
+        raise zipfile.BadZipFile(f"Unsupported compression {compress_type} for {filename}")
+
+    if len(content) != file_size or zlib.crc32(content) != crc:
+        raise zipfile.BadZipFile(f"Bad CRC for {filename}")
+    return content
+
+
+def read_local_entry(path, entry):
+    """Read and decompress one entry found by scan_local_entries, checking its CRC"""
+    with open(path, 'rb') as f:
+        f.seek(entry.data_offset)
+        data = f.read(entry.compress_size)
+    return inflate_entry(data, entry.filename, entry.compress_type, entry.file_size, entry.crc)
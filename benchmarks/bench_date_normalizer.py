@@ -0,0 +1,93 @@
+"""
+Date normalization: the previous strptime loop against normalize_date.
+
+Birth dates repeat a lot in a certificate batch, so the corpus draws a
+configurable number of values from a smaller pool written in the forms
+OCR returns. Every value the old function understood must normalize to
+the same result.
+
+    python benchmarks/bench_date_normalizer.py [values] [distinct]
+"""
+import os
+import re
+import sys
+import time
+import random
+import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+FORMS = [
+    lambda d: d.strftime("%d/%m/%Y"),
+    lambda d: f"{d.day}/{d.month}/{d.year}",
+    lambda d: d.strftime("%d-%m-%Y"),
+    lambda d: d.strftime("%d.%m.%Y"),
+    lambda d: d.strftime("%Y-%m-%d"),
+    lambda d: f"{d.day} tháng {d.month} năm {d.year}",
+    lambda d: f"Ngày {d.day:02d} tháng {d.month:02d} năm {d.year}",
+    lambda d: f"{d.day:02d} / {d.month:02d} / {d.year}",
+    lambda d: d.strftime("%d/%m/%y"),
+    lambda d: "không rõ",
+]
+
+
+def legacy_clean_date_string(date_str):
+    """clean_date_string before the normalizer"""
+    if not isinstance(date_str, str):
+        return ""
+    for fmt in ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]:
+        try:
+            return datetime.datetime.strptime(date_str.strip(), fmt).strftime("%d/%m/%Y")
+        except ValueError:
+            continue
+    match = re.match(r'(\d{1,2})\s*tháng\s*(\d{1,2})\s*năm\s*(\d{4})', date_str, re.IGNORECASE)
+    if match:
+        day, month, year = match.groups()
+        return f"{day.zfill(2)}/{month.zfill(2)}/{year}"
+    return ""
+
+
+def make_values(count, distinct):
+    rng = random.Random(count)
+    start = datetime.date(1960, 1, 1)
+    pool = [rng.choice(FORMS)(start + datetime.timedelta(days=rng.randrange(20000))) for _ in range(distinct)]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    import pandas as pd
+    from apps.date_normalizer import normalize_date, normalize_date_series, _normalize
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    values = make_values(count, distinct)
+
+    legacy, legacy_seconds = timed(lambda: [legacy_clean_date_string(v) for v in values])
+    _normalize.cache_clear()
+    cold, cold_seconds = timed(lambda: [_normalize.__wrapped__(v) for v in values])
+    _normalize.cache_clear()
+    memo, memo_seconds = timed(lambda: [normalize_date(v) for v in values])
+    series = pd.Series(values)
+    _normalize.cache_clear()
+    vectorized, series_seconds = timed(lambda: normalize_date_series(series))
+
+    for old, new in zip(legacy, memo):
+        assert not old or old == new, (old, new)
+    assert cold == memo == vectorized.tolist()
+    understood = sum(1 for v in memo if v)
+    print(f"{count} values ({distinct} distinct): {sum(1 for v in legacy if v)} understood before, {understood} now")
+    print(f"{'strptime loop':>20} {legacy_seconds:8.3f} s")
+    print(f"{'regex, no memo':>20} {cold_seconds:8.3f} s  ({legacy_seconds / cold_seconds:.1f}x)")
+    print(f"{'normalize_date':>20} {memo_seconds:8.3f} s  ({legacy_seconds / memo_seconds:.1f}x)")
+    print(f"{'Series entry point':>20} {series_seconds:8.3f} s  ({legacy_seconds / series_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Spelling dictionary startup: parsing the word lists against the compiled index.
+
+Each mode runs in fresh processes, like gunicorn workers and Celery
+processes starting up, and reports the time to a ready corrector, the
+memory it then holds privately (pages of the mapped index are shared
+through the page cache and not counted) and cold lookup time. Linux only
+(/proc).
+
+    python benchmarks/bench_dictionary_index.py [workers] [tokens]
+"""
+import os
+import sys
+import glob
+import time
+import tempfile
+import multiprocessing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+DICTIONARY_FILES = sorted(glob.glob(os.path.join(BASE_DIR, 'thuvien_tiengviet', '*.txt')))
+MAX_DISTANCE = 1
+PREFIX_LENGTH = 7
+
+
+def private_bytes():
+    """Private (unshared) resident memory of this process"""
+    total = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def load_and_lookup(mode, index_path, tokens):
+    from apps.spelling import SpellingCorrector
+    from apps.dictionary_index import load_dictionary
+
+    before = private_bytes()
+    start = time.perf_counter()
+    if mode == 'text':
+        corrector = SpellingCorrector.from_files(DICTIONARY_FILES, max_distance=MAX_DISTANCE,
+                                                 prefix_length=PREFIX_LENGTH)
+    else:
+        corrector = SpellingCorrector.from_compiled(
+            load_dictionary(DICTIONARY_FILES, index_path, MAX_DISTANCE, PREFIX_LENGTH))
+    load_seconds = time.perf_counter() - start
+    private = private_bytes() - before
+
+    start = time.perf_counter()
+    results = [corrector._lookup(token) for token in tokens]
+    lookup_seconds = time.perf_counter() - start
+    return load_seconds, private, lookup_seconds / len(tokens), results
+
+
+def main():
+    sys.path.insert(0, os.path.join(BASE_DIR, 'benchmarks'))
+    from bench_spelling import make_tokens
+    from apps.dictionary_index import compile_dictionary, read_dictionary
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 3_000
+
+    counts, _ = read_dictionary(DICTIONARY_FILES)
+    tokens = list(dict.fromkeys(make_tokens(sorted(w for w in counts if len(w) > 1), count, count)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = os.path.join(directory, 'dictionary.idx')
+        start = time.perf_counter()
+        compile_dictionary(DICTIONARY_FILES, index_path, MAX_DISTANCE, PREFIX_LENGTH)
+        print(f"compile: {time.perf_counter() - start:.3f} s, {os.path.getsize(index_path) / 1024:.0f} KiB")
+
+        context = multiprocessing.get_context('spawn')
+        results = {}
+        for mode in ('text', 'compiled'):
+            with context.Pool(workers) as pool:
+                runs = pool.starmap(load_and_lookup, [(mode, index_path, tokens)] * workers)
+            results[mode] = runs[0][3]
+            load = max(run[0] for run in runs)
+            private = sum(run[1] for run in runs) / workers
+            lookup = sum(run[2] for run in runs) / workers
+            print(f"{mode:>9}: load {load * 1000:8.1f} ms, private memory {private / 1024 ** 2:6.1f} MiB/process "
+                  f"({private * workers / 1024 ** 2:.1f} MiB for {workers}), lookup {lookup * 1e6:6.1f} us/token")
+        assert results['text'] == results['compiled']
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Excel export: the previous pandas/ExcelWriter path against write_export.
+
+Both build the transcript export of the same synthetic rows (a few invalid
+SBDs are mixed in, as OCR produces them). Each run is a separate process so
+max RSS is per run. The non-empty cells of the two workbooks (values and
+number formats) are compared first.
+
+    python benchmarks/bench_excel_export.py [rows...]
+"""
+import io
+import os
+import sys
+import json
+import importlib
+import time
+import random
+import resource
+import subprocess
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+def make_rows(num_rows):
+    rng = random.Random(num_rows)
+    rows = []
+    for i in range(num_rows):
+        sbd = f"{rng.randint(0, 99999):05d}" if i % 50 else "AB"
+        score = rng.choice([round(rng.uniform(0, 10), 1), str(rng.randint(0, 10)), None])
+        rows.append({'Sbd': sbd, 'Thi': score})
+    return rows
+
+
+def legacy_export(extracted_data):
+    """download_excel before the write-only engine"""
+    import pandas as pd
+    from openpyxl.utils import get_column_letter
+    from apps.views import process_transcript_dataframe, TRANSCRIPT_COLUMNS as output_cols
+
+    df = process_transcript_dataframe(pd.DataFrame(extracted_data))
+    if 'Thi' in df.columns:
+        df['Thi'] = pd.to_numeric(df['Thi'], errors='coerce').fillna(0.0)
+    rows = []
+    for idx, row in df.iterrows():
+        new_row = {col: None for col in output_cols}
+        new_row['TT'] = idx + 1
+        new_row['SBD'] = row.get('Sbd', '')
+        new_row['Thi'] = row.get('Thi', 0.0)
+        rows.append(new_row)
+    df_final = pd.DataFrame(rows, columns=output_cols)
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        df_final.to_excel(writer, index=False, sheet_name='Sheet1')
+        ws = writer.sheets['Sheet1']
+        sbd_col_idx = output_cols.index("SBD") + 1
+        for i in range(2, ws.max_row + 1):
+            ws[f'{get_column_letter(sbd_col_idx)}{i}'].number_format = '@'
+        thi_col_idx = output_cols.index("Thi") + 1
+        for i in range(2, ws.max_row + 1):
+            ws[f'{get_column_letter(thi_col_idx)}{i}'].number_format = '0.0'
+    buffer.seek(0)
+    return buffer.read()
+
+
+def streaming_export(extracted_data):
+    from apps.views import write_export
+    buffer = io.BytesIO()
+    write_export(buffer, extracted_data, 'transcript')
+    return buffer.getvalue()
+
+
+def sheet_cells(content):
+    """Value and number format of every non-empty cell, by coordinate"""
+    from openpyxl import load_workbook
+    sheet = load_workbook(io.BytesIO(content)).active
+    return {cell.coordinate: (cell.value, cell.number_format)
+            for row in sheet.iter_rows() for cell in row if cell.value not in (None, '')}
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocr.settings')
+    import django
+    django.setup()
+    # Import the views up front so their start-up cost is not timed
+    importlib.import_module('apps.views')
+
+
+def run_one(engine, num_rows):
+    setup()
+    export = legacy_export if engine == 'legacy' else streaming_export
+    rows = make_rows(num_rows)
+
+    start = time.perf_counter()
+    content = export(rows)
+    elapsed = time.perf_counter() - start
+
+    # Traced separately: tracemalloc slows the export down several times
+    tracemalloc.start()
+    export(rows)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'engine': engine,
+        'rows': num_rows,
+        'seconds': round(elapsed, 2),
+        'traced_peak_mb': round(traced_peak / 1024 / 1024, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'xlsx_kb': len(content) // 1024,
+    }))
+
+
+def check_same_cells():
+    setup()
+    rows = make_rows(2000)
+    assert sheet_cells(legacy_export(rows)) == sheet_cells(streaming_export(rows)), "exports differ"
+    print("legacy and streaming exports have the same cells")
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or [10000, 100000]
+    check_same_cells()
+    print(f"{'engine':>10} {'rows':>8} {'time s':>8} {'traced MB':>10} {'max RSS MB':>11} {'xlsx KB':>8}")
+    for size in sizes:
+        for engine in ('legacy', 'streaming'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--one', engine, str(size)],
+                capture_output=True, text=True, check=True, cwd=BASE_DIR
+            ).stdout.strip().splitlines()[-1]
+            row = json.loads(output)
+            print(f"{row['engine']:>10} {row['rows']:>8} {row['seconds']:>8} "
+                  f"{row['traced_peak_mb']:>10} {row['max_rss_mb']:>11} {row['xlsx_kb']:>8}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--one':
+        run_one(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
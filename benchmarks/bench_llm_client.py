@@ -0,0 +1,96 @@
+"""
+Per-image LLM client overhead: new ChatGoogleGenerativeAI per image vs the shared pool.
+
+Runs against a local fake Gemini REST endpoint, so only client construction and
+connection setup are measured (no real API calls, no TLS).
+
+    python benchmarks/bench_llm_client.py [num_images]
+"""
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import HumanMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+from apps.llm_pool import get_llm, reset_pool
+
+MODEL = "gemini-2.0-flash"
+TINY_GIF = "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
+
+FAKE_RESPONSE = json.dumps({
+    "candidates": [{
+        "content": {"parts": [{"text": '{"items": [{"Sbd": "00123", "Thi": 8.5}]}'}], "role": "model"},
+        "finishReason": "STOP",
+        "index": 0
+    }],
+    "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 10, "totalTokenCount": 20}
+}).encode()
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(FAKE_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(FAKE_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_message():
+    return HumanMessage(content=[
+        {"type": "text", "text": "benchmark"},
+        {"type": "image_url", "image_url": {"url": TINY_GIF}}
+    ])
+
+
+def run(label, num_images, make_llm):
+    FakeGeminiHandler.connections = set()
+    start = time.perf_counter()
+    for _ in range(num_images):
+        make_llm().invoke([make_message()])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} total {elapsed:.3f}s  per image {elapsed / num_images * 1000:.2f} ms  "
+          f"connections {len(FakeGeminiHandler.connections)}")
+
+
+def main():
+    num_images = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeminiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client_kwargs = {
+        'transport': 'rest',
+        'client_options': {'api_endpoint': f"http://127.0.0.1:{server.server_port}"},
+    }
+
+    def new_client():
+        return ChatGoogleGenerativeAI(
+            model=MODEL, temperature=0, google_api_key="fake-key",
+            request_timeout=30, max_retries=0, **client_kwargs
+        )
+
+    def pooled_client():
+        return get_llm("fake-key", MODEL, request_timeout=30, max_retries=0, **client_kwargs)
+
+    print(f"{num_images} images against fake endpoint on port {server.server_port}")
+    run("per-image", num_images, new_client)
+    reset_pool()
+    run("pooled", num_images, pooled_client)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
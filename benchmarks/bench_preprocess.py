@@ -0,0 +1,99 @@
+"""
+OCR image preprocessing on data_ocr/van_bang: inline on I/O threads (what daemonic prefork
+children do) vs the process pool, called directly and from a Celery --pool threads worker
+as start_celery.sh runs it.
+
+CPU utilization is process + pool worker CPU time over wall time and core count (pool
+workers come from a forkserver, so they are read from /proc rather than RUSAGE_CHILDREN).
+
+    python benchmarks/bench_preprocess.py [threads]
+"""
+import os
+import sys
+import glob
+import time
+import resource
+from concurrent.futures import ThreadPoolExecutor
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from apps.imaging import ImagePreprocessor, preprocess_for_ocr, physical_cpu_count
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def pool_cpu_seconds(preprocessor):
+    """CPU time of the preprocessing pool workers, which are not our children"""
+    total = 0
+    for pid in list(getattr(preprocessor._executor, '_processes', None) or ()):
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+
+def map_threads(preprocess, images, threads):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(preprocess, images))
+
+
+def map_celery(preprocess, images, threads, pool):
+    app = Celery('bench-preprocess', broker='memory://', backend='cache+memory://')
+    app.conf.update(task_serializer='pickle', result_serializer='pickle', accept_content=['pickle'])
+
+    @app.task(name='preprocess')
+    def preprocess_task(data):
+        return preprocess(data)
+
+    with start_worker(app, pool=pool, concurrency=threads, perform_ping_check=False, shutdown_timeout=60):
+        results = [preprocess_task.delay(image) for image in images]
+        return [result.get(timeout=600) for result in results]
+
+
+def run(label, images, threads, preprocess, preprocessor=None, pool=None):
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    if pool:
+        outputs = map_celery(preprocess, images, threads, pool)
+    else:
+        outputs = map_threads(preprocess, images, threads)
+    wall = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_start
+    if preprocessor:
+        cpu += pool_cpu_seconds(preprocessor)
+        preprocessor.shutdown()
+    utilization = cpu / wall / (os.cpu_count() or 1) * 100
+    out_mb = sum(len(o) for o in outputs) / 1024 / 1024
+    print(f"{label:<14} wall {wall:6.2f}s  cpu {cpu:6.2f}s  utilization {utilization:5.1f}%  output {out_mb:.1f} MB")
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    paths = sorted(glob.glob(os.path.join(BASE_DIR, 'data_ocr', 'van_bang', '*')))
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+
+    print(f"{len(images)} images, {sum(map(len, images)) / 1024 / 1024:.1f} MB, "
+          f"{physical_cpu_count()} physical / {os.cpu_count()} logical cores, {threads} I/O threads")
+
+    run("inline", images, threads, preprocess_for_ocr)
+
+    preprocessor = ImagePreprocessor()
+    run("process pool", images, max(threads, preprocessor.processes), preprocessor.preprocess, preprocessor)
+
+    # The OCR worker setup: tasks on threads of the worker's main process share its pool
+    preprocessor = ImagePreprocessor()
+    run("celery threads", images, threads, preprocessor.preprocess, preprocessor, pool='threads')
+
+
+if __name__ == "__main__":
+    main()
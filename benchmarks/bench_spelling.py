@@ -0,0 +1,133 @@
+"""
+Dictionary correction: index load time and lookup throughput.
+
+Loads the bundled Vietnamese word lists into SpellingCorrector and times:
+reading the files, building the deletion index for edit distance 1
+(OCR_DICTIONARY_MAX_DISTANCE) and 2, single-word lookups with and without
+the memo (against a linear edit-distance scan over the whole vocabulary),
+and correct_text over certificate-like fields. The noisy words have one
+tone mark changed, as OCR does.
+
+    python benchmarks/bench_spelling.py [tokens] [distinct]
+"""
+import os
+import sys
+import glob
+import time
+import random
+import unicodedata
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+DICTIONARY_FILES = sorted(glob.glob(os.path.join(BASE_DIR, 'thuvien_tiengviet', '*.txt')))
+SCAN_SAMPLE = 200
+FIELDS = [
+    "Trường Đại học Mở Hà Nội", "Công nghệ thông tin", "Quản trị kinh doanh", "Kỹ thuật phần mềm",
+    "Ngôn ngữ Anh", "Kế toán", "Sư phạm Toán học", "Đại học Bách khoa Hà Nội", "Nguyễn Văn Xuân",
+    "Trần Thị Thu Hiền", "Luật kinh tế", "Tài chính - Ngân hàng",
+]
+TONES = ['\u0300', '\u0301', '\u0303', '\u0309', '\u0323']
+
+
+def add_noise(word, rng):
+    """word with one tone mark changed, added or removed"""
+    chars = list(unicodedata.normalize('NFD', word))
+    marks = [i for i, c in enumerate(chars) if c in TONES]
+    if marks:
+        i = marks[0]
+        old_tone = chars.pop(i)
+        while unicodedata.combining(chars[i - 1]):
+            i -= 1
+        vowel = i - 1
+        tone = rng.choice([''] + [t for t in TONES if t != old_tone])
+    else:
+        vowels = [i for i, c in enumerate(chars) if c in 'aeiouy']
+        if not vowels:
+            return word
+        vowel = rng.choice(vowels)
+        tone = rng.choice(TONES)
+    # After the vowel's other marks (the circumflex of ê, ...)
+    i = vowel + 1
+    while i < len(chars) and unicodedata.combining(chars[i]):
+        i += 1
+    chars.insert(i, tone)
+    return unicodedata.normalize('NFC', ''.join(chars))
+
+
+def make_tokens(words, count, distinct):
+    rng = random.Random(count)
+    pool = [add_noise(rng.choice(words), rng) for _ in range(distinct)]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def make_fields(count):
+    """(field, field with one noisy word) pairs"""
+    rng = random.Random(count)
+    fields = []
+    while len(fields) < count:
+        field = rng.choice(FIELDS)
+        words = field.split(' ')
+        i = rng.randrange(len(words))
+        words[i] = add_noise(words[i], rng)
+        if ' '.join(words) != field:
+            fields.append((field, ' '.join(words)))
+    return fields
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    from apps.spelling import SpellingCorrector, read_dictionary, edit_distance
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+
+    (counts, bigrams), read_seconds = timed(lambda: read_dictionary(DICTIONARY_FILES))
+    print(f"{len(counts)} words, {len(bigrams)} bigrams")
+    print(f"{'read word lists':>24} {read_seconds:8.3f} s")
+
+    words = sorted(w for w in counts if len(w) > 1)
+    tokens = make_tokens(words, count, distinct)
+
+    unique_tokens = list(dict.fromkeys(tokens))
+    vocabulary = list(counts)
+    sample = tokens[:SCAN_SAMPLE]
+    scan, scan_seconds = timed(lambda: [[w for w in vocabulary if edit_distance(t, w, 1) <= 1] for t in sample])
+    print(f"{'linear scan, d=1':>24} {scan_seconds / len(sample) * 1e6:8.1f} us/token")
+
+    correctors = {}
+    for max_distance in (2, 1):
+        corrector, index_seconds = timed(lambda: SpellingCorrector(counts, bigrams, max_distance=max_distance))
+        correctors[max_distance] = corrector
+        if max_distance == 1:
+            indexed = [corrector._lookup(t) for t in sample]
+            assert [sorted(found) for found in scan] == [sorted(s.term for s in found) for found in indexed]
+        _, cold_seconds = timed(lambda: [corrector._lookup(t) for t in unique_tokens])
+        _, memo_seconds = timed(lambda: [corrector.lookup(t) for t in tokens])
+        print(f"{f'build index, d={max_distance}':>24} {index_seconds:8.3f} s  ({len(corrector.deletes)} keys)")
+        print(f"{f'lookup d={max_distance}, no memo':>24} {cold_seconds / len(unique_tokens) * 1e6:8.1f} us/token")
+        print(f"{f'lookup d={max_distance}, memo':>24} {memo_seconds / count * 1e6:8.1f} us/token")
+
+    corrector = correctors[1]
+    fields = make_fields(count // 10)
+    word_count = sum(len(noisy.split()) for _, noisy in fields)
+    print(f"{len(fields)} fields with one wrong tone mark: restored / left as is / made wrong")
+    for apply_context in (False, True):
+        corrector.lookup.cache_clear()
+        corrector._correct_text.cache_clear()
+        results, text_seconds = timed(lambda: [corrector.correct_text(noisy, apply_context=apply_context)[0]
+                                               for _, noisy in fields])
+        restored = sum(1 for (field, _), result in zip(fields, results) if result == field)
+        unchanged = sum(1 for (_, noisy), result in zip(fields, results) if result == noisy)
+        label = 'correct_text, context' if apply_context else 'correct_text'
+        print(f"{label:>24} {text_seconds / word_count * 1e6:8.1f} us/word  "
+              f"({restored} / {unchanged} / {len(fields) - restored - unchanged})")
+
+
+if __name__ == "__main__":
+    main()
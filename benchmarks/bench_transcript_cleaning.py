@@ -0,0 +1,80 @@
+"""
+SBD cleaning of a transcript table: the previous per-row apply/regex path
+against the vectorized process_transcript_dataframe.
+
+The synthetic score table mixes clean SBDs with the noise OCR produces
+(separators, letters, too many or too few digits, None, numbers). Both
+paths must return the same frame before the timings are printed.
+
+    python benchmarks/bench_transcript_cleaning.py [rows]
+"""
+import os
+import re
+import sys
+import time
+import random
+import logging
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+NOISE = [None, '', 'AB', 'SBD: 12-345', '1234567', '12.0', 'O1234', '٣٤٥', '²²²²²', 7, 123.0, 'nan']
+
+
+def make_table(num_rows):
+    import pandas as pd
+    rng = random.Random(num_rows)
+    sbd = [rng.choice(NOISE) if i % 20 == 0 else f"{rng.randint(0, 99999):05d}" for i in range(num_rows)]
+    thi = [round(rng.uniform(0, 10), 1) for _ in range(num_rows)]
+    return pd.DataFrame({'Sbd': sbd, 'Thi': thi})
+
+
+def legacy_clean_sbd(raw_value):
+    if not raw_value:
+        return ""
+    digits = re.findall(r"\d+", str(raw_value))
+    if not digits:
+        return str(raw_value)
+    return "".join(digits).zfill(5)[:5]
+
+
+def legacy_process(df):
+    """process_transcript_dataframe before vectorization"""
+    if df.empty:
+        return df
+    df['Sbd'] = df['Sbd'].astype(str).apply(legacy_clean_sbd)
+    invalid_sbd = df[~df['Sbd'].apply(lambda x: len(x) == 5 and x.isdigit())]
+    if not invalid_sbd.empty:
+        logging.getLogger('apps').warning(f"Found {len(invalid_sbd)} invalid SBD entries")
+    return df[df['Sbd'].apply(lambda x: len(x) == 5 and x.isdigit())]
+
+
+def timed(func, table):
+    df = table.copy()
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def main():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocr.settings')
+    import django
+    django.setup()
+    import pandas as pd
+    from apps.views import process_transcript_dataframe
+    logging.getLogger('apps').setLevel(logging.ERROR)
+
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    table = make_table(num_rows)
+
+    legacy, legacy_seconds = timed(legacy_process, table)
+    vectorized, vectorized_seconds = timed(process_transcript_dataframe, table)
+    pd.testing.assert_frame_equal(legacy, vectorized)
+
+    print(f"{num_rows} rows, {len(vectorized)} valid SBDs: results identical")
+    print(f"{'legacy apply':>16} {legacy_seconds:8.2f} s")
+    print(f"{'vectorized':>16} {vectorized_seconds:8.2f} s  ({legacy_seconds / vectorized_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Peak memory of process_zip_file for growing ZIPs built from the samples in data_ocr/.
+
+Each size runs in its own process with a fake LLM (no API calls) and the OCR
+cache bypassed. Peak RSS and tracemalloc peak should stay roughly flat as the
+number of images grows. Needs Redis, like the app itself.
+
+    python benchmarks/bench_zip_memory.py [sizes...]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import resource
+import tempfile
+import zipfile
+import subprocess
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+class FakeResponse:
+    content = '{"items": [{"Sbd": "00123", "Thi": 8.5}]}'
+
+
+class FakeLLM:
+    def invoke(self, messages):
+        time.sleep(0.2)
+        return FakeResponse()
+
+
+def build_zip(num_images):
+    samples = sorted(glob.glob(os.path.join(BASE_DIR, 'data_ocr', '**', '*.jpg'), recursive=True))
+    zip_path = os.path.join(tempfile.mkdtemp(), f"bench_{num_images}.zip")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
+        for i in range(num_images):
+            zf.write(samples[i % len(samples)], f"scan_{i:05d}.jpg")
+    return zip_path
+
+
+def run_one(num_images):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocr.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.MEDIA_ROOT = tempfile.mkdtemp()
+    settings.OCR_LLM_BATCH_IMAGES = 1
+
+    from apps import views
+    views.get_llm = lambda *args, **kwargs: FakeLLM()
+    views.ocr_cache.get = lambda key: None
+    views.ocr_cache.set = lambda key, items: None
+
+    zip_path = build_zip(num_images)
+    zip_mb = os.path.getsize(zip_path) / 1024 / 1024
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    _, image_results = views.process_zip_file(zip_path, 'fake-key', 'transcript', f"bench-{num_images}",
+                                              max_images=num_images)
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'images': len(image_results),
+        'zip_mb': round(zip_mb, 1),
+        'seconds': round(elapsed, 2),
+        'traced_peak_mb': round(traced_peak / 1024 / 1024, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or [10, 50, 200]
+    print(f"{'images':>7} {'zip MB':>8} {'time s':>8} {'traced MB':>10} {'max RSS MB':>11}")
+    for size in sizes:
+        output = subprocess.run(
+            [sys.executable, __file__, '--one', str(size)],
+            capture_output=True, text=True, check=True, cwd=BASE_DIR
+        ).stdout.strip().splitlines()[-1]
+        row = json.loads(output)
+        print(f"{row['images']:>7} {row['zip_mb']:>8} {row['seconds']:>8} "
+              f"{row['traced_peak_mb']:>10} {row['max_rss_mb']:>11}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == '--one':
+        run_one(int(sys.argv[2]))
+    else:
+        main()
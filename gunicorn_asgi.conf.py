@@ -0,0 +1,23 @@
+# Async workers for /progress_stream/ (Server-Sent Events).
+# nginx should route that path here and keep everything else on gunicorn.conf.py.
+import multiprocessing
+
+bind = "unix:/home/dienpv/OCR_script/gunicorn_asgi.sock"
+backlog = 2048
+
+workers = max(2, multiprocessing.cpu_count() // 2)
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 3600
+keepalive = 75
+graceful_timeout = 30
+
+errorlog = "/home/dienpv/OCR_script/logs/gunicorn_asgi_error.log"
+accesslog = "/home/dienpv/OCR_script/logs/gunicorn_asgi_access.log"
+loglevel = "info"
+
+proc_name = "ocr_script_gunicorn_asgi"
+
+wsgi_app = 'ocr.asgi:application'
+
+def post_worker_init(worker):
+   worker.log.info("ASGI worker initialized (pid: %s)", worker.pid)
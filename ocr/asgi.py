@@ -0,0 +1,14 @@
+"""
+ASGI config for ocr project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Used for the progress event stream, which needs an async-capable worker.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ocr.settings')
+
+application = get_asgi_application()
@@ -98,14 +98,109 @@ SESSION_COOKIE_AGE = 7200  # 2 hours
 SESSION_SAVE_EVERY_REQUEST = True
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
-# File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
+# File upload settings (larger uploads are spooled to a temp file instead of RAM)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024   # 100MB
 
 # OCR specific settings
 OCR_SESSION_CLEANUP_HOURS = 24  # Clean up session data after 24 hours
-OCR_MAX_IMAGES_PER_SESSION = 100
-OCR_MAX_BATCH_SIZE = 15
+OCR_MAX_IMAGES_PER_SESSION = 5000  # Images processed per upload; the rest are reported as skipped
+OCR_MAX_BATCH_SIZE = 15  # Images per chunk in large-archive and fan-out mode
+
+# Large-archive mode: from this many images, rows are not kept in worker memory
+# and results/progress go to Redis once per OCR_MAX_BATCH_SIZE images
+OCR_LARGE_ARCHIVE_MIN_IMAGES = 200
+
+# OCR result cache (Redis with disk fallback)
+OCR_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'ocr')
+OCR_CACHE_TTL = 7 * 24 * 3600  # 7 days
+OCR_CACHE_MAX_ENTRIES = 10000
+
+# Generated Excel exports, one file per session and version of its rows
+OCR_EXPORT_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'exports')
+
+# Certificate names, majors and issuers checked against the Vietnamese word lists:
+# words missing from them are fixed within OCR_DICTIONARY_MAX_DISTANCE edits;
+# fixes to listed words that only the neighbouring words support are logged as
+# proposals unless OCR_DICTIONARY_CONTEXT_FIXES is set
+OCR_DICTIONARY_CORRECTION = True
+OCR_DICTIONARY_FILES = [
+    os.path.join(BASE_DIR, 'thuvien_tiengviet', 'vietnam_dictionary.txt'),
+    os.path.join(BASE_DIR, 'thuvien_tiengviet', 'vn_dictionary.txt'),
+]
+# Compiled, memory-mapped form of the word lists shared by all processes; rebuilt
+# when the lists change (`python manage.py compile_dictionary`; None: parse the lists)
+OCR_DICTIONARY_INDEX = os.path.join(BASE_DIR, 'cache', 'dictionary', 'vi_dictionary.idx')
+OCR_DICTIONARY_MAX_DISTANCE = 1
+OCR_DICTIONARY_CONTEXT_FIXES = False
+
+# Multi-image requests: images packed into one Gemini call, bounded by raw size.
+# Off (1) by default: a batched answer must attribute every row to the right
+# image, so raise this only after checking extraction accuracy on real scans.
+OCR_LLM_BATCH_IMAGES = 1
+OCR_LLM_BATCH_MAX_BYTES = 12 * 1024 * 1024  # 12MB
+
+# Adaptive (AIMD) limit on in-flight Gemini requests per worker process
+OCR_LLM_CONCURRENCY_INITIAL = 3
+OCR_LLM_CONCURRENCY_MAX = 12
+OCR_LLM_LATENCY_TARGET = 20.0  # seconds
+
+# Gemini quota per API key, enforced across all Celery workers through Redis
+OCR_RATE_LIMIT_RPM = 1000
+OCR_RATE_LIMIT_TPM = 1000000
+OCR_RATE_LIMIT_TOKENS_PER_IMAGE = 1500
+
+# Streaming pipeline: items waiting between stages and threads preparing images
+# (None: one per preprocessing process)
+OCR_PIPELINE_QUEUE_SIZE = 2
+OCR_PREPARE_WORKERS = None
+
+# Threads inflating ZIP entries ahead of the pipeline (1: read in order on one thread)
+OCR_ZIP_READ_WORKERS = 4
+
+# Image preprocessing process pool (None: one per physical core, 0: inline).
+# Only non-daemonic processes can start it: run the OCR workers with --pool threads
+# (start_celery.sh); prefork children preprocess inline.
+OCR_PREPROCESS_PROCESSES = None
+
+# OCR image normalization: long edge in px, encoded size budget, 'JPEG' or 'WEBP'
+OCR_IMAGE_LONG_EDGE = 2000
+OCR_IMAGE_BYTE_BUDGET = 1536 * 1024  # 1.5MB
+OCR_IMAGE_FORMAT = 'JPEG'
+
+# Send images as inline bytes parts instead of base64 data URIs
+OCR_INLINE_IMAGE_PARTS = True
+
+# Extraction engine: 'threads' (thread pool + adaptive limiter) or 'asyncio' (ainvoke on one event loop).
+# 'asyncio' is experimental: one request per image at a fixed concurrency, with no
+# OCR_LLM_BATCH_IMAGES batching and no llm_limiter backoff on 429s.
+OCR_EXTRACTION_ENGINE = 'threads'
+OCR_ASYNC_CONCURRENCY = 32
+OCR_ASYNC_REQUEST_DEADLINE = 60  # seconds
+
+# Fan-out mode: ZIPs with at least this many images are split into Celery
+# subtasks of OCR_MAX_BATCH_SIZE images, merged by a chord callback
+# (None: always one task). Off by default: subtasks read the ZIP from
+# MEDIA_ROOT/temp on whichever worker runs them, so enable it only when every
+# worker host mounts the same MEDIA_ROOT.
+OCR_FANOUT_MIN_IMAGES = None
+OCR_FANOUT_MAX_RETRIES = 3
+
+# Chunked resumable uploads (/upload/chunked/): bytes per PUT and largest ZIP
+OCR_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+OCR_UPLOAD_MAX_SIZE = 2 * 1024 ** 3  # 2GB
+
+# Start OCR on ZIP entries while a chunked upload of at least this size is still arriving
+OCR_STREAMING_INGEST = True
+OCR_STREAMING_MIN_SIZE = 20 * 1024 * 1024  # 20MB
+# Stream tasks of one upload queued or running at a time; entries found
+# while that many are out wait for the job's own task
+OCR_STREAM_MAX_TASKS = 4
+
+# Job scheduling: ZIPs up to this many images go to the ocr_small queue, the
+# rest to ocr_large; each user/session has at most this many jobs queued or running
+OCR_SMALL_JOB_MAX_IMAGES = 10
+OCR_MAX_ACTIVE_JOBS_PER_OWNER = 1
 
 # Logging configuration
 LOGGING = {
@@ -156,5 +251,21 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Ho_Chi_Minh'
+# Reserve one job at a time so a busy worker does not sit on queued uploads
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# OCR tasks are acknowledged late; keep unacked jobs away from other workers
+# for longer than the slowest ZIP takes, or they would run twice
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 4 * 3600}
+# Run by the beat embedded in the main worker (start_celery.sh)
+CELERY_BEAT_SCHEDULE = {
+    'purge-abandoned-uploads': {
+        'task': 'apps.tasks.purge_abandoned_uploads_task',
+        'schedule': 3600,
+    },
+    'dispatch-stranded-jobs': {
+        'task': 'apps.tasks.dispatch_stranded_jobs_task',
+        'schedule': 300,
+    },
+}
 
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', 'default_key_if_missing')
@@ -10,5 +10,17 @@ pkill -f "celery worker"
 
 sleep 2
 
-./venv/bin/celery -A ocr worker --loglevel=info --concurrency=2 --logfile=/home/dienpv/OCR_script/logs/celery.log
+# Compile the spelling dictionary once, before the workers map it
+./venv/bin/python manage.py compile_dictionary
+
+# --pool threads: tasks run in the worker's main process, which owns the image
+# preprocessing process pool (prefork children are daemonic and cannot start one)
+
+# One worker only for small uploads, so short jobs never wait behind large ones
+./venv/bin/celery -A ocr worker -n small@%h -Q ocr_small --loglevel=info --pool threads --concurrency=1 --detach \
+    --pidfile=/home/dienpv/OCR_script/logs/celery_small.pid --logfile=/home/dienpv/OCR_script/logs/celery_small.log
+
+# -B: this worker also runs the periodic tasks (CELERY_BEAT_SCHEDULE)
+./venv/bin/celery -A ocr worker -B -Q ocr_large,ocr_small,celery --loglevel=info --pool threads --concurrency=2 \
+    --schedule=/home/dienpv/OCR_script/logs/celerybeat-schedule --logfile=/home/dienpv/OCR_script/logs/celery.log
 